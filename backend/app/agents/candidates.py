@@ -0,0 +1,145 @@
+"""
+候选POI引用
+为结构化整理得到的景点、酒店、餐饮候选分配短ID（A1、H1、D1），
+规划模型只输出ID引用和少量规划字段，再由 CandidateStore 还原为完整对象，
+减少输出token并避免模型转抄名称、地址、坐标时出错。
+"""
+from typing import Any, Dict, List, Optional, Union
+
+from pydantic import BaseModel, Field
+
+from app.models.common_model import Dining
+from app.observability.logger import default_logger as logger
+
+# 各类候选的ID前缀与提示词中展示的字段
+CANDIDATE_KINDS = {
+    "attractions": ("A", ("name", "type", "rating", "ticket_price", "location")),
+    "hotels": ("H", ("name", "price", "rating", "location")),
+    "dinings": ("D", ("name", "cost_per_person", "rating", "location")),
+}
+
+
+class AttractionRef(BaseModel):
+    """规划输出中的景点引用"""
+
+    id: str
+    suggested_duration_hours: Optional[float] = None
+    description: str = ""
+
+
+class PlannedDay(BaseModel):
+    """规划输出中的单日行程（引用候选ID；天气与预算由后处理计算）"""
+
+    day: int
+    theme: str = ""
+    recommended_hotel: Optional[str] = None
+    attractions: List[AttractionRef] = Field(default_factory=list)
+    dinings: List[Union[str, Dining]] = Field(default_factory=list)
+
+
+class PlannedTrip(BaseModel):
+    """规划模型的输出结构（用于 json_schema 结构化输出）"""
+
+    trip_title: str
+    hotels: List[str] = Field(default_factory=list)
+    days: List[PlannedDay]
+
+
+def _compact(item: Dict[str, Any], fields: tuple) -> Dict[str, Any]:
+    view = {}
+    for field in fields:
+        value = item.get(field)
+        if value in (None, "", [], {}):
+            continue
+        if field == "location" and isinstance(value, dict):
+            try:
+                value = {"lat": round(float(value["lat"]), 5), "lng": round(float(value["lng"]), 5)}
+            except (KeyError, TypeError, ValueError):
+                continue
+        view[field] = value
+    return view
+
+
+def _clean(item: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉空值，让模型字段使用默认值；坐标不完整时置空"""
+    cleaned = {key: value for key, value in item.items() if value is not None and key != "id"}
+    location = cleaned.get("location")
+    if location is not None and not (
+        isinstance(location, dict) and location.get("lat") is not None and location.get("lng") is not None
+    ):
+        cleaned.pop("location")
+    return cleaned
+
+
+class CandidateStore:
+    """单次规划中的候选POI，按短ID索引"""
+
+    def __init__(self):
+        self._items: Dict[str, Dict[str, Dict[str, Any]]] = {kind: {} for kind in CANDIDATE_KINDS}
+        self.unknown_refs: List[str] = []
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "CandidateStore":
+        """从结构化协作数据构建，按出现顺序分配ID，同名候选只保留第一个"""
+        store = cls()
+        for kind, (prefix, _) in CANDIDATE_KINDS.items():
+            seen = set()
+            for item in (payload.get(kind) or {}).get("items") or []:
+                if not isinstance(item, dict) or not item.get("name") or item["name"] in seen:
+                    continue
+                seen.add(item["name"])
+                store._items[kind][f"{prefix}{len(store._items[kind]) + 1}"] = item
+        return store
+
+    def has(self, kind: str) -> bool:
+        return bool(self._items[kind])
+
+    def prompt_section(self, kind: str, section: Dict[str, Any]) -> Dict[str, Any]:
+        """生成提示词中的候选列表：保留摘要与警告，条目替换为带ID的精简视图"""
+        _, fields = CANDIDATE_KINDS[kind]
+        view = {key: value for key, value in (section or {}).items() if key != "items"}
+        view["items"] = [dict(id=candidate_id, **_compact(item, fields)) for candidate_id, item in self._items[kind].items()]
+        return view
+
+    def _resolve(self, kind: str, ref: Any) -> Optional[Dict[str, Any]]:
+        """ID引用还原为完整对象；未带ID的完整对象原样保留；未知ID返回None"""
+        if isinstance(ref, dict) and "id" not in ref:
+            return ref
+        candidate_id = ref.get("id") if isinstance(ref, dict) else ref
+        if not isinstance(candidate_id, str):
+            return None
+        item = self._items[kind].get(candidate_id.strip().upper())
+        if item is None:
+            self.unknown_refs.append(candidate_id)
+            return None
+        resolved = _clean(item)
+        if isinstance(ref, dict):
+            # 模型补充的规划字段（建议时长、游览建议）覆盖候选中的空值
+            resolved.update({key: value for key, value in ref.items() if key != "id" and value not in (None, "")})
+        return resolved
+
+    def _resolve_list(self, kind: str, refs: Any) -> List[Dict[str, Any]]:
+        resolved = [self._resolve(kind, ref) for ref in refs if ref is not None] if isinstance(refs, list) else []
+        return [item for item in resolved if item is not None]
+
+    def hydrate_day(self, raw_day: Any) -> Any:
+        """还原单日行程中的景点、酒店、餐饮引用"""
+        if not isinstance(raw_day, dict):
+            return raw_day
+        day = dict(raw_day)
+        day["attractions"] = self._resolve_list("attractions", day.get("attractions"))
+        day["dinings"] = self._resolve_list("dinings", day.get("dinings"))
+        if day.get("recommended_hotel") is not None:
+            day["recommended_hotel"] = self._resolve("hotels", day["recommended_hotel"])
+        return day
+
+    def hydrate_hotels(self, refs: Any) -> List[Dict[str, Any]]:
+        return self._resolve_list("hotels", refs)
+
+    def log_unknown_refs(self) -> None:
+        if self.unknown_refs:
+            logger.warning(
+                "Planner referenced unknown candidate ids",
+                extra={"unknown_ids": sorted(set(self.unknown_refs))},
+            )
+            self.unknown_refs = []
@@ -0,0 +1,216 @@
+"""
+降级行程规划
+LLM 熔断（所有端点均不可用）时不再等待模型超时，直接用本地逻辑生成基础行程：
+- 景点：目的地缓存中的结构化景点，不足时直接调用高德文本搜索
+- 分天：按景点坐标聚类（每天一簇，簇大小均衡），簇内按最近邻顺序游览
+- 酒店：HotelRanker 本地排序，每天推荐距当天景点最近的酒店
+- 标题与主题：模板生成
+天气、酒店距离和预算沿用 postprocess_plan 的本地计算，生成的行程标记为 degraded。
+"""
+import math
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pydantic import ValidationError
+
+from app.agents.hotel_ranker import parse_location
+from app.agents.plan_parser import loads_tolerant
+from app.agents.plan_postprocess import haversine_matrix
+from app.models.common_model import Attraction, Hotel
+from app.models.trip_model import BudgetBreakdown, DailyPlan, TripPlanRequest, TripPlanResponse
+from app.observability.logger import default_logger as logger
+
+# 降级行程中景点的默认建议游玩时长（小时）
+DEFAULT_DURATION_HOURS = 2.0
+
+# k-means 迭代次数上限
+CLUSTER_ITERATIONS = 10
+
+
+def parse_amap_weather(raw: Any) -> List[Dict[str, Any]]:
+    """
+    解析高德天气查询结果为 Weather 字段结构
+
+    Args:
+        raw: maps_weather 工具返回的文本（可带 "工具 'xxx' 执行结果:" 前缀）或已解析的对象
+    """
+    data = raw
+    if isinstance(raw, str):
+        try:
+            data = loads_tolerant(raw)
+        except ValueError:
+            return []
+    forecasts = data.get("forecasts") if isinstance(data, dict) else data
+    # 高德 Web API 返回 [{"casts": [...]}]，MCP 服务器直接返回 forecasts 列表
+    if isinstance(forecasts, list) and forecasts and isinstance(forecasts[0], dict) and "casts" in forecasts[0]:
+        forecasts = forecasts[0]["casts"]
+    if not isinstance(forecasts, list):
+        return []
+
+    parsed = []
+    for cast in forecasts:
+        if not isinstance(cast, dict) or not cast.get("date"):
+            continue
+        parsed.append({
+            "date": str(cast["date"])[:10],
+            "day_weather": str(cast.get("dayweather") or cast.get("day_weather") or ""),
+            "night_weather": str(cast.get("nightweather") or cast.get("night_weather") or ""),
+            "day_temp": str(cast.get("daytemp") or cast.get("day_temp") or ""),
+            "night_temp": str(cast.get("nighttemp") or cast.get("night_temp") or ""),
+            "day_wind": " ".join(str(cast[key]) for key in ("daywind", "daypower") if cast.get(key)) or None,
+            "night_wind": " ".join(str(cast[key]) for key in ("nightwind", "nightpower") if cast.get(key)) or None,
+        })
+    return parsed
+
+
+def _to_attraction(item: Dict[str, Any]) -> Optional[Attraction]:
+    data = {key: value for key, value in item.items() if value is not None and key != "id"}
+    location = parse_location(data.pop("location", None))
+    if location is not None:
+        data["location"] = location
+    data.setdefault("suggested_duration_hours", DEFAULT_DURATION_HOURS)
+    try:
+        return Attraction.model_validate(data)
+    except ValidationError:
+        return None
+
+
+def _nearest_neighbor_order(attractions: List[Attraction]) -> List[Attraction]:
+    """从第一个景点出发，每次前往最近的未游览景点"""
+    if len(attractions) < 3:
+        return attractions
+    coordinates = np.array([[item.location.lat, item.location.lng] for item in attractions], dtype=float)
+    distances = haversine_matrix(coordinates, coordinates)
+    order, remaining = [0], set(range(1, len(attractions)))
+    while remaining:
+        current = order[-1]
+        following = min(remaining, key=lambda position: distances[current, position])
+        order.append(following)
+        remaining.remove(following)
+    return [attractions[position] for position in order]
+
+
+def cluster_attractions(attractions: List[Attraction], day_count: int) -> List[List[Attraction]]:
+    """
+    按坐标把景点分成 day_count 组
+
+    先用最远点初始化的 k-means 求出各天中心，再按距离从近到远分配，
+    每组不超过 ceil(n / day_count) 个以保持各天景点数均衡；没有坐标的景点补到景点最少的一天。
+    """
+    groups: List[List[Attraction]] = [[] for _ in range(day_count)]
+    located = [item for item in attractions if item.location]
+    unlocated = [item for item in attractions if not item.location]
+
+    if len(located) <= day_count:
+        for position, item in enumerate(located):
+            groups[position].append(item)
+    else:
+        coordinates = np.array([[item.location.lat, item.location.lng] for item in located], dtype=float)
+        centers = [coordinates[0]]
+        for _ in range(1, day_count):
+            nearest = haversine_matrix(coordinates, np.array(centers)).min(axis=1)
+            centers.append(coordinates[int(nearest.argmax())])
+        centers = np.array(centers)
+        for _ in range(CLUSTER_ITERATIONS):
+            labels = haversine_matrix(coordinates, centers).argmin(axis=1)
+            updated = np.array([
+                coordinates[labels == cluster].mean(axis=0) if np.any(labels == cluster) else centers[cluster]
+                for cluster in range(day_count)
+            ])
+            if np.allclose(updated, centers):
+                break
+            centers = updated
+
+        capacity = math.ceil(len(located) / day_count)
+        distances = haversine_matrix(coordinates, centers)
+        assigned = set()
+        for flat in np.argsort(distances, axis=None):
+            position, cluster = divmod(int(flat), day_count)
+            if position in assigned or len(groups[cluster]) >= capacity:
+                continue
+            groups[cluster].append(located[position])
+            assigned.add(position)
+        groups = [_nearest_neighbor_order(group) for group in groups]
+
+    for item in unlocated:
+        min(groups, key=len).append(item)
+    return groups
+
+
+def _nearest_hotel(hotels: List[Hotel], attractions: List[Attraction]) -> Optional[Hotel]:
+    located_hotels = [hotel for hotel in hotels if hotel.location]
+    targets = [[item.location.lat, item.location.lng] for item in attractions if item.location]
+    if not located_hotels or not targets:
+        return hotels[0].model_copy() if hotels else None
+    distances = haversine_matrix(
+        np.array([[hotel.location.lat, hotel.location.lng] for hotel in located_hotels]),
+        np.array(targets),
+    ).mean(axis=1)
+    # 复制一份，避免后处理计算每天的酒店距离时相互覆盖
+    return located_hotels[int(distances.argmin())].model_copy()
+
+
+def _day_theme(attractions: List[Attraction]) -> str:
+    if not attractions:
+        return "自由活动"
+    names = "、".join(item.name for item in attractions[:2])
+    return f"{names}一带游览" if len(attractions) <= 2 else f"{names}等{len(attractions)}处景点游览"
+
+
+def build_degraded_plan(
+    request: TripPlanRequest,
+    attraction_items: List[Dict[str, Any]],
+    hotels: List[Hotel],
+    attractions_per_day: int = 3,
+) -> Optional[TripPlanResponse]:
+    """
+    不经过LLM生成基础行程（天气、距离和预算由调用方通过 postprocess_plan 填充）
+
+    Args:
+        request: 行程规划请求
+        attraction_items: 结构化景点（目的地缓存或高德搜索结果）
+        hotels: 本地排序后的酒店
+        attractions_per_day: 每天最多安排的景点数
+
+    Returns:
+        行程，没有可用景点时返回None
+    """
+    start = datetime.strptime(request.start_date, "%Y-%m-%d")
+    end = datetime.strptime(request.end_date, "%Y-%m-%d")
+    day_count = max(1, (end - start).days + 1)
+
+    attractions: List[Attraction] = []
+    seen = set()
+    for item in attraction_items or []:
+        if not isinstance(item, dict) or item.get("name") in seen:
+            continue
+        attraction = _to_attraction(item)
+        if attraction is not None:
+            seen.add(attraction.name)
+            attractions.append(attraction)
+        if len(attractions) >= day_count * attractions_per_day:
+            break
+    if not attractions:
+        return None
+
+    days = []
+    for day_number, group in enumerate(cluster_attractions(attractions, day_count), start=1):
+        days.append(DailyPlan(
+            day=day_number,
+            theme=_day_theme(group),
+            recommended_hotel=_nearest_hotel(hotels, group),
+            attractions=group,
+        ))
+
+    logger.debug(
+        "Degraded plan built",
+        extra={"days": day_count, "attractions": len(attractions), "hotels": len(hotels)},
+    )
+    return TripPlanResponse(
+        trip_title=f"{request.destination}{day_count}日游（简化行程）",
+        total_budget=BudgetBreakdown(),
+        hotels=hotels,
+        days=days,
+        degraded=True,
+    )
@@ -36,7 +36,8 @@ class EnhancedAgent(SimpleAgent):
         context_manager: Optional[ContextManager] = None,
         communication_hub: Optional[AgentCommunicationHub] = None,
         user_id: Optional[str] = None,
-        memory_service: Optional[VectorMemoryService] = None
+        memory_service: Optional[VectorMemoryService] = None,
+        stage_name: Optional[str] = None
     ):
         """
         初始化增强智能体
@@ -52,6 +53,7 @@ class EnhancedAgent(SimpleAgent):
             communication_hub: 通信中心
             user_id: 用户ID（用于记忆检索）
             memory_service: 向量记忆服务实例
+            stage_name: 调用阶段名称（用于按阶段选择模型，见 LLM_STAGE_MODELS）
         """
         super().__init__(name, llm, system_prompt, config)
         self.tool_registry = tool_registry
@@ -60,6 +62,8 @@ class EnhancedAgent(SimpleAgent):
         self.communication_hub = communication_hub
         self.user_id = user_id
         self.memory_service = memory_service or VectorMemoryService()
+        self.stage_name = stage_name
+        self._static_system_prompt: Optional[str] = None
         
         # 注册到通信中心
         if self.communication_hub:
@@ -78,8 +82,16 @@ class EnhancedAgent(SimpleAgent):
         
         logger.info(f"✅ {name} 增强智能体初始化完成，工具调用: {'启用' if self.enable_tool_calling else '禁用'}")
     
-    def _get_enhanced_system_prompt(self) -> str:
-        """构建增强的系统提示词，包含工具信息和记忆上下文"""
+    def _get_static_system_prompt(self) -> str:
+        """
+        构建系统提示词：角色说明与工具说明
+
+        只包含不随请求变化的内容，保证每次调用的前缀逐字节一致，
+        以便命中服务端（OpenAI 兼容接口、vLLM）的前缀缓存
+        """
+        if self._static_system_prompt is not None:
+            return self._static_system_prompt
+
         base_prompt = self.system_prompt or "你是一个有用的AI助手。"
         
         # 添加工具信息
@@ -95,7 +107,14 @@ class EnhancedAgent(SimpleAgent):
                 tools_section += "例如：`[TOOL_CALL:search:Python编程]` 或 `[TOOL_CALL:memory:recall=用户信息]`\n\n"
                 tools_section += "工具调用结果会自动插入到对话中，然后你可以基于结果继续回答。\n"
                 base_prompt += tools_section
-        
+
+        self._static_system_prompt = base_prompt
+        return base_prompt
+
+    def _get_request_context(self) -> str:
+        """构建本次请求相关的记忆与共享上下文（随请求变化，放在消息末尾）"""
+        sections = []
+
         # 添加记忆上下文（性能优化：只在context_manager中没有记忆时才检索）
         if self.user_id:
             # 优先从context_manager获取已检索的记忆
@@ -122,22 +141,29 @@ class EnhancedAgent(SimpleAgent):
                 logger.debug(f"{self.name} context_manager中没有记忆，执行向量检索")
             
             if memory_context:
-                memory_section = "\n\n## 相关记忆信息\n"
+                memory_section = "## 相关记忆信息\n"
                 memory_section += "以下是与当前任务相关的历史信息，你可以参考这些信息来更好地完成任务：\n"
                 memory_section += memory_context + "\n"
-                base_prompt += memory_section
+                sections.append(memory_section)
         
-        # 添加上下文信息
+        # 添加上下文信息（按键排序，相同数据生成相同文本）
         if self.context_manager:
             shared_data = self.context_manager.get_all_shared_data()
             if shared_data:
-                context_section = "\n\n## 共享上下文信息\n"
+                context_section = "## 共享上下文信息\n"
                 context_section += "以下是从其他智能体共享的信息：\n"
-                for key, value in shared_data.items():
-                    context_section += f"- {key}: {str(value)[:200]}\n"
-                base_prompt += context_section
+                for key in sorted(shared_data):
+                    context_section += f"- {key}: {str(shared_data[key])[:200]}\n"
+                sections.append(context_section)
         
-        return base_prompt
+        return "\n".join(sections)
+
+    def _build_user_content(self, input_text: str) -> str:
+        """当前用户消息：任务在前，本次请求的记忆与共享上下文附在末尾"""
+        request_context = self._get_request_context()
+        if not request_context:
+            return input_text
+        return f"{input_text}\n\n{request_context}"
     
     def _get_memory_context(self) -> str:
         """获取记忆上下文（使用向量记忆服务）"""
@@ -201,19 +227,21 @@ class EnhancedAgent(SimpleAgent):
         # 构建消息列表
         messages = []
         
-        # 添加增强的系统消息
-        enhanced_system_prompt = self._get_enhanced_system_prompt()
-        messages.append({"role": "system", "content": enhanced_system_prompt})
+        # 消息顺序按稳定程度排列：固定的系统提示词 -> 历史消息 -> 当前任务与本次请求的上下文，
+        # 随请求变化的内容都在末尾，前面的部分可以命中服务端前缀缓存
+        messages.append({"role": "system", "content": self._get_static_system_prompt()})
         
         # 添加历史消息
         for msg in self._history:
             messages.append({"role": msg.role, "content": msg.content})
         
         # 添加当前用户消息
-        messages.append({"role": "user", "content": input_text})
+        messages.append({"role": "user", "content": self._build_user_content(input_text)})
 
         if self.context_manager and "usage_key" not in kwargs:
             kwargs["usage_key"] = self.context_manager.request_id
+        if self.stage_name and "stage" not in kwargs:
+            kwargs["stage"] = self.stage_name
         
         # 如果没有启用工具调用，使用简单对话逻辑
         if not self.enable_tool_calling:
@@ -482,6 +510,7 @@ class EnhancedAgent(SimpleAgent):
             self.tool_registry = ToolRegistry()
             self.enable_tool_calling = True
         self.tool_registry.register_tool(tool)
+        self._static_system_prompt = None
         logger.debug(f"🔧 工具 '{tool.name}' 已添加到 {self.name}")
     
     def has_tools(self) -> bool:
@@ -0,0 +1,213 @@
+"""
+本地酒店排序
+直接使用高德文本搜索的酒店结果在本地打分排序，替代酒店智能体的工具调用与结构化整理两次LLM调用：
+- 距离：酒店到景点中心点（结构化景点坐标的均值）的球面距离
+- 价格：酒店价格与预算档位的每晚参考价的接近程度
+- 评分：高德评分
+- 偏好：酒店偏好关键词在名称、类型、地址中的命中情况
+"""
+import math
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pydantic import ValidationError
+
+from app.agents.plan_parser import loads_tolerant
+from app.agents.plan_postprocess import budget_profile, haversine_matrix, parse_price
+from app.models.common_model import Hotel, Location
+from app.observability.logger import default_logger as logger
+
+# 各维度权重（缺少某一维度的数据时该维度一般取中性分 0.5）
+SCORE_WEIGHTS = {"distance": 0.4, "price": 0.3, "rating": 0.2, "preference": 0.1}
+
+# 距离得分在该距离（公里）处衰减为约 0.37
+DISTANCE_SCALE_KM = 5.0
+
+# 价格为参考价的 1/4 或 4 倍时价格得分降为0
+PRICE_TOLERANCE_RATIO = 4.0
+
+NEUTRAL_SCORE = 0.5
+
+
+def parse_location(value: Any) -> Optional[Location]:
+    """解析高德坐标（"lng,lat" 字符串）、{"lat", "lng"} 对象或 Location"""
+    if isinstance(value, Location):
+        return value
+    try:
+        if isinstance(value, str) and "," in value:
+            lng, lat = value.split(",", 1)
+            return Location(lat=float(lat), lng=float(lng))
+        if isinstance(value, dict):
+            return Location(lat=float(value["lat"]), lng=float(value["lng"]))
+    except (KeyError, TypeError, ValueError):
+        pass
+    return None
+
+
+def _first_present(*values: Any) -> Any:
+    for value in values:
+        if value not in (None, "", [], {}):
+            return value
+    return None
+
+
+def parse_amap_pois(raw: Any) -> List[Dict[str, Any]]:
+    """
+    从高德文本搜索结果中解析POI候选（酒店、景点）
+
+    Args:
+        raw: 工具返回的文本（可带 "工具 'xxx' 执行结果:" 前缀）或已解析的对象
+
+    Returns:
+        候选列表，每项包含 name / address / location / price / rating / type
+    """
+    data = raw
+    if isinstance(raw, str):
+        try:
+            data = loads_tolerant(raw)
+        except ValueError:
+            return []
+    pois = data.get("pois") if isinstance(data, dict) else data
+    if not isinstance(pois, list):
+        return []
+
+    candidates = []
+    seen = set()
+    for poi in pois:
+        if not isinstance(poi, dict) or not poi.get("name") or poi["name"] in seen:
+            continue
+        seen.add(poi["name"])
+        biz_ext = poi.get("biz_ext") if isinstance(poi.get("biz_ext"), dict) else {}
+        candidates.append({
+            "name": poi["name"],
+            "address": poi.get("address") if isinstance(poi.get("address"), str) else "",
+            "location": parse_location(poi.get("location")),
+            "price": _first_present(poi.get("price"), biz_ext.get("lowest_price"), biz_ext.get("cost")),
+            "rating": _first_present(poi.get("rating"), biz_ext.get("rating")),
+            "type": poi.get("type") if isinstance(poi.get("type"), str) else "",
+        })
+    return candidates
+
+
+class HotelRanker:
+    """按距离、价格档位、评分与偏好关键词为酒店候选打分"""
+
+    def __init__(self, top_n: int = 5, weights: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            top_n: 返回的酒店数量
+            weights: 各维度权重，默认 SCORE_WEIGHTS
+        """
+        self.top_n = top_n
+        self.weights = weights or SCORE_WEIGHTS
+
+    @staticmethod
+    def attraction_centroid(attractions: List[Dict[str, Any]]) -> Optional[Location]:
+        """结构化景点坐标的中心点，没有可用坐标时返回None"""
+        locations = [parse_location(item.get("location")) for item in attractions or [] if isinstance(item, dict)]
+        coordinates = [[location.lat, location.lng] for location in locations if location]
+        if not coordinates:
+            return None
+        lat, lng = np.asarray(coordinates, dtype=float).mean(axis=0)
+        return Location(lat=float(lat), lng=float(lng))
+
+    @staticmethod
+    def _distance_score(distance: Optional[float], has_centroid: bool) -> float:
+        if distance is not None:
+            return math.exp(-distance / DISTANCE_SCALE_KM)
+        # 有景点中心但酒店缺少坐标时无法确认远近，不给距离分
+        return 0.0 if has_centroid else NEUTRAL_SCORE
+
+    @staticmethod
+    def _price_score(price: Optional[float], target: float) -> float:
+        if not price:
+            return NEUTRAL_SCORE
+        return max(0.0, 1.0 - abs(math.log(price / target)) / math.log(PRICE_TOLERANCE_RATIO))
+
+    @staticmethod
+    def _rating_score(rating: Any) -> float:
+        value = parse_price(rating)
+        if value is None or value <= 0:
+            return NEUTRAL_SCORE
+        return min(value, 5.0) / 5.0
+
+    @staticmethod
+    def _preference_score(candidate: Dict[str, Any], preferences: List[str]) -> float:
+        keywords = [keyword.strip() for keyword in preferences or [] if keyword and keyword.strip()]
+        if not keywords:
+            return NEUTRAL_SCORE
+        text = " ".join(str(candidate.get(field) or "") for field in ("name", "type", "address"))
+        return sum(1 for keyword in keywords if keyword in text) / len(keywords)
+
+    def rank(
+        self,
+        candidates: List[Dict[str, Any]],
+        attractions: List[Dict[str, Any]],
+        budget: Optional[str],
+        preferences: Optional[List[str]] = None,
+    ) -> List[Hotel]:
+        """
+        对酒店候选打分并返回得分最高的 top_n 个
+
+        Args:
+            candidates: parse_amap_pois 解析出的候选
+            attractions: 结构化景点列表（用于计算中心点）
+            budget: 预算档位
+            preferences: 酒店偏好关键词
+        """
+        if not candidates:
+            return []
+
+        centroid = self.attraction_centroid(attractions)
+        distances: List[Optional[float]] = [None] * len(candidates)
+        located = [position for position, candidate in enumerate(candidates) if candidate.get("location")]
+        if centroid and located:
+            matrix = haversine_matrix(
+                np.array([[candidates[position]["location"].lat, candidates[position]["location"].lng] for position in located]),
+                np.array([[centroid.lat, centroid.lng]]),
+            )
+            for position, distance in zip(located, matrix[:, 0]):
+                distances[position] = float(distance)
+
+        target_price = budget_profile(budget)["hotel_per_night"]
+        scored = []
+        for candidate, distance in zip(candidates, distances):
+            scores = {
+                "distance": self._distance_score(distance, has_centroid=centroid is not None),
+                "price": self._price_score(parse_price(candidate.get("price")), target_price),
+                "rating": self._rating_score(candidate.get("rating")),
+                "preference": self._preference_score(candidate, preferences or []),
+            }
+            total = sum(self.weights.get(name, 0.0) * value for name, value in scores.items())
+            scored.append((total, distance, candidate))
+
+        scored.sort(key=lambda entry: entry[0], reverse=True)
+        hotels = []
+        for _, distance, candidate in scored:
+            try:
+                hotels.append(Hotel(
+                    name=candidate["name"],
+                    address=candidate.get("address") or "",
+                    location=candidate.get("location"),
+                    price=candidate.get("price") or "N/A",
+                    rating=candidate.get("rating") or "N/A",
+                    distance_to_main_attraction_km=None if distance is None else round(distance, 2),
+                ))
+            except ValidationError:
+                continue
+            if len(hotels) >= self.top_n:
+                break
+
+        logger.debug(
+            "Hotels ranked locally",
+            extra={"candidates": len(candidates), "selected": len(hotels), "has_centroid": centroid is not None},
+        )
+        return hotels
+
+    def to_section(self, hotels: List[Hotel], candidate_count: int) -> Dict[str, Any]:
+        """转换为与结构化整理结果相同的 {"summary", "warnings", "items"} 结构"""
+        return {
+            "summary": f"按距景点中心、价格档位、评分和偏好从{candidate_count}家候选酒店中选出{len(hotels)}家",
+            "warnings": [],
+            "items": [hotel.model_dump(exclude_none=True) for hotel in hotels],
+        }
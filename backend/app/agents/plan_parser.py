@@ -0,0 +1,269 @@
+"""
+行程JSON容错解析
+- 去除 Markdown 代码块和 JSON 前后的多余文本
+- 修复常见缺陷：尾随逗号、被截断的字符串与括号、末尾不完整的键值
+- 按天独立校验（校验前将候选ID引用还原为完整对象），返回可用的天与需要重新生成的天
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from pydantic import ValidationError
+
+from app.agents.candidates import CandidateStore
+from app.models.common_model import Hotel
+from app.models.trip_model import BudgetBreakdown, DailyPlan, TripPlanResponse
+
+
+def extract_json_text(text: str) -> str:
+    """去掉代码块标记，截取第一个 '{' 或 '[' 开始的内容"""
+    text = (text or "").strip()
+    if "```" in text:
+        fenced = text.split("```", 1)[1]
+        # 去掉语言标记（如 ```json）
+        if "\n" in fenced:
+            first_line, rest = fenced.split("\n", 1)
+            if first_line.strip().isalpha() or not first_line.strip():
+                fenced = rest
+        # 截断的输出可能没有结束标记
+        text = fenced.split("```", 1)[0].strip()
+
+    starts = [position for position in (text.find("{"), text.find("[")) if position >= 0]
+    return text[min(starts):] if starts else text
+
+
+def repair_json(text: str) -> str:
+    """
+    修复常见的JSON缺陷
+
+    逐字符扫描并跟踪字符串与括号栈：删除 } 或 ] 前的尾随逗号，
+    在文本被截断时补全未闭合的字符串，丢弃末尾不完整的键值，再按栈顺序补全括号。
+    """
+    output: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+
+    for char in text:
+        if in_string:
+            output.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            # 删除尾随逗号
+            while output and output[-1].isspace():
+                output.pop()
+            if output and output[-1] == ",":
+                output.pop()
+            if stack and stack[-1] == char:
+                stack.pop()
+            else:
+                # 多余的闭合括号直接忽略
+                continue
+        output.append(char)
+
+        if not stack and char in "}]":
+            # 顶层对象已完整，忽略其后的文本
+            break
+
+    if in_string:
+        if escaped:
+            output.pop()
+        output.append('"')
+
+    repaired = "".join(output).rstrip()
+    if stack:
+        repaired = _drop_incomplete_tail(repaired)
+        repaired += "".join(reversed(stack))
+    return repaired
+
+
+def _drop_incomplete_tail(text: str) -> str:
+    """截断发生在键值中间时，去掉末尾不完整的部分（悬空的逗号、冒号或孤立的键）"""
+    text = text.rstrip()
+    if text.endswith(","):
+        return text[:-1]
+    if text.endswith(":"):
+        return text + " null"
+    if text.endswith('"'):
+        # 可能是对象中没有值的孤立键：{"a": 1, "b"
+        key_start = _string_start(text)
+        if key_start is not None:
+            before = text[:key_start].rstrip()
+            if before.endswith(",") and _inside_object(before):
+                return before[:-1]
+            if before.endswith("{"):
+                return before
+    return text
+
+
+def _string_start(text: str) -> Optional[int]:
+    """返回末尾字符串字面量的起始引号位置"""
+    position = len(text) - 2
+    while position >= 0:
+        if text[position] == '"':
+            backslashes = 0
+            cursor = position - 1
+            while cursor >= 0 and text[cursor] == "\\":
+                backslashes += 1
+                cursor -= 1
+            if backslashes % 2 == 0:
+                return position
+        position -= 1
+    return None
+
+
+def _open_brackets(text: str) -> List[str]:
+    """返回文本末尾仍未闭合的括号栈"""
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]" and stack:
+            stack.pop()
+    return stack
+
+
+def _inside_object(text: str) -> bool:
+    """判断文本末尾是否位于对象（而非数组）内部"""
+    stack = _open_brackets(text)
+    return bool(stack) and stack[-1] == "{"
+
+
+def loads_tolerant(text: str) -> Any:
+    """先按标准JSON解析，失败后修复再解析，仍失败时抛出 ValueError"""
+    candidate = extract_json_text(text)
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(repair_json(candidate))
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"无法修复的JSON: {exc}") from exc
+
+
+class PlanParseResult:
+    """按天校验后的结果"""
+
+    def __init__(self):
+        self.trip_title: str = ""
+        self.total_budget: BudgetBreakdown = BudgetBreakdown()
+        self.hotels: List[Hotel] = []
+        self.days: Dict[int, DailyPlan] = {}
+        self.failed_days: Dict[int, str] = {}
+
+    def merge_days(self, days: Dict[int, DailyPlan]) -> None:
+        for day_number, day in days.items():
+            self.days[day_number] = day
+            self.failed_days.pop(day_number, None)
+
+    def to_response(self) -> TripPlanResponse:
+        return TripPlanResponse(
+            trip_title=self.trip_title,
+            total_budget=self.total_budget,
+            hotels=self.hotels,
+            days=[self.days[day_number] for day_number in sorted(self.days)],
+        )
+
+
+def validate_days(
+    raw_days: Any,
+    expected_days: int,
+    store: Optional[CandidateStore] = None,
+) -> tuple[Dict[int, DailyPlan], Dict[int, str]]:
+    """逐天校验，返回 (有效的天, 失败或缺失的天 -> 原因)；传入 store 时先还原候选ID引用"""
+    valid: Dict[int, DailyPlan] = {}
+    failed: Dict[int, str] = {}
+    for position, raw_day in enumerate(raw_days if isinstance(raw_days, list) else []):
+        day_number = raw_day.get("day") if isinstance(raw_day, dict) else None
+        if not isinstance(day_number, int) or not 1 <= day_number <= expected_days:
+            day_number = position + 1
+        if day_number > expected_days or day_number in valid:
+            continue
+        try:
+            if store is not None:
+                raw_day = store.hydrate_day(raw_day)
+            day = DailyPlan.model_validate(dict(raw_day, day=day_number))
+        except (ValidationError, TypeError, ValueError) as exc:
+            failed[day_number] = str(exc)[:300]
+            continue
+        valid[day_number] = day
+        failed.pop(day_number, None)
+
+    for day_number in range(1, expected_days + 1):
+        if day_number not in valid and day_number not in failed:
+            failed[day_number] = "missing"
+    return valid, failed
+
+
+def parse_plan(text: str, expected_days: int, store: Optional[CandidateStore] = None) -> PlanParseResult:
+    """
+    容错解析最终行程
+
+    Args:
+        text: 模型输出
+        expected_days: 行程天数
+        store: 候选POI，用于还原模型输出中的ID引用
+
+    Raises:
+        ValueError: 输出无法修复为JSON对象
+    """
+    candidate = extract_json_text(text)
+    truncated = False
+    try:
+        data = json.loads(candidate)
+    except json.JSONDecodeError:
+        data = loads_tolerant(candidate)
+        truncated = bool(_open_brackets(candidate))
+    if not isinstance(data, dict):
+        raise ValueError("行程JSON的顶层不是对象")
+
+    result = PlanParseResult()
+    result.trip_title = str(data.get("trip_title") or "")
+    try:
+        result.total_budget = BudgetBreakdown.model_validate(data.get("total_budget") or {})
+    except ValidationError:
+        result.total_budget = BudgetBreakdown()
+
+    raw_hotels = data.get("hotels") or []
+    if store is not None:
+        raw_hotels = store.hydrate_hotels(raw_hotels)
+    for raw_hotel in raw_hotels:
+        try:
+            result.hotels.append(Hotel.model_validate(raw_hotel))
+        except (ValidationError, TypeError):
+            continue
+
+    raw_days = data.get("days")
+    result.days, result.failed_days = validate_days(raw_days, expected_days, store)
+
+    # 输出被截断时，最后一天即使能通过校验也很可能缺少内容，同样需要重新生成
+    if truncated and isinstance(raw_days, list) and raw_days:
+        last_day = raw_days[-1]
+        day_number = last_day.get("day") if isinstance(last_day, dict) else None
+        if not isinstance(day_number, int) or not 1 <= day_number <= expected_days:
+            day_number = min(len(raw_days), expected_days)
+        result.days.pop(day_number, None)
+        result.failed_days[day_number] = "truncated"
+    return result
@@ -0,0 +1,194 @@
+"""
+行程确定性后处理
+在 _validate_and_filter_plan 之后本地计算原先由模型生成的字段：
+- 每天的天气：按日期把天气预报映射到第N天
+- 酒店距离：向量化计算酒店到景点的球面距离
+- 预算：门票、餐饮、酒店按候选价格求和，交通按当天路线距离估算，再汇总为总预算
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pydantic import ValidationError
+
+from app.models.common_model import Hotel, Location, Weather
+from app.models.trip_model import BudgetBreakdown, DailyBudget, DailyPlan, TripPlanRequest, TripPlanResponse
+from app.observability.logger import default_logger as logger
+
+EARTH_RADIUS_KM = 6371.0
+
+# 各预算档位在缺少价格信息时使用的默认值（元）与交通估算参数
+BUDGET_PROFILES = {
+    "经济": {"hotel_per_night": 200.0, "meal_per_person": 40.0, "transport_per_km": 1.0, "transport_min": 10.0},
+    "中等": {"hotel_per_night": 400.0, "meal_per_person": 80.0, "transport_per_km": 2.0, "transport_min": 20.0},
+    "宽裕": {"hotel_per_night": 700.0, "meal_per_person": 150.0, "transport_per_km": 3.0, "transport_min": 40.0},
+    "豪华": {"hotel_per_night": 1500.0, "meal_per_person": 300.0, "transport_per_km": 4.0, "transport_min": 80.0},
+}
+BUDGET_ALIASES = {"low": "经济", "medium": "中等", "high": "宽裕", "luxury": "豪华"}
+
+# 没有餐饮安排时按每天两餐估算
+DEFAULT_MEALS_PER_DAY = 2
+
+_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+
+def budget_profile(level: Optional[str]) -> Dict[str, float]:
+    level = (level or "").strip()
+    return BUDGET_PROFILES.get(BUDGET_ALIASES.get(level.lower(), level), BUDGET_PROFILES["中等"])
+
+
+def parse_price(value: Any) -> Optional[float]:
+    """解析价格字段（如 60、"400元/晚"、"免费"），无法识别时返回None"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    if "免费" in value or value.strip().lower() == "free":
+        return 0.0
+    match = _NUMBER_PATTERN.search(value.replace(",", ""))
+    return float(match.group()) if match else None
+
+
+def haversine_matrix(origins: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    计算两组坐标两两之间的球面距离（公里）
+
+    Args:
+        origins: 形状为 (M, 2) 的 [lat, lng] 数组
+        targets: 形状为 (N, 2) 的 [lat, lng] 数组
+
+    Returns:
+        形状为 (M, N) 的距离矩阵
+    """
+    origins = np.radians(np.asarray(origins, dtype=float)).reshape(-1, 1, 2)
+    targets = np.radians(np.asarray(targets, dtype=float)).reshape(1, -1, 2)
+    delta = targets - origins
+    a = (
+        np.sin(delta[..., 0] / 2) ** 2
+        + np.cos(origins[..., 0]) * np.cos(targets[..., 0]) * np.sin(delta[..., 1] / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _coordinates(locations: List[Optional[Location]]) -> np.ndarray:
+    return np.array([[location.lat, location.lng] for location in locations if location], dtype=float).reshape(-1, 2)
+
+
+def fill_weather(plan: TripPlanResponse, forecast: List[Dict[str, Any]], start_date: str) -> int:
+    """按日期把天气预报映射到每天，返回填充的天数；没有对应日期时保留原值"""
+    by_date = {}
+    for item in forecast or []:
+        if not isinstance(item, dict) or not item.get("date"):
+            continue
+        try:
+            by_date[str(item["date"])[:10]] = Weather.model_validate(
+                {key: "" if value is None and key in {"day_weather", "night_weather", "day_temp", "night_temp"} else value
+                 for key, value in item.items()}
+            )
+        except ValidationError:
+            continue
+
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    filled = 0
+    for day in plan.days:
+        weather = by_date.get((start + timedelta(days=day.day - 1)).strftime("%Y-%m-%d"))
+        if weather is not None:
+            day.weather = weather
+            filled += 1
+    return filled
+
+
+def fill_hotel_distances(plan: TripPlanResponse) -> None:
+    """
+    计算酒店到景点的距离：
+    每天的推荐酒店取到当天最近景点的距离，行程级酒店列表取到所有景点中最近一个的距离
+    """
+    all_attractions = _coordinates([attraction.location for day in plan.days for attraction in day.attractions])
+
+    def nearest(hotel: Hotel, targets: np.ndarray) -> Optional[float]:
+        if not hotel.location or not len(targets):
+            return None
+        distances = haversine_matrix(_coordinates([hotel.location]), targets)
+        return round(float(distances.min()), 2)
+
+    for day in plan.days:
+        if day.recommended_hotel is not None:
+            day_targets = _coordinates([attraction.location for attraction in day.attractions])
+            distance = nearest(day.recommended_hotel, day_targets if len(day_targets) else all_attractions)
+            if distance is not None:
+                day.recommended_hotel.distance_to_main_attraction_km = distance
+
+    located = [hotel for hotel in plan.hotels if hotel.location]
+    if located and len(all_attractions):
+        matrix = haversine_matrix(_coordinates([hotel.location for hotel in located]), all_attractions)
+        for hotel, distance in zip(located, matrix.min(axis=1)):
+            hotel.distance_to_main_attraction_km = round(float(distance), 2)
+
+
+def _route_distance_km(day: DailyPlan) -> float:
+    """当天路线长度：酒店 -> 各景点（按顺序） -> 酒店"""
+    stops = [attraction.location for attraction in day.attractions if attraction.location]
+    hotel_location = day.recommended_hotel.location if day.recommended_hotel else None
+    if hotel_location:
+        stops = [hotel_location] + stops + [hotel_location]
+    if len(stops) < 2:
+        return 0.0
+    coordinates = _coordinates(stops)
+    # 相邻站点的距离即矩阵的次对角线
+    return float(np.diagonal(haversine_matrix(coordinates[:-1], coordinates[1:])).sum())
+
+
+def fill_budgets(plan: TripPlanResponse, budget_level: Optional[str]) -> None:
+    """按候选价格计算每天预算与总预算，缺少价格时使用预算档位默认值"""
+    profile = budget_profile(budget_level)
+    last_day = max((day.day for day in plan.days), default=0)
+
+    for day in plan.days:
+        tickets = sum(parse_price(attraction.ticket_price) or 0.0 for attraction in day.attractions)
+
+        if day.dinings:
+            dining = sum(
+                parse_price(dining.cost_per_person) or profile["meal_per_person"] for dining in day.dinings
+            )
+        else:
+            dining = profile["meal_per_person"] * DEFAULT_MEALS_PER_DAY
+
+        # 多日行程最后一天不再住宿
+        hotel = 0.0
+        if day.recommended_hotel is not None and not (len(plan.days) > 1 and day.day == last_day):
+            hotel = parse_price(day.recommended_hotel.price) or profile["hotel_per_night"]
+
+        transport = 0.0
+        if day.attractions:
+            transport = max(profile["transport_min"], _route_distance_km(day) * profile["transport_per_km"])
+
+        day.budget = DailyBudget(
+            transport_cost=round(transport, 2),
+            dining_cost=round(dining, 2),
+            hotel_cost=round(hotel, 2),
+            attraction_ticket_cost=round(tickets, 2),
+            total=round(transport + dining + hotel + tickets, 2),
+        )
+
+    totals = {
+        field: round(sum(getattr(day.budget, field) for day in plan.days), 2)
+        for field in ("transport_cost", "dining_cost", "hotel_cost", "attraction_ticket_cost", "total")
+    }
+    plan.total_budget = BudgetBreakdown(**totals)
+
+
+def postprocess_plan(
+    plan: TripPlanResponse,
+    request: TripPlanRequest,
+    forecast: Optional[List[Dict[str, Any]]] = None,
+) -> TripPlanResponse:
+    """依次填充天气、酒店距离和预算"""
+    filled = fill_weather(plan, forecast or [], request.start_date)
+    fill_hotel_distances(plan)
+    fill_budgets(plan, request.budget)
+    logger.debug(
+        "Trip plan post-processed",
+        extra={"days": len(plan.days), "weather_days": filled, "total_budget": plan.total_budget.total},
+    )
+    return plan
@@ -1,11 +1,21 @@
+import contextvars
 import json
 import math
 from datetime import datetime
-from app.models.trip_model import TripPlanRequest, TripPlanResponse
+from app.models.trip_model import DailyPlan, TripPlanRequest, TripPlanResponse
 from app.models.common_model import Attraction, Hotel, Weather
 from app.services.llm_service import LLMService
+from app.services.llm_cache import CachePolicy
+from app.services.destination_cache import get_destination_cache
+from app.exceptions.custom_exceptions import CircuitBreakerOpenException
+from app.agents.candidates import CandidateStore, PlannedDay, PlannedTrip
+from app.agents.degraded_planner import build_degraded_plan, parse_amap_weather
+from app.agents.hotel_ranker import HotelRanker, parse_amap_pois
+from app.agents.plan_parser import PlanParseResult, loads_tolerant, parse_plan, validate_days
+from app.agents.plan_postprocess import postprocess_plan
+from app.observability.metrics import metrics_registry
 from app.observability.logger import default_logger as logger
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from app.tools.mcp_tool import MCPTool
 from app.config import settings
 from app.services.unsplash_service import UnsplashService
@@ -19,7 +29,8 @@ from app.agents.specialized_agents import (
     AttractionSearchAgent,
     HotelRecommendationAgent,
     WeatherQueryAgent,
-    PlannerAgent as EnhancedPlannerAgent
+    PlannerAgent as EnhancedPlannerAgent,
+    PLANNER_AGENT_PROMPT,
 )
 from hello_agents import ToolRegistry
 from app.observability.logger import get_request_id
@@ -64,6 +75,39 @@ CITY_BOUNDS = {
     "乌鲁木齐": {"lat_min": 43.7, "lat_max": 44.2, "lng_min": 87.4, "lng_max": 88.0},
     "宁波": {"lat_min": 29.8, "lat_max": 30.0, "lng_min": 121.3, "lng_max": 121.8},
 }
+# 酒店智能体输出的结构化整理格式（本地排序回退时同样使用）
+HOTEL_SYNTHESIS_SCHEMA = """
+        {
+          "summary": "string",
+          "warnings": ["string"],
+          "items": [
+            {
+              "name": "string",
+              "address": "string",
+              "price": "string",
+              "rating": "string",
+              "location": {"lat": 0, "lng": 0}
+            }
+          ]
+        }
+        """
+# 整理结果随出行日期变化的角色（天气预报、酒店价格与房态），只使用精确匹配缓存
+DATE_DEPENDENT_SYNTHESIS_ROLES = {"weather_agent", "hotel_agent"}
+# 最终规划的输出要求（不含任何请求数据，放在用户消息开头）
+PLANNER_OUTPUT_REQUIREMENTS = """
+        **输出要求:**
+        1. 严格按照系统提示中给定的 JSON 结构和字段名生成行程计划。
+        2. 你的输出必须是一个完整的 JSON 对象，包含：
+           - trip_title
+           - hotels（酒店候选 id 列表）
+           - days（其中包含 theme / recommended_hotel / attractions / dinings 字段）
+           天气信息仅供安排行程参考（如雨天安排室内景点），预算、天气和酒店距离由系统计算，不要输出。
+        3. 只能引用下方候选中的 id，不要重复输出候选的名称、地址、坐标、评分或价格：
+           - attractions 的元素为 {"id": "A1", "suggested_duration_hours": 2.5, "description": "游览建议"}
+           - recommended_hotel 与 hotels 只填写酒店候选的 id（如 "H1"）
+           - 提供了餐饮候选时 dinings 只填写餐饮候选的 id（如 "D1"），否则按系统提示给出完整的餐饮对象
+        4. 不要输出任何额外的解释或 Markdown，只输出 JSON。
+"""
 # 注意：Agent提示词已移至 specialized_agents.py
 class PlannerAgent:
     """
@@ -76,17 +120,29 @@ class PlannerAgent:
         self.settings = settings
         self.unsplash_service = UnsplashService(settings.UNSPLASH_ACCESS_KEY)
         self.memory_service = memory_service or VectorMemoryService()
+        self.hotel_ranker = HotelRanker(top_n=settings.HOTEL_RANKER_TOP_N)
         
         # 创建工具注册表
         self.tool_registry = ToolRegistry()
         
-        # 创建高德地图工具
+        # 创建高德地图工具：http 模式连接共享的 MCP 服务器并复用长连接会话，
+        # stdio 模式在本进程内启动 amap-mcp-server
+        if settings.AMAP_MCP_TRANSPORT.lower() == "http":
+            amap_connection = {
+                "server_url": settings.AMAP_MCP_SERVER_URL,
+                "persistent_session": True,
+                "http_max_connections": settings.AMAP_MCP_HTTP_MAX_CONNECTIONS,
+            }
+        else:
+            amap_connection = {"server_command": ["uvx", "amap-mcp-server"]}
         self.amap_tool = MCPTool(
                 name="amap",
                 description="高德地图服务",
-                server_command=["uvx", "amap-mcp-server"],
                 env={"AMAP_MAPS_API_KEY": settings.AMAP_API_KEY},
-                auto_expand=True
+                auto_expand=True,
+                schema_cache_path=settings.MCP_TOOL_CACHE_PATH,
+                schema_refresh_seconds=settings.MCP_TOOL_CACHE_REFRESH_SECONDS,
+                **amap_connection,
             )
         self.tool_registry.register_tool(self.amap_tool)
         # 关键修复：将MCP展开后的子工具一并注册，确保可直接调用
@@ -256,16 +312,12 @@ class PlannerAgent:
         output_schema: str,
         request_id: Optional[str] = None,
     ) -> Dict[str, Any]:
-        prompt = f"""
+        # 系统消息只包含该角色固定的整理规则与 JSON 结构；请求信息与原始结果分为两条用户消息，
+        # 语义缓存只对最后一条（原始结果）做向量检索，请求信息（目的地、日期、偏好、预算）进入作用域
+        system_prompt = f"""
         你是多智能体协作流程中的结构化整理器。
         当前任务来自 {role_name}，请将原始输出整理成严格 JSON。
 
-        目的地: {request.destination}
-        出行日期: {request.start_date} 到 {request.end_date}
-        偏好: {', '.join(request.preferences or []) or '无'}
-        酒店偏好: {', '.join(request.hotel_preferences or []) or '无'}
-        预算: {request.budget}
-
         输出要求:
         1. 只返回 JSON 对象。
         2. 保留不确定性，无法确认时放入 warnings。
@@ -274,20 +326,33 @@ class PlannerAgent:
 
         JSON 结构:
         {output_schema}
-
-        原始结果:
-        {raw_result}
         """
+        request_context = f"""
+        目的地: {request.destination}
+        出行日期: {request.start_date} 到 {request.end_date}
+        偏好: {', '.join(request.preferences or []) or '无'}
+        酒店偏好: {', '.join(request.hotel_preferences or []) or '无'}
+        预算: {request.budget}
+        """
+        prompt = f"原始结果:\n{raw_result}"
 
         fallback_payload = {"summary": raw_result[:500], "warnings": ["structured_parse_failed"], "items": []}
         try:
             response = self.llm.invoke(
                 [
-                    {"role": "system", "content": "You convert agent outputs into strict JSON for downstream orchestration."},
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": request_context},
                     {"role": "user", "content": prompt},
                 ],
                 response_format={"type": "json_object"},
                 usage_key=request_id,
+                stage=f"synthesis:{role_name}",
+                # 工具结果命中缓存时整理提示词往往逐字相同，可直接复用；
+                # 与日期无关的整理允许在同一请求信息下近似复用原始结果，因此开启语义缓存
+                cache_policy=CachePolicy(
+                    namespace=f"synthesis:{role_name}",
+                    semantic=role_name not in DATE_DEPENDENT_SYNTHESIS_ROLES,
+                ),
             )
             return json.loads(response)
         except Exception as exc:
@@ -302,10 +367,11 @@ class PlannerAgent:
         request: TripPlanRequest,
         *,
         attractions_raw: str,
-        hotels_raw: str,
+        hotels_raw: Optional[str],
         weather_raw: str,
         request_id: Optional[str] = None,
     ) -> Dict[str, Any]:
+        """结构化整理各智能体的原始输出；hotels_raw 为None时跳过酒店（由本地排序提供）"""
         attraction_schema = """
         {
           "summary": "string",
@@ -315,21 +381,8 @@ class PlannerAgent:
               "name": "string",
               "type": "string",
               "address": "string",
-              "location": {"lat": 0, "lng": 0}
-            }
-          ]
-        }
-        """
-        hotel_schema = """
-        {
-          "summary": "string",
-          "warnings": ["string"],
-          "items": [
-            {
-              "name": "string",
-              "address": "string",
-              "price": "string",
               "rating": "string",
+              "ticket_price": "string",
               "location": {"lat": 0, "lng": 0}
             }
           ]
@@ -353,7 +406,7 @@ class PlannerAgent:
         }
         """
 
-        return {
+        payload = {
             "attractions": self._synthesize_agent_output(
                 role_name="attraction_agent",
                 raw_result=attractions_raw,
@@ -361,13 +414,6 @@ class PlannerAgent:
                 output_schema=attraction_schema,
                 request_id=request_id,
             ),
-            "hotels": self._synthesize_agent_output(
-                role_name="hotel_agent",
-                raw_result=hotels_raw,
-                request=request,
-                output_schema=hotel_schema,
-                request_id=request_id,
-            ),
             "weather": self._synthesize_agent_output(
                 role_name="weather_agent",
                 raw_result=weather_raw,
@@ -376,17 +422,35 @@ class PlannerAgent:
                 request_id=request_id,
             ),
         }
+        if hotels_raw is not None:
+            payload["hotels"] = self._synthesize_agent_output(
+                role_name="hotel_agent",
+                raw_result=hotels_raw,
+                request=request,
+                output_schema=HOTEL_SYNTHESIS_SCHEMA,
+                request_id=request_id,
+            )
+        return payload
 
-    def _construct_prompt(self, request: TripPlanRequest, attractions: Dict[str, Any], hotels: Dict[str, Any], weather: Dict[str, Any]) -> str:
+    def _construct_prompt(
+        self,
+        request: TripPlanRequest,
+        attractions: Dict[str, Any],
+        hotels: Dict[str, Any],
+        weather: Dict[str, Any],
+        dinings: Optional[Dict[str, Any]] = None,
+    ) -> str:
         start_date = datetime.strptime(request.start_date, "%Y-%m-%d")
         end_date = datetime.strptime(request.end_date, "%Y-%m-%d")
         duration = (end_date - start_date).days + 1
 
-        # attraction_details = [f"- {a.name} (评分: {a.rating}, 类型: {a.type})" for a in attractions]
-        # hotel_details = [f"- {h.name} (价格: {h.price}, 评分: {h.rating})" for h in hotels]
-        # weather_details = [f"- {w.date}: {w.day_weather}, {w.day_temp}°C" for w in weather]
+        dining_resource = (
+            f"        - **结构化餐饮候选:**\n{json.dumps(dinings, ensure_ascii=False, indent=2)}\n"
+            if dinings else ""
+        )
 
-        prompt = f"""
+        # 固定的输出要求在前，本次请求的信息与候选在后，保持前缀稳定以命中服务端前缀缓存
+        prompt = PLANNER_OUTPUT_REQUIREMENTS + f"""
         请为我创建一个前往 {request.destination} 的旅行计划。
 
         **基本信息:**
@@ -395,22 +459,131 @@ class PlannerAgent:
         - 个人偏好: {', '.join(request.preferences) if request.preferences else '无'}
         - 酒店偏好: {', '.join(request.hotel_preferences) if request.hotel_preferences else '无'}
 
-        **可用资源:**
+        **可用资源（每个候选都有唯一 id）:**
         - **结构化景点候选:**\n{json.dumps(attractions, ensure_ascii=False, indent=2)}
         - **结构化酒店候选:**\n{json.dumps(hotels, ensure_ascii=False, indent=2)}
-        - **结构化天气信息:**\n{json.dumps(weather, ensure_ascii=False, indent=2)}
-
-        **输出要求:**
-        1. 严格按照系统提示中给定的 JSON 结构和字段名生成行程计划。
-        2. 你的输出必须是一个完整的 JSON 对象，包含：
-           - trip_title
-           - total_budget（含 transport_cost / dining_cost / hotel_cost / attraction_ticket_cost / total）
-           - hotels
-           - days（其中包含 recommended_hotel / attractions / dinings / budget 等字段）
-        3. 不要输出任何额外的解释或 Markdown，只输出 JSON。
+{dining_resource}        - **结构化天气信息:**\n{json.dumps(weather, ensure_ascii=False, indent=2)}
         """
         return prompt
 
+    def _parse_plan_with_repair(
+        self,
+        json_plan_str: str,
+        prompt: str,
+        request: TripPlanRequest,
+        request_id: Optional[str],
+        candidate_store: Optional[CandidateStore] = None,
+    ) -> Optional[TripPlanResponse]:
+        """
+        容错解析最终行程：修复常见JSON缺陷，还原候选ID引用并逐天校验，
+        失败或缺失的天单独重新生成后合并，所有天都失败时返回None
+
+        Args:
+            json_plan_str: 规划智能体的原始输出
+            prompt: 生成行程时使用的提示词（重新生成时复用）
+            request: 行程规划请求
+            request_id: 请求ID（用于用量统计）
+            candidate_store: 候选POI（用于还原ID引用）
+        """
+        duration = (
+            datetime.strptime(request.end_date, "%Y-%m-%d") - datetime.strptime(request.start_date, "%Y-%m-%d")
+        ).days + 1
+
+        try:
+            result = parse_plan(json_plan_str, duration, candidate_store)
+        except ValueError as exc:
+            logger.warning("Trip plan JSON is unrecoverable, regenerating all days", extra={"error": str(exc)})
+            result = PlanParseResult()
+            result.failed_days = {day_number: "unparseable" for day_number in range(1, duration + 1)}
+
+        initially_failed = len(result.failed_days)
+        for attempt in range(settings.PLAN_REPAIR_MAX_ATTEMPTS):
+            if not result.failed_days:
+                break
+            logger.warning(
+                "Regenerating failed trip plan days",
+                extra={
+                    "request_id": request_id,
+                    "attempt": attempt + 1,
+                    "failed_days": {str(day): reason[:120] for day, reason in result.failed_days.items()},
+                },
+            )
+            result.merge_days(
+                self._regenerate_days(prompt, sorted(result.failed_days), duration, request_id, candidate_store)
+            )
+        if candidate_store is not None:
+            candidate_store.log_unknown_refs()
+
+        if initially_failed:
+            outcome = "partial" if result.failed_days else "recovered"
+            metrics_registry.inc("trip_plan_repair_total", outcome=outcome if result.days else "failed")
+        if not result.days:
+            logger.error("LLM未能生成任何有效的行程天", extra={"request_id": request_id})
+            return None
+        if result.failed_days:
+            logger.warning(
+                "Trip plan returned with missing days",
+                extra={"request_id": request_id, "missing_days": sorted(result.failed_days)},
+            )
+
+        if not result.trip_title:
+            result.trip_title = f"{request.destination}{duration}日游"
+        return result.to_response()
+
+    def _regenerate_days(
+        self,
+        prompt: str,
+        day_numbers: List[int],
+        duration: int,
+        request_id: Optional[str],
+        candidate_store: Optional[CandidateStore] = None,
+    ) -> Dict[int, DailyPlan]:
+        """只为指定的天重新请求模型，返回其中通过校验的天"""
+        day_list = "、".join(str(day_number) for day_number in day_numbers)
+        repair_prompt = (
+            f"{prompt}\n\n"
+            f"之前的输出中第 {day_list} 天缺失或不符合结构要求。请只重新生成这些天，"
+            f'输出 JSON 对象 {{"days": [...]}}，每个元素的结构与系统提示中 days 的元素相同，'
+            f"day 字段依次为 {day_list}，不要输出其他天或其他字段。"
+        )
+        day_schema = PlannedDay.model_json_schema()
+        definitions = day_schema.pop("$defs", {})
+        schema = {
+            "type": "object",
+            "properties": {"days": {"type": "array", "items": day_schema}},
+            "required": ["days"],
+            "$defs": definitions,
+        }
+
+        try:
+            response = self.llm.invoke(
+                [
+                    {"role": "system", "content": PLANNER_AGENT_PROMPT},
+                    {"role": "user", "content": repair_prompt},
+                ],
+                stage="planner_agent:repair",
+                usage_key=request_id,
+                response_format=self.llm.structured_response_format("trip_plan_days", schema),
+            )
+            data = loads_tolerant(response)
+        except Exception as exc:
+            logger.warning("Failed to regenerate trip plan days", extra={"days": day_numbers, "error": str(exc)})
+            return {}
+
+        raw_days = data.get("days") if isinstance(data, dict) else data
+        if isinstance(raw_days, list) and len(raw_days) == len(day_numbers):
+            # 按请求顺序补全缺失的 day 编号
+            raw_days = [
+                dict(raw_day, day=raw_day.get("day") or day_number) if isinstance(raw_day, dict) else raw_day
+                for raw_day, day_number in zip(raw_days, day_numbers)
+            ]
+        valid, _ = validate_days(
+            [raw_day for raw_day in raw_days or [] if isinstance(raw_day, dict) and isinstance(raw_day.get("day"), int)],
+            duration,
+            candidate_store,
+        )
+        return {day_number: day for day_number, day in valid.items() if day_number in day_numbers}
+
     def _build_attraction_query(self, request: TripPlanRequest) -> str:
         """构建景点搜索查询 - 直接包含工具调用"""
         keywords = []
@@ -429,6 +602,159 @@ class PlannerAgent:
         query = f"请使用amap_maps_text_search工具搜索{request.destination}的酒店。请确保返回的酒店信息详细且准确。\n[TOOL_CALL:amap_maps_text_search:keywords=酒店,city={request.destination}]"
         return query
     
+    def _search_hotel_candidates(self, request: TripPlanRequest) -> List[Dict[str, Any]]:
+        """直接调用高德文本搜索获取酒店候选（不经过LLM）"""
+        raw = self.amap_tool.run({
+            "action": "call_tool",
+            "tool_name": "maps_text_search",
+            "arguments": {"keywords": "酒店", "city": request.destination},
+        })
+        return parse_amap_pois(raw)
+
+    def _search_attraction_candidates(self, request: TripPlanRequest) -> List[Dict[str, Any]]:
+        """直接调用高德文本搜索获取景点候选（不经过LLM，供降级规划使用）"""
+        keywords = request.preferences[0] if request.preferences else "景点"
+        raw = self.amap_tool.run({
+            "action": "call_tool",
+            "tool_name": "maps_text_search",
+            "arguments": {"keywords": keywords, "city": request.destination},
+        })
+        return parse_amap_pois(raw)
+
+    def _query_weather_forecast(self, request: TripPlanRequest) -> List[Dict[str, Any]]:
+        """直接调用高德天气查询（不经过LLM，供降级规划使用）"""
+        raw = self.amap_tool.run({
+            "action": "call_tool",
+            "tool_name": "maps_weather",
+            "arguments": {"city": request.destination},
+        })
+        return parse_amap_weather(raw)
+
+    def _cache_destination_data(self, request: TripPlanRequest, payload: Dict[str, Any]) -> None:
+        """保存本次规划的结构化景点、酒店与天气，供LLM不可用时的降级规划使用"""
+        try:
+            get_destination_cache().save(
+                request.destination,
+                attractions=(payload.get("attractions") or {}).get("items"),
+                hotels=(payload.get("hotels") or {}).get("items"),
+                forecast=(payload.get("weather") or {}).get("forecast"),
+            )
+        except Exception as e:
+            logger.warning("Failed to cache destination data", extra={"destination": request.destination, "error": str(e)})
+
+    def _plan_degraded(self, request: TripPlanRequest, reason: str) -> Optional[TripPlanResponse]:
+        """
+        LLM熔断时不经过模型生成基础行程
+
+        优先使用目的地缓存中的景点和酒店，缓存缺失时直接调用高德搜索；天气优先实时查询，失败时使用缓存。
+
+        Args:
+            request: 行程规划请求
+            reason: 降级原因（日志与指标标签）
+        """
+        cached = get_destination_cache().load(request.destination) or {}
+        attraction_items = cached.get("attractions") or []
+        hotel_candidates = parse_amap_pois({"pois": cached.get("hotels") or []})
+        forecast: List[Dict[str, Any]] = []
+
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="degraded_query") as executor:
+            future_weather = executor.submit(contextvars.copy_context().run, self._query_weather_forecast, request)
+            future_attractions = None if attraction_items else executor.submit(
+                contextvars.copy_context().run, self._search_attraction_candidates, request
+            )
+            future_hotels = None if hotel_candidates else executor.submit(
+                contextvars.copy_context().run, self._search_hotel_candidates, request
+            )
+            try:
+                forecast = future_weather.result(timeout=30)
+            except Exception as e:
+                logger.warning("Degraded plan weather query failed", extra={"error": str(e)})
+            try:
+                if future_attractions is not None:
+                    attraction_items = future_attractions.result(timeout=30)
+                if future_hotels is not None:
+                    hotel_candidates = future_hotels.result(timeout=30)
+            except Exception as e:
+                logger.warning("Degraded plan POI search failed", extra={"error": str(e)})
+        forecast = forecast or cached.get("forecast") or []
+
+        hotels = self.hotel_ranker.rank(
+            hotel_candidates,
+            attraction_items,
+            request.budget,
+            request.hotel_preferences,
+        )
+        plan = build_degraded_plan(
+            request,
+            attraction_items,
+            hotels,
+            attractions_per_day=settings.DEGRADED_ATTRACTIONS_PER_DAY,
+        )
+        metrics_registry.inc("trip_plans_degraded_total", reason=reason, outcome="success" if plan else "failed")
+        if plan is None:
+            logger.error(
+                "Degraded plan unavailable: no attraction data",
+                extra={"destination": request.destination, "reason": reason},
+            )
+            return None
+
+        plan = self._validate_and_filter_plan(plan, request.destination)
+        plan = postprocess_plan(plan, request, forecast=forecast)
+        self._enrich_attraction_images(plan, request)
+        logger.warning(
+            "Returning degraded trip plan",
+            extra={
+                "destination": request.destination,
+                "reason": reason,
+                "from_cache": bool(cached.get("attractions")),
+                "days": len(plan.days),
+            },
+        )
+        return plan
+
+    def _enrich_attraction_images(self, plan: TripPlanResponse, request: TripPlanRequest) -> None:
+        """为行程中的景点补充图片，失败时清空图片列表"""
+        logger.info("Starting attraction image enrichment")
+        attractions = [attraction for day in plan.days for attraction in day.attractions]
+        if not attractions:
+            logger.info("No attractions require image enrichment")
+            return
+        try:
+            image_stats = self.unsplash_service.enrich_attractions(
+                attractions=attractions,
+                destination=request.destination,
+                use_fallback=True,
+                use_cache=True,
+            )
+            logger.debug(
+                "Unsplash image enrichment stats",
+                extra={
+                    "image_stats": image_stats,
+                    "cache_stats": self.unsplash_service.get_cache_stats(),
+                },
+            )
+        except Exception as e:
+            logger.error(f"Attraction image enrichment failed: {e}")
+            for attraction in attractions:
+                attraction.image_urls = []
+
+    def _rank_hotels(
+        self,
+        request: TripPlanRequest,
+        hotel_candidates: List[Dict[str, Any]],
+        attractions: Dict[str, Any],
+    ) -> Optional[Dict[str, Any]]:
+        """本地排序酒店候选，没有可用候选时返回None（由调用方回退到酒店智能体）"""
+        hotels = self.hotel_ranker.rank(
+            hotel_candidates,
+            (attractions or {}).get("items") or [],
+            request.budget,
+            request.hotel_preferences,
+        )
+        if not hotels:
+            return None
+        return self.hotel_ranker.to_section(hotels, len(hotel_candidates))
+
     def plan_trip(
         self,
         request: TripPlanRequest,
@@ -464,6 +790,7 @@ class PlannerAgent:
         # 如果没有提供user_id，使用request_id作为临时user_id
         if not user_id:
             user_id = request_id
+        self.llm.bind_usage(request_id, user_id, request.destination)
         
         # 检索用户记忆并添加到上下文（使用向量记忆服务）
         # 构建查询文本
@@ -490,6 +817,10 @@ class PlannerAgent:
             context_manager.add_memory_context("knowledge_memories", knowledge_memories)
             logger.info(f"已加载 {len(knowledge_memories)} 条知识记忆")
         
+        # LLM所有端点均在熔断中时直接生成降级行程，不再逐个等待智能体调用失败
+        if settings.DEGRADED_PLAN_ENABLED and not self.llm.is_available("planner_agent"):
+            return self._plan_degraded(request, reason="llm_circuit_open")
+
         # 创建增强的智能体
         logger.info("创建增强智能体...")
         
@@ -534,16 +865,20 @@ class PlannerAgent:
             hotel_query = self._build_hotel_query(request)
             weather_query = f"请查询{request.destination}的天气信息，日期范围：{request.start_date} 到 {request.end_date}"
             
-            # 使用线程池并行执行三个独立查询
+            # 使用线程池并行执行三个独立查询；酒店默认直接搜索后在本地排序，不经过LLM
             attractions = None
             hotels = None
+            hotel_candidates: List[Dict[str, Any]] = []
             weather = None
             
             with ThreadPoolExecutor(max_workers=3, thread_name_prefix="agent_query") as executor:
-                # 提交三个任务
-                future_attractions = executor.submit(attraction_agent.run, attraction_query)
-                future_hotels = executor.submit(hotel_agent.run, hotel_query)
-                future_weather = executor.submit(weather_agent.run, weather_query)
+                # 提交三个任务（复制当前上下文，保留请求ID与LLM网关优先级）
+                future_attractions = executor.submit(contextvars.copy_context().run, attraction_agent.run, attraction_query)
+                if settings.HOTEL_RANKER_ENABLED:
+                    future_hotels = executor.submit(contextvars.copy_context().run, self._search_hotel_candidates, request)
+                else:
+                    future_hotels = executor.submit(contextvars.copy_context().run, hotel_agent.run, hotel_query)
+                future_weather = executor.submit(contextvars.copy_context().run, weather_agent.run, weather_query)
                 
                 # 等待并获取结果（带异常处理）
                 # 1. 获取景点搜索结果
@@ -555,14 +890,19 @@ class PlannerAgent:
                     logger.error(f"❌ 景点搜索失败: {e}，使用降级策略")
                     attractions = f"未找到{request.destination}相关景点信息，请参考通用旅游攻略"
                 
-                # 2. 获取酒店推荐结果
+                # 2. 获取酒店搜索/推荐结果
                 logger.info("  等待酒店推荐结果...")
                 try:
-                    hotels = future_hotels.result(timeout=120)
-                    logger.info(f"✅ 酒店推荐完成: {hotels[:200] if hotels else '无结果'}...")
+                    if settings.HOTEL_RANKER_ENABLED:
+                        hotel_candidates = future_hotels.result(timeout=120)
+                        logger.info(f"✅ 酒店搜索完成: {len(hotel_candidates)} 家候选")
+                    else:
+                        hotels = future_hotels.result(timeout=120)
+                        logger.info(f"✅ 酒店推荐完成: {hotels[:200] if hotels else '无结果'}...")
                 except Exception as e:
                     logger.error(f"❌ 酒店推荐失败: {e}，使用降级策略")
-                    hotels = f"未找到{request.destination}相关酒店信息，请根据预算选择住宿"
+                    if not settings.HOTEL_RANKER_ENABLED:
+                        hotels = f"未找到{request.destination}相关酒店信息，请根据预算选择住宿"
                 
                 # 3. 获取天气查询结果
                 logger.info("  等待天气查询结果...")
@@ -580,62 +920,80 @@ class PlannerAgent:
             collaboration_payload = self._build_structured_collaboration_payload(
                 request,
                 attractions_raw=attractions or "",
-                hotels_raw=hotels or "",
+                hotels_raw=None if settings.HOTEL_RANKER_ENABLED else (hotels or ""),
                 weather_raw=weather or "",
                 request_id=request_id,
             )
+            if settings.HOTEL_RANKER_ENABLED:
+                hotel_section = self._rank_hotels(request, hotel_candidates, collaboration_payload["attractions"])
+                if hotel_section is None:
+                    # 本地没有可用的酒店候选时回退到酒店智能体
+                    logger.warning("No hotel candidates for local ranking, falling back to hotel agent")
+                    try:
+                        hotels = hotel_agent.run(hotel_query)
+                    except Exception as e:
+                        logger.error(f"❌ 酒店推荐失败: {e}，使用降级策略")
+                        hotels = f"未找到{request.destination}相关酒店信息，请根据预算选择住宿"
+                    hotel_section = self._synthesize_agent_output(
+                        role_name="hotel_agent",
+                        raw_result=hotels or "",
+                        request=request,
+                        output_schema=HOTEL_SYNTHESIS_SCHEMA,
+                        request_id=request_id,
+                    )
+                collaboration_payload["hotels"] = hotel_section
             context_manager.share_data("structured_collaboration_payload", collaboration_payload, from_agent="orchestrator")
             context_manager.share_data(
                 "attraction_locations",
                 collaboration_payload.get("attractions", {}).get("items", []),
                 from_agent="orchestrator",
             )
+            # 为候选分配短ID，模型只引用ID，完整对象在解析时还原
+            candidate_store = CandidateStore.from_payload(collaboration_payload)
             prompt = self._construct_prompt(
                 request,
-                collaboration_payload["attractions"],
-                collaboration_payload["hotels"],
+                candidate_store.prompt_section("attractions", collaboration_payload["attractions"]),
+                candidate_store.prompt_section("hotels", collaboration_payload["hotels"]),
                 collaboration_payload["weather"],
+                dinings=(
+                    candidate_store.prompt_section("dinings", collaboration_payload["dinings"])
+                    if candidate_store.has("dinings") else None
+                ),
+            )
+            # 最终行程生成位于关键路径上，多端点时开启对冲请求以降低尾延迟
+            json_plan_str = planner_agent.run(
+                prompt,
+                hedge=True,
+                response_format=self.llm.structured_response_format(
+                    "trip_plan", PlannedTrip.model_json_schema()
+                ),
             )
-            json_plan_str = planner_agent.run(prompt)
         
             if not json_plan_str:
                 logger.error("LLM未能生成有效的行程计划JSON。")
                 return None
 
-            # 5. 解析和验证
-            if '```json' in json_plan_str:
-                json_plan_str = json_plan_str.split('```json')[1].split('```')[0].strip()
-            
-            plan_data = json.loads(json_plan_str)
-            validated_plan = TripPlanResponse.model_validate(plan_data)
+            # 5. 容错解析和逐天验证，只为失败的天重新请求模型
+            validated_plan = self._parse_plan_with_repair(
+                json_plan_str, prompt, request, request_id, candidate_store
+            )
+            if validated_plan is None:
+                return None
 
             # 6. 验证和过滤地理位置
             validated_plan = self._validate_and_filter_plan(validated_plan, request.destination)
+
+            # 6.1 本地计算天气、酒店距离和预算（不再由模型生成）
+            validated_plan = postprocess_plan(
+                validated_plan,
+                request,
+                forecast=(collaboration_payload.get("weather") or {}).get("forecast"),
+            )
             
+            self._cache_destination_data(request, collaboration_payload)
+
             # 7. Enrich attraction images after validation.
-            logger.info("Starting attraction image enrichment")
-            attractions = [attraction for day in validated_plan.days for attraction in day.attractions]
-            if attractions:
-                try:
-                    image_stats = self.unsplash_service.enrich_attractions(
-                        attractions=attractions,
-                        destination=request.destination,
-                        use_fallback=True,
-                        use_cache=True,
-                    )
-                    logger.debug(
-                        "Unsplash image enrichment stats",
-                        extra={
-                            "image_stats": image_stats,
-                            "cache_stats": self.unsplash_service.get_cache_stats(),
-                        },
-                    )
-                except Exception as e:
-                    logger.error(f"Attraction image enrichment failed: {e}")
-                    for attraction in attractions:
-                        attraction.image_urls = []
-            else:
-                logger.info("No attractions require image enrichment")
+            self._enrich_attraction_images(validated_plan, request)
             # 8. 存储用户偏好记忆
             self.memory_service.store_user_preference(
                 user_id,
@@ -657,6 +1015,7 @@ class PlannerAgent:
                     "request_id": request_id,
                     "destination": request.destination,
                     "llm_usage": llm_usage,
+                    "llm_cache": self.llm.get_cache_stats(),
                 },
             )
             logger.info(f"成功生成并验证了行程计划: {validated_plan.trip_title}")
@@ -667,6 +1026,15 @@ class PlannerAgent:
             return validated_plan
             
         except (json.JSONDecodeError, Exception) as e:
+            # 规划过程中LLM熔断（包括本次调用触发熔断）时降级，而不是直接返回失败
+            if settings.DEGRADED_PLAN_ENABLED and (
+                isinstance(e, CircuitBreakerOpenException) or not self.llm.is_available("planner_agent")
+            ):
+                logger.warning(
+                    "LLM circuit opened during planning, falling back to degraded plan",
+                    extra={"request_id": request_id, "error": str(e)},
+                )
+                return self._plan_degraded(request, reason="llm_circuit_opened")
             logger.error(
                 f"解析或验证LLM返回的JSON时失败: {e}",
                 exc_info=True,
@@ -103,109 +103,55 @@ PLANNER_AGENT_PROMPT = """你是行程规划专家。你的任务是根据景点
 请严格按照以下 **JSON 结构** 返回旅行计划。你的输出必须是有效的 JSON，不要添加任何额外的解释或注释。
 
 **整体设计要求：**
-1. **景点模型（Attraction）** 必须包含：景点名称、类型、评分、建议游玩时间、描述、地址、经纬度、景点图片 URL 列表、门票价格。
-2. **酒店模型（Hotel）** 在原有基础上，必须补充「距离景点的距离」字段。
+1. 景点、酒店（以及提供了餐饮候选时的餐饮）全部来自用户消息中的候选列表，每个候选都有唯一 id（景点 A1、A2…，酒店 H1、H2…，餐饮 D1、D2…）。
+2. **只引用 id**：不要输出候选的名称、地址、经纬度、评分、价格等字段，系统会根据 id 自动补全。
 3. **单日行程（DailyPlan）** 必须包含：
-   - 推荐住宿（recommended_hotel）
-   - 景点列表（attractions）
+   - 当天主题（theme）
+   - 推荐住宿（recommended_hotel，酒店 id）
+   - 景点列表（attractions，每个元素包含景点 id、建议游玩时长和游览建议）
    - 餐饮列表（dinings）
-   - 单日预算拆分（budget），包括交通费用、餐饮费用、酒店费用、景点门票费用。
-4. **预算**：总预算字段需要拆分为交通费用、餐饮费用、酒店费用、景点门票费用四项，并给出总和。
-5. 所有的「图片」只能挂在 **景点（attractions）** 上，不能给酒店或餐饮生成图片 URL。
+4. **不要输出预算、天气和距离**：每天的天气、单日与总预算、酒店到景点的距离都由系统根据候选价格和天气预报计算。
+5. 不要生成任何图片 URL，景点图片由系统补充。
 
 **响应格式（示例，仅作为结构参考，字段名和类型必须严格遵守）：**
 ```json
 {
   "trip_title": "一个吸引人的行程标题",
-  "total_budget": {
-    "transport_cost": 300.0,
-    "dining_cost": 800.0,
-    "hotel_cost": 1200.0,
-    "attraction_ticket_cost": 400.0,
-    "total": 2700.0
-  },
-  "hotels": [
-    {
-      "name": "酒店名称",
-      "address": "酒店地址",
-      "location": {"lat": 39.915, "lng": 116.397},
-      "price": "400元/晚",
-      "rating": "4.5",
-      "distance_to_main_attraction_km": 1.2
-    }
-  ],
+  "hotels": ["H1", "H2"],
   "days": [
     {
       "day": 1,
       "theme": "古都历史探索",
-      "weather": {
-        "date": "YYYY-MM-DD",
-        "day_weather": "晴",
-        "night_weather": "多云",
-        "day_temp": "25",
-        "night_temp": "15",
-        "day_wind": "东风3级",
-        "night_wind": "西北风2级"
-      },
-      "recommended_hotel": {
-        "name": "当日推荐酒店",
-        "address": "酒店地址",
-        "location": {"lat": 39.915, "lng": 116.397},
-        "price": "400元/晚",
-        "rating": "4.5",
-        "distance_to_main_attraction_km": 0.8
-      },
+      "recommended_hotel": "H1",
       "attractions": [
         {
-          "name": "景点名称",
-          "type": "历史文化",
-          "rating": "4.7",
+          "id": "A3",
           "suggested_duration_hours": 3.0,
-          "description": "景点简介和游览建议",
-          "address": "景点地址",
-          "location": {"lat": 39.915, "lng": 116.397},
-          "image_urls": [
-            "https://example.com/attraction-image-1.jpg"
-          ],
-          "ticket_price": "60"
-        }
-      ],
-      "dinings": [
-        {
-          "name": "餐厅名称",
-          "address": "餐厅地址",
-          "location": {"lat": 39.910, "lng": 116.400},
-          "cost_per_person": "80",
-          "rating": "4.5"
+          "description": "景点简介和游览建议"
         }
       ],
-      "budget": {
-        "transport_cost": 50.0,
-        "dining_cost": 200.0,
-        "hotel_cost": 400.0,
-        "attraction_ticket_cost": 120.0,
-        "total": 770.0
-      }
+      "dinings": ["D2"]
     }
   ]
 }
 ```
+如果用户消息中没有餐饮候选，dinings 中的元素改为完整的餐饮对象：
+{"name": "餐厅名称", "address": "餐厅地址", "location": {"lat": 39.910, "lng": 116.400}, "cost_per_person": "80", "rating": "4.5"}
 
 **关键要求：**
 1. **trip_title**：创建一个吸引人且能体现行程特色的标题。
-2. **total_budget**：给出四类费用（交通、餐饮、酒店、景点门票），并计算 total 为它们的总和。
-3. **hotels / recommended_hotel**：酒店必须包含名称、地址、位置坐标、价格、评分和距离主要景点的距离。
-4. **days**：为每一天创建详细的行程计划。
-5. **theme**：每天的主题要体现该天的主要活动特色。
-6. **weather**：包含该天的天气信息，温度必须是纯数字（不要带 °C 等单位），并给出白天和夜间的风向与风力（day_wind, night_wind）。
-7. **attractions / dinings**：
-   - attractions：只包含"景点"信息，图片 URL 只能出现在 attractions.image_urls 中。
+2. **hotels / recommended_hotel**：只填写酒店候选 id，优先选择离当天景点更近、价格符合预算水平的酒店。
+3. **days**：为每一天创建详细的行程计划。
+4. **theme**：每天的主题要体现该天的主要活动特色。
+5. **天气**：参考用户消息中的天气信息安排行程（如雨天优先室内景点），但不要在输出中包含天气字段。
+6. **attractions / dinings**：
+   - attractions：只引用景点候选 id，并给出建议游玩时长和游览建议。
    - dinings：只包含餐饮信息，不能包含图片 URL 字段。
-8. **时间规划**：在描述中要体现出合理的时间安排（例如上午/下午/晚上安排哪些景点和餐饮）。
-9. **预算准确**：total_budget.total 必须等于四类费用之和；每天的 budget.total 也必须等于四项之和。
-10. **避免重复**：不要在多天中重复推荐同一个景点或餐厅。
-11. **地理位置验证（关键）**：
-    - 在生成JSON前，必须检查所有景点的location字段（经纬度）是否在目标城市范围内
+7. **时间规划**：在描述中要体现出合理的时间安排（例如上午/下午/晚上安排哪些景点和餐饮）。
+8. **预算意识**：根据预算水平选择景点、酒店和餐饮，具体费用由系统根据候选价格计算。
+9. **避免重复**：不要在多天中重复推荐同一个景点或餐厅。
+10. **地理位置验证（关键）**：
+    - 在生成JSON前，必须根据候选中的 location（经纬度）检查景点是否在目标城市范围内
     - 如果发现景点位置不在目标城市，必须排除该景点
     - 同一天的景点经纬度应该相对集中，距离不超过50公里
     - 相邻天的景点经纬度变化应该合理，避免突然跨越很大距离
@@ -231,7 +177,8 @@ class AttractionSearchAgent(EnhancedAgent):
             enable_tool_calling=True,
             context_manager=context_manager,
             communication_hub=communication_hub,
-            user_id=user_id
+            user_id=user_id,
+            stage_name="attraction_agent"
         )
     
     def handle_message(self, message: AgentMessage) -> Dict[str, Any]:
@@ -304,7 +251,8 @@ class HotelRecommendationAgent(EnhancedAgent):
             enable_tool_calling=True,
             context_manager=context_manager,
             communication_hub=communication_hub,
-            user_id=user_id
+            user_id=user_id,
+            stage_name="hotel_agent"
         )
     
     def handle_message(self, message: AgentMessage) -> Dict[str, Any]:
@@ -357,7 +305,8 @@ class WeatherQueryAgent(EnhancedAgent):
             enable_tool_calling=True,
             context_manager=context_manager,
             communication_hub=communication_hub,
-            user_id=user_id
+            user_id=user_id,
+            stage_name="weather_agent"
         )
     
     def run(self, input_text: str, max_tool_iterations: int = 3, **kwargs) -> str:
@@ -402,7 +351,8 @@ class PlannerAgent(EnhancedAgent):
             enable_tool_calling=False,
             context_manager=context_manager,
             communication_hub=communication_hub,
-            user_id=user_id
+            user_id=user_id,
+            stage_name="planner_agent"
         )
     
     def handle_message(self, message: AgentMessage) -> Dict[str, Any]:
@@ -12,6 +12,7 @@ from app.models.trip_model import (
     TripPlanResponse,
     TripTaskResponse,
     TripVersionsResponse,
+    UsageSummaryResponse,
 )
 from app.services.city_service import city_support_service
 from app.services.trip_service import TripService
@@ -54,6 +55,16 @@ def get_trip_list(
     return trip_service.list_trips(user_id=get_user_id(http_request))
 
 
+@router.get("/usage", response_model=UsageSummaryResponse)
+def get_usage_summary(
+    http_request: Request,
+    destination: Optional[str] = None,
+    days: int = 7,
+    trip_service: TripService = Depends(get_trip_service),
+):
+    return trip_service.get_usage_summary(user_id=get_user_id(http_request), destination=destination, days=days)
+
+
 @router.get("/city-support", response_model=CityListResponse)
 def list_city_support():
     cities = city_support_service.list_cities()
@@ -21,6 +21,52 @@ class Settings(BaseSettings):
     ZHIPU_API_KEY: Optional[str] = None
     MODELSCOPE_API_KEY: Optional[str] = None
 
+    LLM_CACHE_BACKEND: str = "disk"
+    LLM_CACHE_DIR: str = "llm_cache"
+    LLM_CACHE_TTL_SECONDS: int = 6 * 60 * 60
+    LLM_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    LLM_CACHE_MAX_ENTRIES: int = 10000
+    LLM_SEMANTIC_CACHE_ENABLED: bool = True
+    LLM_SEMANTIC_CACHE_THRESHOLD: float = 0.97
+    LLM_SEMANTIC_CACHE_MAX_ENTRIES: int = 2000
+
+    LLM_GATEWAY_MAX_CONCURRENCY: int = 8
+    LLM_GATEWAY_RPM: int = 0
+    LLM_GATEWAY_TPM: int = 0
+    LLM_GATEWAY_PROVIDER_LIMITS: Optional[str] = None
+    LLM_GATEWAY_SHARED_BUCKETS: bool = True
+    LLM_GATEWAY_QUEUE_TIMEOUT: float = 120.0
+    LLM_GATEWAY_MAX_RETRIES: int = 2
+    # 多端点路由（JSON数组），为空时使用自动检测的单一端点
+    LLM_ENDPOINTS: Optional[str] = None
+    LLM_ROUTER_WINDOW_SIZE: int = 100
+    LLM_HEDGE_MIN_DELAY: float = 1.0
+    LLM_HEDGE_MAX_DELAY: float = 30.0
+    # 按调用阶段选择模型（JSON对象），未配置的阶段使用 LLM_MODEL_ID
+    LLM_STAGE_MODELS: Optional[str] = None
+    LLM_USAGE_MAX_REQUEST_KEYS: int = 2000
+    LLM_USAGE_REQUEST_TTL_SECONDS: int = 3600
+    LLM_USAGE_ROLLUP_TTL_DAYS: int = 90
+    # 模型单价（JSON对象，每千token）：{"模型": {"prompt": 0.002, "completion": 0.006}}
+    LLM_MODEL_PRICING: Optional[str] = None
+    LLM_JSON_SCHEMA_PROVIDERS: str = "openai,vllm"
+    PLAN_REPAIR_MAX_ATTEMPTS: int = 1
+    HOTEL_RANKER_ENABLED: bool = True
+    HOTEL_RANKER_TOP_N: int = 5
+    # 熔断器默认参数（LLM端点、MCP服务器、Unsplash、Redis 各自独立熔断）
+    CIRCUIT_BREAKER_FAILURE_RATE: float = 0.5
+    CIRCUIT_BREAKER_SLOW_CALL_RATE: float = 0.8
+    CIRCUIT_BREAKER_WINDOW_SIZE: int = 20
+    CIRCUIT_BREAKER_MINIMUM_CALLS: int = 5
+    CIRCUIT_BREAKER_OPEN_SECONDS: float = 30.0
+    CIRCUIT_BREAKER_HALF_OPEN_CALLS: int = 2
+    # LLM熔断时用缓存的景点/酒店/天气和本地聚类生成降级行程
+    DEGRADED_PLAN_ENABLED: bool = True
+    DEGRADED_ATTRACTIONS_PER_DAY: int = 3
+    DESTINATION_CACHE_DIR: str = "destination_cache"
+    DESTINATION_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    DESTINATION_CACHE_TTL_SECONDS: int = 7 * 24 * 60 * 60
+
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     CORS_ORIGINS: str = "http://localhost:5173,http://localhost:3000"
@@ -32,7 +78,12 @@ class Settings(BaseSettings):
     UNSPLASH_SECRET_KEY: Optional[str] = None
 
     AMAP_API_KEY: str
-    AMAP_MCP_SERVER_URL: str = "http://127.0.0.1:8000"
+    AMAP_MCP_SERVER_URL: str = "http://127.0.0.1:8001/mcp"
+    # stdio：每个进程启动本地 amap-mcp-server；http：连接共享的 Streamable HTTP 服务器
+    AMAP_MCP_TRANSPORT: str = "stdio"
+    AMAP_MCP_HTTP_MAX_CONNECTIONS: int = 10
+    MCP_TOOL_CACHE_PATH: str = "mcp_cache/tool_schemas.json"
+    MCP_TOOL_CACHE_REFRESH_SECONDS: int = 3600
     CITY_CONFIG_PATH: str = "app/data/city_support.json"
 
     JWT_SECRET: str = "your-secret-key-change-in-production"
@@ -50,6 +101,36 @@ class Settings(BaseSettings):
     VECTOR_MEMORY_DIR: str = "vector_memory"
     EMBEDDING_MODEL: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
     VECTOR_DIM: int = 384
+    # 嵌入微批处理：单批最多文本数、收集请求的等待窗口（毫秒）
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+    EMBEDDING_BATCH_WAIT_MS: float = 5.0
+    # 嵌入缓存：memory（进程内LRU）/ redis（LRU + Redis float16 共享）/ none
+    EMBEDDING_CACHE_BACKEND: str = "memory"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 10000
+    EMBEDDING_CACHE_TTL_SECONDS: int = 7 * 24 * 60 * 60
+    # 知识索引向量数超过阈值后在后台迁移为近似索引（hnsw / ivf），召回率不足时保留平面索引
+    VECTOR_ANN_ENABLED: bool = True
+    VECTOR_ANN_THRESHOLD: int = 20000
+    VECTOR_ANN_TYPE: str = "hnsw"
+    VECTOR_ANN_MIN_RECALL: float = 0.9
+    VECTOR_ANN_RECALL_SAMPLES: int = 200
+    VECTOR_HNSW_M: int = 32
+    VECTOR_HNSW_EF_CONSTRUCTION: int = 80
+    VECTOR_HNSW_EF_SEARCH: int = 64
+    VECTOR_IVF_NLIST: int = 0
+    VECTOR_IVF_NPROBE: int = 16
+    # 向量记忆预写日志：超过该大小时压缩为快照；是否每次追加后 fsync
+    VECTOR_WAL_COMPACT_BYTES: int = 32 * 1024 * 1024
+    VECTOR_WAL_FSYNC: bool = False
+    # 快照索引以 mmap 方式加载（多进程共享页缓存）
+    VECTOR_INDEX_MMAP: bool = True
+    # 单写线程每批最多应用的写入数
+    VECTOR_WRITE_MAX_BATCH: int = 256
+    # 用户记忆向量存储方式：flat / sq_fp16 / sq_int8 / pq；压缩存储时按原始向量重排前 limit * 倍数个候选（0 关闭）
+    VECTOR_STORAGE: str = "flat"
+    VECTOR_PQ_M: int = 48
+    VECTOR_PQ_NBITS: int = 8
+    VECTOR_RERANK_FACTOR: int = 4
 
     ASYNC_TASK_WORKER_COUNT: int = 1
     ASYNC_TASK_LEASE_SECONDS: int = 30 * 60
@@ -76,3 +76,20 @@ class ImageServiceException(ExternalServiceException):
     """图片服务异常"""
     pass
 
+
+
+class CircuitBreakerOpenException(ServiceException):
+    """熔断器打开，调用被直接拒绝"""
+
+    def __init__(self, breaker: str, state: str, retry_after: float = 0.0):
+        """
+        Args:
+            breaker: 熔断器名称
+            state: 拒绝调用时熔断器的状态（open / half_open）
+            retry_after: 距离允许试探调用的剩余时间（秒）
+        """
+        super().__init__(
+            ErrorCode.CIRCUIT_BREAKER_OPEN,
+            details={"breaker": breaker, "state": state, "retry_after": round(retry_after, 1)},
+        )
+        self.breaker = breaker
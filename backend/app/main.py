@@ -13,6 +13,8 @@ from .middleware.auth import AuthMiddleware
 from .middleware.rate_limit import RateLimitMiddleware, RateLimiter
 from .middleware.request_id import RequestIDMiddleware
 from .observability.logger import setup_logger
+from .observability.metrics import metrics_registry
+from .services.async_bridge import get_event_loop_bridge
 from .services.vector_memory_service import vector_memory_service
 
 logger = setup_logger(
@@ -71,6 +73,10 @@ def _configure_routes(app: FastAPI) -> None:
     def health_check():
         return {"status": "ok"}
 
+    @app.get("/metrics", tags=["Health Check"])
+    def metrics():
+        return metrics_registry.snapshot()
+
 
 def _register_events(app: FastAPI) -> None:
     @app.on_event("startup")
@@ -79,5 +85,9 @@ def _register_events(app: FastAPI) -> None:
         logger.info("Vector memory stats", extra={"stats": vector_memory_service.get_stats()})
         get_trip_service().start_async_workers()
 
+    @app.on_event("shutdown")
+    def on_shutdown():
+        get_event_loop_bridge().stop()
+
 
 app = create_app()
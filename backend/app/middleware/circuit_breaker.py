@@ -1,117 +1,262 @@
 """
-熔断器实现 - 简化版本
-简单的失败计数和快速失败机制
+熔断器实现
+按滚动窗口统计失败率与慢调用比例，超过阈值后熔断并快速失败：
+- CLOSED：正常放行，最近 window_size 次调用中失败率或慢调用比例超过阈值时打开
+- OPEN：直接抛出 CircuitBreakerOpenException，不再等待依赖超时；open_seconds 后进入半开
+- HALF_OPEN：只放行 half_open_max_calls 个试探调用，全部成功则关闭，任一失败或过慢则重新打开
+状态、状态切换次数和被拒绝的调用数导出为指标。
 """
 import time
-from typing import Callable, Any
+from collections import deque
+from enum import Enum
 from threading import Lock
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, Type
+
+from app.config import settings
+from app.exceptions.custom_exceptions import CircuitBreakerOpenException
 from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+# 状态指标取值
+STATE_GAUGE_VALUES = {CircuitState.CLOSED: 0, CircuitState.HALF_OPEN: 1, CircuitState.OPEN: 2}
 
 
 class CircuitBreaker:
     """
-    简化的熔断器
-    失败达到阈值后熔断，一段时间后自动恢复
+    滚动窗口熔断器（线程安全）
     """
-    
+
     def __init__(
         self,
-        failure_threshold: int = 5,  # 失败次数阈值
-        timeout: float = 60.0  # 熔断后等待时间（秒）
+        name: str = "default",
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: Optional[float] = None,
+        slow_call_rate_threshold: float = 0.8,
+        window_size: int = 20,
+        minimum_calls: int = 5,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 2,
+        failure_exceptions: Tuple[Type[BaseException], ...] = (Exception,),
     ):
         """
         初始化熔断器
-        
+
         Args:
-            failure_threshold: 失败次数阈值
-            timeout: 熔断后等待时间（秒）
+            name: 熔断器名称（日志与指标标签）
+            failure_rate_threshold: 窗口内失败率达到该值时熔断
+            slow_call_seconds: 耗时超过该值的调用记为慢调用，None 表示不统计慢调用
+            slow_call_rate_threshold: 窗口内慢调用比例达到该值时熔断
+            window_size: 滚动窗口大小（最近N次调用）
+            minimum_calls: 窗口内调用数少于该值时不判断熔断
+            open_seconds: 熔断后进入半开状态前的等待时间（秒）
+            half_open_max_calls: 半开状态下放行的试探调用数
+            failure_exceptions: 计为失败的异常类型，其他异常（如参数错误）说明依赖可用，记为成功
         """
-        self.failure_threshold = failure_threshold
-        self.timeout = timeout
-        self.failure_count = 0
-        self.last_failure_time = 0.0
-        self.is_open = False
-        self.lock = Lock()
-    
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.window_size = window_size
+        self.minimum_calls = max(1, minimum_calls)
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self.failure_exceptions = failure_exceptions
+
+        self._lock = Lock()
+        self._state = CircuitState.CLOSED
+        # 每次调用记录 (是否失败, 是否慢调用)
+        self._window: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._half_open_permits = 0
+        self._half_open_successes = 0
+        self._rejected = 0
+        self._publish_state()
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            self._maybe_half_open_locked()
+            return self._state
+
+    def is_rejecting(self) -> bool:
+        """当前调用是否会被直接拒绝（不占用半开试探名额）"""
+        with self._lock:
+            if self._state == CircuitState.OPEN:
+                return time.monotonic() - self._opened_at < self.open_seconds
+            if self._state == CircuitState.HALF_OPEN:
+                return self._half_open_permits >= self.half_open_max_calls
+            return False
+
+    def _publish_state(self) -> None:
+        metrics_registry.set_gauge("circuit_breaker_state", STATE_GAUGE_VALUES[self._state], breaker=self.name)
+
+    def _transition_locked(self, state: CircuitState, reason: str) -> None:
+        previous, self._state = self._state, state
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+        if state in (CircuitState.CLOSED, CircuitState.HALF_OPEN):
+            self._window.clear()
+        self._half_open_permits = 0
+        self._half_open_successes = 0
+        self._publish_state()
+        metrics_registry.inc("circuit_breaker_transitions_total", breaker=self.name, to_state=state.value)
+        log = logger.warning if state == CircuitState.OPEN else logger.info
+        log(
+            "Circuit breaker state changed",
+            extra={"breaker": self.name, "from_state": previous.value, "to_state": state.value, "reason": reason},
+        )
+
+    def _maybe_half_open_locked(self) -> None:
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition_locked(CircuitState.HALF_OPEN, "open timeout elapsed")
+
+    def acquire(self) -> None:
+        """
+        申请一次调用许可
+
+        Raises:
+            CircuitBreakerOpenException: 熔断中，或半开状态的试探名额已用完
+        """
+        with self._lock:
+            self._maybe_half_open_locked()
+            if self._state == CircuitState.CLOSED:
+                return
+            if self._state == CircuitState.HALF_OPEN and self._half_open_permits < self.half_open_max_calls:
+                self._half_open_permits += 1
+                return
+            self._rejected += 1
+            retry_after = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+            state = self._state
+        metrics_registry.inc("circuit_breaker_rejected_total", breaker=self.name)
+        raise CircuitBreakerOpenException(self.name, state.value, retry_after)
+
+    def _is_slow(self, duration: Optional[float]) -> bool:
+        return self.slow_call_seconds is not None and duration is not None and duration >= self.slow_call_seconds
+
+    def record_success(self, duration: Optional[float] = None) -> None:
+        """记录一次成功调用（耗时超过阈值时同时记为慢调用）"""
+        self._record(failed=False, slow=self._is_slow(duration))
+
+    def record_failure(self, error: Optional[BaseException] = None, duration: Optional[float] = None) -> None:
+        """记录一次调用异常；不属于 failure_exceptions 的异常按成功处理"""
+        if error is not None and not isinstance(error, self.failure_exceptions):
+            self.record_success(duration)
+            return
+        self._record(failed=True, slow=self._is_slow(duration))
+
+    def _record(self, failed: bool, slow: bool) -> None:
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                if failed or slow:
+                    self._transition_locked(CircuitState.OPEN, "half-open trial call failed" if failed else "half-open trial call slow")
+                    return
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.half_open_max_calls:
+                    self._transition_locked(CircuitState.CLOSED, "half-open trial calls succeeded")
+                return
+            if self._state == CircuitState.OPEN:
+                # 熔断前已放行的调用迟到的结果
+                return
+
+            self._window.append((failed, slow))
+            calls = len(self._window)
+            if calls < self.minimum_calls:
+                return
+            failure_rate = sum(1 for outcome in self._window if outcome[0]) / calls
+            slow_rate = sum(1 for outcome in self._window if outcome[1]) / calls
+            if failure_rate >= self.failure_rate_threshold:
+                self._transition_locked(CircuitState.OPEN, f"failure rate {failure_rate:.2f}")
+            elif self.slow_call_seconds is not None and slow_rate >= self.slow_call_rate_threshold:
+                self._transition_locked(CircuitState.OPEN, f"slow call rate {slow_rate:.2f}")
+
     def call(self, func: Callable, *args, **kwargs) -> Any:
         """
         通过熔断器调用函数
-        
+
         Args:
             func: 要调用的函数
             *args: 位置参数
             **kwargs: 关键字参数
-        
+
         Returns:
             函数返回值
-        
+
         Raises:
-            Exception: 当熔断器打开时抛出异常
+            CircuitBreakerOpenException: 熔断器打开时直接抛出，不调用函数
         """
-        with self.lock:
-            # 检查是否应该从熔断状态恢复
-            if self.is_open:
-                if time.time() - self.last_failure_time >= self.timeout:
-                    # 超过等待时间，尝试恢复
-                    self.is_open = False
-                    self.failure_count = 0
-                    logger.info("熔断器已恢复，允许请求通过")
-                else:
-                    raise Exception("熔断器已打开，服务暂时不可用")
-        
-        # 执行函数
+        self.acquire()
+        started_at = time.monotonic()
         try:
             result = func(*args, **kwargs)
-            
-            # 成功后重置计数
-            with self.lock:
-                self.failure_count = 0
-            
-            return result
-            
-        except Exception as e:
-            # 失败时计数
-            with self.lock:
-                self.failure_count += 1
-                self.last_failure_time = time.time()
-                
-                # 达到阈值，打开熔断器
-                if self.failure_count >= self.failure_threshold and not self.is_open:
-                    self.is_open = True
-                    logger.error(
-                        f"失败次数达到阈值({self.failure_threshold})，熔断器已打开",
-                        extra={"failure_count": self.failure_count}
-                    )
-            
-            raise e
-    
+        except BaseException as exc:
+            self.record_failure(exc, time.monotonic() - started_at)
+            raise
+        self.record_success(time.monotonic() - started_at)
+        return result
+
     def reset(self):
         """重置熔断器"""
-        with self.lock:
-            self.is_open = False
-            self.failure_count = 0
-            self.last_failure_time = 0.0
-    
+        with self._lock:
+            self._transition_locked(CircuitState.CLOSED, "manual reset")
+
     def get_state(self) -> str:
         """获取当前状态"""
-        return "open" if self.is_open else "closed"
+        return self.state.value
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_half_open_locked()
+            calls = len(self._window)
+            failures = sum(1 for outcome in self._window if outcome[0])
+            slow = sum(1 for outcome in self._window if outcome[1])
+            return {
+                "state": self._state.value,
+                "window_calls": calls,
+                "failure_rate": round(failures / calls, 4) if calls else 0.0,
+                "slow_call_rate": round(slow / calls, 4) if calls else 0.0,
+                "rejected": self._rejected,
+            }
 
 
 class CircuitBreakerManager:
     """熔断器管理器"""
-    
+
     def __init__(self):
         self.breakers: dict[str, CircuitBreaker] = {}
         self.lock = Lock()
-    
+
+    @staticmethod
+    def _defaults() -> Dict[str, Any]:
+        return {
+            "failure_rate_threshold": settings.CIRCUIT_BREAKER_FAILURE_RATE,
+            "slow_call_rate_threshold": settings.CIRCUIT_BREAKER_SLOW_CALL_RATE,
+            "window_size": settings.CIRCUIT_BREAKER_WINDOW_SIZE,
+            "minimum_calls": settings.CIRCUIT_BREAKER_MINIMUM_CALLS,
+            "open_seconds": settings.CIRCUIT_BREAKER_OPEN_SECONDS,
+            "half_open_max_calls": settings.CIRCUIT_BREAKER_HALF_OPEN_CALLS,
+        }
+
     def get_breaker(self, name: str, **kwargs) -> CircuitBreaker:
-        """获取或创建熔断器"""
+        """获取或创建熔断器（未指定的参数使用 CIRCUIT_BREAKER_* 配置）"""
         if name not in self.breakers:
             with self.lock:
                 if name not in self.breakers:
-                    self.breakers[name] = CircuitBreaker(**kwargs)
+                    options = self._defaults()
+                    options.update(kwargs)
+                    self.breakers[name] = CircuitBreaker(name=name, **options)
         return self.breakers[name]
 
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: breaker.get_stats() for name, breaker in list(self.breakers.items())}
+
 
 # 全局熔断器管理器
 circuit_breaker_manager = CircuitBreakerManager()
+metrics_registry.register_collector("circuit_breakers", circuit_breaker_manager.get_stats)
@@ -35,8 +35,7 @@ def fallback_response(default_value: Any = None):
 def circuit_breaker_with_fallback(
     breaker_name: str,
     fallback_value: Any = None,
-    failure_threshold: int = 5,
-    timeout: float = 60.0
+    **breaker_options: Any
 ):
     """
     带降级的熔断器装饰器
@@ -45,8 +44,8 @@ def circuit_breaker_with_fallback(
     Args:
         breaker_name: 熔断器名称
         fallback_value: 降级时的返回值
-        failure_threshold: 失败次数阈值
-        timeout: 熔断后等待时间（秒）
+        **breaker_options: 熔断器参数（failure_rate_threshold、slow_call_seconds、open_seconds 等），
+            未指定时使用 CIRCUIT_BREAKER_* 配置
     
     Returns:
         装饰器函数
@@ -54,11 +53,7 @@ def circuit_breaker_with_fallback(
     from .circuit_breaker import circuit_breaker_manager
     
     def decorator(func: Callable) -> Callable:
-        breaker = circuit_breaker_manager.get_breaker(
-            breaker_name,
-            failure_threshold=failure_threshold,
-            timeout=timeout
-        )
+        breaker = circuit_breaker_manager.get_breaker(breaker_name, **breaker_options)
         
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -61,6 +61,7 @@ class TripPlanResponse(BaseModel):
     total_budget: BudgetBreakdown
     hotels: List[Hotel] = Field(default_factory=list)
     days: List[DailyPlan]
+    degraded: bool = Field(False, description="LLM unavailable; plan built from cached data without the model")
 
 
 class TripTaskResponse(BaseModel):
@@ -107,6 +108,34 @@ class CityListResponse(BaseModel):
     cities: List[str] = Field(default_factory=list)
 
 
+class UsageTotals(BaseModel):
+    """Aggregated LLM usage and estimated cost."""
+
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    request_count: int = 0
+    cache_hits: int = 0
+    cost: float = 0.0
+
+
+class DailyUsage(UsageTotals):
+    """LLM usage for a single day."""
+
+    date: str
+
+
+class UsageSummaryResponse(BaseModel):
+    """Recent LLM usage for a user, optionally filtered by destination."""
+
+    user_id: str
+    destination: Optional[str] = None
+    days: int
+    totals: UsageTotals
+    by_day: List[DailyUsage] = Field(default_factory=list)
+
+
 class MessageResponse(BaseModel):
     """Simple operation result."""
 
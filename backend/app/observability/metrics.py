@@ -0,0 +1,120 @@
+"""
+进程内指标注册表
+提供计数器、仪表盘和直方图（带分位数摘要），以及按需拉取的统计收集器，
+通过 /metrics 接口以JSON形式导出
+"""
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((str(key), str(value)) for key, value in labels.items()))
+
+
+def _format_series(name: str, label_key: LabelKey) -> str:
+    if not label_key:
+        return name
+    labels = ",".join(f"{key}={value}" for key, value in label_key)
+    return f"{name}{{{labels}}}"
+
+
+def _percentile(sorted_values: list, percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    position = min(len(sorted_values) - 1, int(round(percentile * (len(sorted_values) - 1))))
+    return float(sorted_values[position])
+
+
+class _Histogram:
+    """保留最近若干个样本的直方图，用于计算分位数"""
+
+    def __init__(self, reservoir_size: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=reservoir_size)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "avg": round(self.total / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "p50": round(_percentile(ordered, 0.50), 6),
+            "p95": round(_percentile(ordered, 0.95), 6),
+            "p99": round(_percentile(ordered, 0.99), 6),
+        }
+
+
+class MetricsRegistry:
+    """线程安全的指标注册表"""
+
+    def __init__(self, reservoir_size: int = 1024):
+        self._lock = threading.Lock()
+        self._reservoir_size = reservoir_size
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], _Histogram] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = _Histogram(self._reservoir_size)
+                self._histograms[key] = histogram
+            histogram.observe(value)
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, Any]]) -> None:
+        """注册按需拉取的统计函数（如缓存命中率），导出时调用"""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {_format_series(name, labels): value for (name, labels), value in self._counters.items()}
+            gauges = {_format_series(name, labels): value for (name, labels), value in self._gauges.items()}
+            histograms = {
+                _format_series(name, labels): histogram.summary()
+                for (name, labels), histogram in self._histograms.items()
+            }
+            collectors = dict(self._collectors)
+
+        collected: Dict[str, Any] = {}
+        for name, collector in collectors.items():
+            try:
+                collected[name] = collector()
+            except Exception as exc:
+                collected[name] = {"error": str(exc)}
+
+        return {
+            "counters": counters,
+            "gauges": gauges,
+            "histograms": histograms,
+            "collectors": collected,
+        }
+
+
+# 全局指标注册表
+metrics_registry = MetricsRegistry()
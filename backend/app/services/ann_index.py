@@ -0,0 +1,85 @@
+"""
+近似最近邻索引
+平面索引（IndexFlatIP）检索耗时随向量数线性增长。向量数超过阈值后，
+VectorMemoryService 在后台用现有向量构建 HNSW 或 IVF 索引，通过召回率检查后再替换平面索引。
+这里负责构建索引、应用检索参数和计算召回率。
+"""
+import math
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from app.config import settings
+
+# 召回率检查的 top-k
+RECALL_AT_K = 10
+
+
+def is_flat_index(index) -> bool:
+    return isinstance(index, faiss.IndexFlat)
+
+
+def index_kind(index) -> str:
+    """索引类型名称（用于日志与统计）"""
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat" if is_flat_index(index) else type(index).__name__
+
+
+def apply_search_params(index) -> None:
+    """按配置设置近似索引的检索参数（HNSW efSearch / IVF nprobe），平面索引不受影响"""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = settings.VECTOR_HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(settings.VECTOR_IVF_NPROBE, index.nlist)
+
+
+def build_ann_index(vectors: np.ndarray, kind: Optional[str] = None):
+    """
+    用已有向量构建内积近似索引，向量ID与写入顺序一致（与平面索引相同）
+
+    Args:
+        vectors: 形状为 (N, dim) 的归一化向量
+        kind: "hnsw" 或 "ivf"，默认使用 VECTOR_ANN_TYPE
+    """
+    kind = (kind or settings.VECTOR_ANN_TYPE or "hnsw").lower()
+    dim = vectors.shape[1]
+    if kind == "ivf":
+        # nlist 未配置时取 4 * sqrt(N)，并保证每个聚类至少有约 39 个训练样本
+        nlist = settings.VECTOR_IVF_NLIST or int(4 * math.sqrt(len(vectors)))
+        nlist = max(1, min(nlist, len(vectors) // 39))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        # 支持按ID取回向量
+        index.make_direct_map()
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, settings.VECTOR_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = settings.VECTOR_HNSW_EF_CONSTRUCTION
+        index.add(vectors)
+    else:
+        raise ValueError(f"Unsupported ANN index type: {kind}")
+    apply_search_params(index)
+    return index
+
+
+def measure_recall(index, vectors: np.ndarray, queries: np.ndarray, k: int = RECALL_AT_K) -> float:
+    """
+    以精确内积检索为基准计算 recall@k
+
+    Args:
+        index: 待检查的近似索引（包含 vectors 中的全部向量）
+        vectors: 建索引用的全部向量
+        queries: 检查用的查询向量
+    """
+    k = min(k, len(vectors))
+    if k == 0 or len(queries) == 0:
+        return 1.0
+    scores = queries @ vectors.T
+    exact = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    _, approximate = index.search(queries, k)
+    hits = sum(len(set(exact[row]) & set(approximate[row])) for row in range(len(queries)))
+    return hits / (len(queries) * k)
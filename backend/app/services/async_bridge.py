@@ -0,0 +1,148 @@
+"""
+后台事件循环桥接
+进程内共享一个在后台线程中常驻的事件循环，同步代码通过 run_sync 把协程提交到该循环执行：
+- 不再为每次调用新建线程池和事件循环
+- 协程始终运行在同一个循环上，MCP 会话、HTTP 客户端等异步资源可以跨调用复用
+- 提交时复制调用方的 contextvars（请求ID、LLM优先级等）
+"""
+import asyncio
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Dict, Optional
+
+from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
+
+
+class BackgroundEventLoop:
+    """在后台守护线程中运行的事件循环"""
+
+    def __init__(self, name: str = "async-bridge"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._timeouts = 0
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """返回后台事件循环，首次访问时启动后台线程"""
+        if self._loop is None or self._loop.is_closed():
+            with self._lock:
+                if self._loop is None or self._loop.is_closed():
+                    self._start_locked()
+        return self._loop
+
+    def _start_locked(self) -> None:
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run_forever():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(started.set)
+            loop.run_forever()
+
+        thread = threading.Thread(target=run_forever, name=self.name, daemon=True)
+        thread.start()
+        started.wait()
+        self._loop = loop
+        self._thread = thread
+        logger.info("Background event loop started", extra={"loop_name": self.name})
+
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro: Awaitable[Any]):
+        """提交协程并返回 concurrent.futures.Future（调用方的 contextvars 会随任务一起传递）"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        with self._lock:
+            self._submitted += 1
+        return future
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """
+        在后台事件循环中执行协程并阻塞等待结果
+
+        Args:
+            coro: 要执行的协程
+            timeout: 等待超时（秒），超时后取消协程并抛出 TimeoutError
+
+        Raises:
+            RuntimeError: 在后台事件循环线程内调用（会导致死锁）
+        """
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("不能在后台事件循环线程内同步等待协程")
+
+        future = self.submit(coro)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timeouts += 1
+            raise TimeoutError(f"协程执行超过 {timeout} 秒")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """取消未完成的任务并停止后台事件循环"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = None
+            self._thread = None
+        if loop is None or loop.is_closed():
+            return
+
+        async def cancel_pending():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(cancel_pending(), loop).result(timeout=timeout)
+        except Exception as exc:
+            logger.warning("Failed to cancel pending background tasks", extra={"error": str(exc)})
+        loop.call_soon_threadsafe(loop.stop)
+        if thread is not None:
+            thread.join(timeout=timeout)
+        loop.close()
+        logger.info("Background event loop stopped", extra={"loop_name": self.name})
+
+    def get_stats(self) -> Dict[str, Any]:
+        loop = self._loop
+        running = loop is not None and not loop.is_closed()
+        pending = 0
+        if running:
+            # all_tasks 在非循环线程中调用可能与任务创建竞争，仅用于监控
+            try:
+                pending = len(asyncio.all_tasks(loop))
+            except RuntimeError:
+                pending = -1
+        with self._lock:
+            return {
+                "running": running,
+                "pending_tasks": pending,
+                "submitted": self._submitted,
+                "timeouts": self._timeouts,
+            }
+
+
+_bridge: Optional[BackgroundEventLoop] = None
+_bridge_lock = threading.Lock()
+
+
+def get_event_loop_bridge() -> BackgroundEventLoop:
+    """获取进程内共享的后台事件循环"""
+    global _bridge
+    if _bridge is None:
+        with _bridge_lock:
+            if _bridge is None:
+                _bridge = BackgroundEventLoop()
+                metrics_registry.register_collector("async_bridge", _bridge.get_stats)
+    return _bridge
+
+
+def run_sync(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """在共享的后台事件循环中执行协程并返回结果（供同步代码调用）"""
+    return get_event_loop_bridge().run(coro, timeout=timeout)
@@ -0,0 +1,120 @@
+"""
+目的地数据缓存
+每次成功规划后保存该目的地结构化后的景点、酒店候选与天气预报，
+LLM 不可用时降级规划直接使用这些数据，不必再经过智能体和结构化整理。
+后端与 LLM 响应缓存相同（Redis 或本地磁盘），同一目的地的多次规划按名称/日期合并。
+"""
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
+from app.services.llm_cache import DiskCacheBackend, RedisCacheBackend
+
+# 每个目的地最多保留的候选数量
+MAX_ITEMS_PER_KIND = 40
+
+
+def _merge_by(existing: List[Dict[str, Any]], incoming: List[Dict[str, Any]], field: str) -> List[Dict[str, Any]]:
+    """按字段去重合并，新数据在前并覆盖同名旧数据"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for item in list(incoming or []) + list(existing or []):
+        if isinstance(item, dict) and item.get(field) and item[field] not in merged:
+            merged[item[field]] = item
+    return list(merged.values())[:MAX_ITEMS_PER_KIND]
+
+
+class DestinationDataCache:
+    """按目的地缓存景点、酒店与天气数据"""
+
+    def __init__(self, backend: Any, ttl_seconds: int):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+    @staticmethod
+    def _key(destination: str) -> str:
+        return hashlib.sha256(f"destination:{destination.strip()}".encode("utf-8")).hexdigest()
+
+    def _incr(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def load(self, destination: str) -> Optional[Dict[str, Any]]:
+        """
+        读取目的地数据
+
+        Returns:
+            {"attractions", "hotels", "forecast", "updated_at"}，没有缓存或读取失败时返回None
+        """
+        try:
+            entry = self.backend.get(self._key(destination))
+        except Exception as exc:
+            self._incr("errors")
+            logger.warning("Destination cache read failed", extra={"destination": destination, "error": str(exc)})
+            return None
+        self._incr("hits" if entry else "misses")
+        return entry or None
+
+    def save(
+        self,
+        destination: str,
+        attractions: Optional[List[Dict[str, Any]]] = None,
+        hotels: Optional[List[Dict[str, Any]]] = None,
+        forecast: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        """合并写入目的地数据，失败只记录日志"""
+        if not (attractions or hotels or forecast):
+            return
+        existing = self.load(destination) or {}
+        entry = {
+            "attractions": _merge_by(existing.get("attractions"), attractions, "name"),
+            "hotels": _merge_by(existing.get("hotels"), hotels, "name"),
+            "forecast": sorted(
+                _merge_by(existing.get("forecast"), forecast, "date"),
+                key=lambda item: str(item.get("date")),
+            ),
+            "updated_at": time.time(),
+        }
+        try:
+            self.backend.set(self._key(destination), entry, self.ttl_seconds)
+            self._incr("writes")
+        except Exception as exc:
+            self._incr("errors")
+            logger.warning("Destination cache write failed", extra={"destination": destination, "error": str(exc)})
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["backend"] = type(self.backend).__name__
+        return stats
+
+
+_cache_instance: Optional[DestinationDataCache] = None
+_cache_lock = threading.Lock()
+
+
+def _create_backend():
+    if (settings.LLM_CACHE_BACKEND or "").lower() == "redis":
+        try:
+            backend = RedisCacheBackend(max_entries=settings.LLM_CACHE_MAX_ENTRIES, key_prefix="destination_cache")
+            backend.redis.ping()
+            return backend
+        except Exception as exc:
+            logger.warning(f"目的地数据缓存无法使用Redis后端，回退到磁盘缓存: {exc}")
+    return DiskCacheBackend(settings.DESTINATION_CACHE_DIR, settings.DESTINATION_CACHE_MAX_BYTES)
+
+
+def get_destination_cache() -> DestinationDataCache:
+    """获取进程内共享的目的地数据缓存"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = DestinationDataCache(_create_backend(), settings.DESTINATION_CACHE_TTL_SECONDS)
+                metrics_registry.register_collector("destination_cache", _cache_instance.get_stats)
+    return _cache_instance
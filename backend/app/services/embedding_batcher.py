@@ -0,0 +1,111 @@
+"""
+嵌入微批处理
+SentenceTransformer 在 CPU 上逐条编码效率最低。并发请求提交的文本先进入队列，
+后台线程在几毫秒的窗口内收集多个请求，合并为一次 encode 调用，再把结果按请求拆分返回。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
+
+
+class EmbeddingBatcher:
+    """把并发的嵌入请求合并成批次交给模型编码"""
+
+    def __init__(
+        self,
+        encode: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "embedding-batcher",
+    ):
+        """
+        Args:
+            encode: 批量编码函数，输入文本列表，返回形状为 (N, dim) 的数组
+            max_batch_size: 单批最多文本数（单个请求超过时仍整体编码）
+            max_wait_ms: 收到第一个请求后最多等待多久（毫秒）再编码
+            name: 后台线程名称
+        """
+        self._encode = encode
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._texts = 0
+        self._requests = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: Sequence[str]) -> Future:
+        """提交一组文本，返回结果为 (len(texts), dim) 数组的 Future"""
+        future: Future = Future()
+        texts = list(texts)
+        if not texts:
+            future.set_result(np.zeros((0, 0), dtype="float32"))
+            return future
+        self._queue.put((texts, future))
+        return future
+
+    def embed(self, texts: Sequence[str], timeout: Optional[float] = None) -> np.ndarray:
+        """提交并等待编码结果"""
+        if threading.current_thread() is self._thread:
+            # 不能在批处理线程内等待自己处理的请求
+            return np.asarray(self._encode(list(texts)))
+        return self.submit(texts).result(timeout=timeout)
+
+    def _collect(self) -> List[Tuple[List[str], Future]]:
+        """阻塞等待第一个请求，然后在等待窗口内尽量凑满一批"""
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            pending = [(texts, future) for texts, future in batch if future.set_running_or_notify_cancel()]
+            if not pending:
+                continue
+            texts = [text for item_texts, _ in pending for text in item_texts]
+            try:
+                vectors = np.asarray(self._encode(texts))
+            except Exception as exc:
+                logger.error("Embedding batch failed", extra={"batch_size": len(texts), "error": str(exc)})
+                for _, future in pending:
+                    future.set_exception(exc)
+                continue
+
+            offset = 0
+            for item_texts, future in pending:
+                future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+            with self._lock:
+                self._batches += 1
+                self._texts += len(texts)
+                self._requests += len(pending)
+            metrics_registry.observe("embedding_batch_size", len(texts))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "texts": self._texts,
+                "requests": self._requests,
+                "avg_batch_size": round(self._texts / self._batches, 2) if self._batches else 0.0,
+                "queued": self._queue.qsize(),
+            }
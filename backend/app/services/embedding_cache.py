@@ -0,0 +1,169 @@
+"""
+文本嵌入缓存
+同一城市的知识检索查询、同一用户的重复查询每次都会重新编码。这里在模型前加一层缓存：
+- 键为 模型名 + 规范化文本（去首尾空白、合并连续空白）的哈希
+- 进程内 LRU 保存 float32 向量；可选 Redis 二级缓存以 float16 存储，多个实例共享
+命中时直接返回向量，不再经过模型前向计算。
+"""
+import base64
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.config import settings
+from app.observability.logger import default_logger as logger
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """规范化待编码文本：去掉首尾空白，连续空白合并为一个空格"""
+    return _WHITESPACE.sub(" ", text or "").strip()
+
+
+class RedisEmbeddingStore:
+    """Redis 二级缓存，向量以 float16 + base64 存储（兼容 decode_responses 连接）"""
+
+    def __init__(self, ttl_seconds: int, key_prefix: str = "embedding_cache"):
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+
+    @property
+    def redis(self):
+        # 延迟导入，避免在未使用Redis后端时建立连接
+        from app.services.redis_service import redis_service
+        return redis_service.redis
+
+    def _entry_key(self, key: str) -> str:
+        return f"{self.key_prefix}:{key}"
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        values = self.redis.mget([self._entry_key(key) for key in keys])
+        vectors: List[Optional[np.ndarray]] = []
+        for raw in values:
+            if raw is None:
+                vectors.append(None)
+                continue
+            vectors.append(np.frombuffer(base64.b64decode(raw), dtype="float16").astype("float32"))
+        return vectors
+
+    def set_many(self, items: Dict[str, np.ndarray]) -> None:
+        pipe = self.redis.pipeline()
+        for key, vector in items.items():
+            encoded = base64.b64encode(np.asarray(vector, dtype="float16").tobytes()).decode("ascii")
+            pipe.set(self._entry_key(key), encoded, ex=self.ttl_seconds)
+        pipe.execute()
+
+
+class EmbeddingCache:
+    """嵌入向量缓存（进程内 LRU + 可选 Redis），线程安全"""
+
+    def __init__(self, model_name: str, max_entries: int, remote: Optional[RedisEmbeddingStore] = None):
+        """
+        Args:
+            model_name: 嵌入模型名称，参与缓存键，换模型后旧向量不会被误用
+            max_entries: 进程内 LRU 最多保存的向量数
+            remote: Redis 二级缓存，None 表示只使用进程内缓存
+        """
+        self.model_name = model_name
+        self.max_entries = max(1, max_entries)
+        self.remote = remote
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "remote_hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+    def build_key(self, text: str) -> str:
+        """以模型名和规范化文本生成缓存键"""
+        return hashlib.sha256(f"{self.model_name}\n{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _put_locked(self, key: str, vector: np.ndarray) -> None:
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        批量读取缓存
+
+        Returns:
+            与 texts 一一对应的向量列表，未命中的位置为None
+        """
+        keys = [self.build_key(text) for text in texts]
+        results: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                results.append(vector)
+            self._stats["hits"] += sum(1 for vector in results if vector is not None)
+
+        missing = [position for position, vector in enumerate(results) if vector is None]
+        if missing and self.remote is not None:
+            try:
+                fetched = self.remote.get_many([keys[position] for position in missing])
+            except Exception as exc:
+                fetched = [None] * len(missing)
+                self._incr("errors")
+                logger.warning("Embedding cache remote read failed", extra={"error": str(exc)})
+            with self._lock:
+                for position, vector in zip(missing, fetched):
+                    if vector is not None:
+                        results[position] = vector
+                        self._put_locked(keys[position], vector)
+                        self._stats["remote_hits"] += 1
+
+        self._incr("misses", sum(1 for vector in results if vector is None))
+        return results
+
+    def set_many(self, texts: Sequence[str], vectors: Sequence[np.ndarray]) -> None:
+        """批量写入缓存，Redis 写入失败只记录日志"""
+        items = {self.build_key(text): np.asarray(vector, dtype="float32") for text, vector in zip(texts, vectors)}
+        if not items:
+            return
+        with self._lock:
+            for key, vector in items.items():
+                self._put_locked(key, vector)
+            self._stats["writes"] += len(items)
+        if self.remote is not None:
+            try:
+                self.remote.set_many(items)
+            except Exception as exc:
+                self._incr("errors")
+                logger.warning("Embedding cache remote write failed", extra={"error": str(exc)})
+
+    def _incr(self, name: str, delta: int = 1) -> None:
+        if delta:
+            with self._lock:
+                self._stats[name] += delta
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["remote_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["remote_hits"]) / lookups, 4) if lookups else 0.0
+        stats["backend"] = "redis" if self.remote is not None else "memory"
+        return stats
+
+
+def create_embedding_cache(model_name: str) -> Optional[EmbeddingCache]:
+    """按配置创建嵌入缓存，EMBEDDING_CACHE_BACKEND 为 none/off 时返回None"""
+    backend_name = (settings.EMBEDDING_CACHE_BACKEND or "").lower()
+    if backend_name in {"", "none", "off"}:
+        return None
+
+    remote = None
+    if backend_name == "redis":
+        try:
+            remote = RedisEmbeddingStore(settings.EMBEDDING_CACHE_TTL_SECONDS)
+            remote.redis.ping()
+        except Exception as exc:
+            remote = None
+            logger.warning(f"嵌入缓存无法使用Redis，仅使用进程内缓存: {exc}")
+    return EmbeddingCache(model_name, settings.EMBEDDING_CACHE_MAX_ENTRIES, remote)
@@ -0,0 +1,325 @@
+"""
+LLM响应缓存
+对完全相同的请求（模型、消息、温度、response_format）直接复用已有补全结果。
+支持 Redis 与本地磁盘两种后端，均带 TTL 与容量淘汰，按调用点通过 cache_policy 开启。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
+
+
+class CachePolicy:
+    """
+    单个调用点的缓存策略
+
+    只有显式传入 cache_policy 的 LLM 调用才会读写缓存，
+    因此个性化、不可复用的调用（如最终行程生成）默认不受影响。
+    semantic=True 时在精确匹配未命中后再查询语义缓存，只应用于允许近似复用的调用点。
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[int] = None,
+        namespace: str = "default",
+        semantic: bool = False,
+    ):
+        """
+        Args:
+            ttl_seconds: 缓存有效期（秒），为None时使用配置中的默认值
+            namespace: 调用点名称，用于日志、统计和语义缓存作用域隔离
+            semantic: 是否启用语义缓存（二级缓存）
+        """
+        self.ttl_seconds = ttl_seconds or settings.LLM_CACHE_TTL_SECONDS
+        self.namespace = namespace
+        self.semantic = semantic
+
+    def __repr__(self) -> str:
+        return (
+            f"CachePolicy(namespace={self.namespace}, ttl_seconds={self.ttl_seconds}, "
+            f"semantic={self.semantic})"
+        )
+
+
+def _empty_cache_stats() -> Dict[str, int]:
+    return {
+        "hits": 0,
+        "misses": 0,
+        "writes": 0,
+        "errors": 0,
+        "saved_prompt_tokens": 0,
+        "saved_completion_tokens": 0,
+        "saved_total_tokens": 0,
+    }
+
+
+class DiskCacheBackend:
+    """
+    本地磁盘缓存后端
+    每个条目一个JSON文件，按修改时间做近似LRU淘汰，总大小超过上限时删除最旧的文件
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = sum(path.stat().st_size for path in self._iter_entries())
+
+    def _iter_entries(self) -> List[Path]:
+        return list(self.cache_dir.glob("*/*.json"))
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        if record.get("expires_at", 0) < time.time():
+            self._remove(path)
+            return None
+
+        # 刷新修改时间，用作LRU的访问时间
+        os.utime(path, None)
+        return record.get("value")
+
+    def set(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> None:
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = json.dumps(
+            {"expires_at": time.time() + ttl_seconds, "value": value},
+            ensure_ascii=False,
+        )
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+
+        with self._lock:
+            previous_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+            self._total_bytes += path.stat().st_size - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict_locked()
+
+    def _remove(self, path: Path) -> None:
+        with self._lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                self._total_bytes -= size
+            except FileNotFoundError:
+                pass
+
+    def _evict_locked(self) -> None:
+        """淘汰最久未访问的条目，直到总大小降到上限的90%以下"""
+        target = int(self.max_bytes * 0.9)
+        entries = []
+        for path in self._iter_entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(key=lambda item: item[0])
+
+        evicted = 0
+        for _, size, path in entries:
+            if self._total_bytes <= target:
+                break
+            try:
+                path.unlink()
+                self._total_bytes -= size
+                evicted += 1
+            except FileNotFoundError:
+                continue
+
+        logger.info(
+            "LLM response cache evicted entries",
+            extra={"backend": "disk", "evicted": evicted, "total_bytes": self._total_bytes},
+        )
+
+
+class RedisCacheBackend:
+    """
+    Redis缓存后端
+    条目使用带过期时间的字符串键存储，另维护一个按访问时间排序的有序集合，
+    条目数超过上限时淘汰最久未访问的键
+    """
+
+    def __init__(self, max_entries: int, key_prefix: str = "llm_cache"):
+        self.max_entries = max_entries
+        self.key_prefix = key_prefix
+        self.index_key = f"{key_prefix}:index"
+
+    @property
+    def redis(self):
+        # 延迟导入，避免在未使用Redis后端时建立连接
+        from app.services.redis_service import redis_service
+        return redis_service.redis
+
+    def _entry_key(self, key: str) -> str:
+        return f"{self.key_prefix}:{key}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self.redis.get(self._entry_key(key))
+        if raw is None:
+            self.redis.zrem(self.index_key, key)
+            return None
+        self.redis.zadd(self.index_key, {key: time.time()})
+        return json.loads(raw)
+
+    def set(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> None:
+        pipe = self.redis.pipeline()
+        pipe.set(self._entry_key(key), json.dumps(value, ensure_ascii=False), ex=ttl_seconds)
+        pipe.zadd(self.index_key, {key: time.time()})
+        pipe.zcard(self.index_key)
+        _, _, size = pipe.execute()
+
+        overflow = int(size) - self.max_entries
+        if overflow > 0:
+            evicted = self.redis.zpopmin(self.index_key, overflow)
+            if evicted:
+                self.redis.delete(*[self._entry_key(member) for member, _ in evicted])
+                logger.info(
+                    "LLM response cache evicted entries",
+                    extra={"backend": "redis", "evicted": len(evicted)},
+                )
+
+
+class LLMResponseCache:
+    """
+    LLM精确匹配响应缓存
+    负责生成缓存键、读写后端并统计命中率与节省的token数
+    """
+
+    def __init__(self, backend: Any):
+        self.backend = backend
+        self._stats_lock = threading.Lock()
+        self._stats = _empty_cache_stats()
+
+    @staticmethod
+    def build_key(
+        model: Optional[str],
+        messages: List[Dict[str, str]],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        response_format: Optional[Dict[str, Any]] = None,
+        extra_params: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """
+        根据请求中影响输出的参数生成稳定的哈希键
+
+        extra_params 为调用时透传给模型的其他参数（top_p、stop、seed、tools 等），
+        为空时不写入，已有条目的键保持不变
+        """
+        request = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "response_format": response_format,
+        }
+        if extra_params:
+            request["extra_params"] = extra_params
+        payload = json.dumps(request, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _incr(self, **deltas: int) -> None:
+        with self._stats_lock:
+            for name, delta in deltas.items():
+                self._stats[name] += delta
+
+    def get(self, key: str, policy: CachePolicy) -> Optional[str]:
+        """读取缓存，命中时返回补全文本"""
+        try:
+            entry = self.backend.get(key)
+        except Exception as exc:
+            self._incr(errors=1)
+            logger.warning(
+                "LLM response cache read failed",
+                extra={"namespace": policy.namespace, "error": str(exc)},
+            )
+            return None
+
+        if not entry or entry.get("content") is None:
+            self._incr(misses=1)
+            return None
+
+        usage = entry.get("usage") or {}
+        self._incr(
+            hits=1,
+            saved_prompt_tokens=int(usage.get("prompt_tokens", 0)),
+            saved_completion_tokens=int(usage.get("completion_tokens", 0)),
+            saved_total_tokens=int(usage.get("total_tokens", 0)),
+        )
+        logger.debug("LLM response cache hit", extra={"namespace": policy.namespace})
+        return entry["content"]
+
+    def set(self, key: str, content: str, usage: Dict[str, int], policy: CachePolicy) -> None:
+        """写入缓存，失败时只记录日志"""
+        try:
+            self.backend.set(
+                key,
+                {"content": content, "usage": usage, "namespace": policy.namespace},
+                policy.ttl_seconds,
+            )
+            self._incr(writes=1)
+        except Exception as exc:
+            self._incr(errors=1)
+            logger.warning(
+                "LLM response cache write failed",
+                extra={"namespace": policy.namespace, "error": str(exc)},
+            )
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["backend"] = type(self.backend).__name__
+        return stats
+
+
+_cache_instance: Optional[LLMResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def _create_backend():
+    backend_name = (settings.LLM_CACHE_BACKEND or "disk").lower()
+    if backend_name == "redis":
+        try:
+            backend = RedisCacheBackend(max_entries=settings.LLM_CACHE_MAX_ENTRIES)
+            backend.redis.ping()
+            return backend
+        except Exception as exc:
+            logger.warning(f"LLM响应缓存无法使用Redis后端，回退到磁盘缓存: {exc}")
+    return DiskCacheBackend(settings.LLM_CACHE_DIR, settings.LLM_CACHE_MAX_BYTES)
+
+
+def get_llm_response_cache() -> Optional[LLMResponseCache]:
+    """获取进程内共享的LLM响应缓存，未启用时返回None"""
+    global _cache_instance
+    if (settings.LLM_CACHE_BACKEND or "").lower() in {"", "none", "off"}:
+        return None
+
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = LLMResponseCache(_create_backend())
+                metrics_registry.register_collector("llm_cache", _cache_instance.get_stats)
+                logger.info(
+                    f"LLM响应缓存初始化完成。Backend: {type(_cache_instance.backend).__name__}"
+                )
+    return _cache_instance
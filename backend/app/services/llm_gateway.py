@@ -0,0 +1,428 @@
+"""
+LLM网关
+在 LLMService 与服务商之间做准入控制：
+- 按服务商的并发信号量（带优先级队列，交互式 /plan 请求优先于异步任务）
+- RPM / TPM 令牌桶（可通过Redis在多个worker间共享）
+- 对 429 和瞬时错误做有界重试，并尊重 Retry-After
+- 导出排队等待时间等指标
+"""
+import heapq
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.config import settings
+from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
+
+# 优先级：数值越小越优先
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+llm_priority_var: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+def set_llm_priority(priority: int):
+    """设置当前上下文中LLM调用的优先级，返回用于恢复的token"""
+    return llm_priority_var.set(priority)
+
+
+def reset_llm_priority(token) -> None:
+    llm_priority_var.reset(token)
+
+
+class GatewayTimeoutError(Exception):
+    """在排队超时前未获得调用许可"""
+
+
+class PriorityConcurrencyLimiter:
+    """
+    带优先级的并发限制器
+    等待者按 (优先级, 到达顺序) 排队，只有队首且有空闲槽位时才能获得许可
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self._cond = threading.Condition()
+        self._waiters: List[tuple] = []
+        self._counter = itertools.count()
+        self._in_use = 0
+
+    def acquire(self, priority: int, timeout: Optional[float] = None) -> None:
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._cond:
+            entry = (priority, next(self._counter))
+            heapq.heappush(self._waiters, entry)
+            while not (self._in_use < self.max_concurrency and self._waiters[0] == entry):
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                    raise GatewayTimeoutError("LLM网关排队超时")
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiters)
+            self._in_use += 1
+            # 可能仍有空闲槽位，唤醒下一个等待者
+            self._cond.notify_all()
+
+    def release(self) -> None:
+        with self._cond:
+            self._in_use = max(0, self._in_use - 1)
+            self._cond.notify_all()
+
+    def get_state(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "in_use": self._in_use,
+                "queued": len(self._waiters),
+                "max_concurrency": self.max_concurrency,
+            }
+
+
+class LocalTokenBucket:
+    """进程内令牌桶，容量为每分钟配额"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def consume(self, amount: float) -> float:
+        """尝试消费令牌，成功返回0，否则返回需要等待的秒数"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill_locked()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def adjust(self, delta: float) -> None:
+        """按实际用量修正（delta>0 追加扣减，delta<0 返还），允许短暂透支"""
+        with self._lock:
+            self._refill_locked()
+            self._tokens = min(self.capacity, self._tokens - delta)
+
+
+_REDIS_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local amount = tonumber(ARGV[4])
+local mode = ARGV[5]
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if mode == 'consume' then
+  if tokens >= amount then
+    tokens = tokens - amount
+  else
+    wait = (amount - tokens) / rate
+  end
+else
+  tokens = math.min(capacity, tokens - amount)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket:
+    """基于Redis Lua脚本的共享令牌桶，多个worker进程共用同一份配额"""
+
+    def __init__(self, key: str, per_minute: int):
+        self.key = key
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._script = None
+
+    @property
+    def redis(self):
+        from app.services.redis_service import redis_service
+        return redis_service.redis
+
+    def _run(self, amount: float, mode: str) -> float:
+        if self._script is None:
+            self._script = self.redis.register_script(_REDIS_BUCKET_SCRIPT)
+        result = self._script(
+            keys=[self.key],
+            args=[self.capacity, self.rate, time.time(), amount, mode],
+        )
+        return float(result)
+
+    def consume(self, amount: float) -> float:
+        return self._run(min(amount, self.capacity), "consume")
+
+    def adjust(self, delta: float) -> None:
+        self._run(delta, "adjust")
+
+
+class _FallbackTokenBucket:
+    """优先使用共享桶，Redis不可用时退化为进程内桶"""
+
+    def __init__(self, shared: RedisTokenBucket, local: LocalTokenBucket):
+        self.shared = shared
+        self.local = local
+        self._warned = False
+
+    def _call(self, method: str, amount: float):
+        try:
+            return getattr(self.shared, method)(amount)
+        except Exception as exc:
+            if not self._warned:
+                logger.warning(f"共享令牌桶不可用，退化为进程内限流: {exc}")
+                self._warned = True
+            return getattr(self.local, method)(amount)
+
+    def consume(self, amount: float) -> float:
+        return self._call("consume", amount)
+
+    def adjust(self, delta: float) -> None:
+        self._call("adjust", delta)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    try:
+        import openai
+    except ImportError:
+        return False
+    return isinstance(
+        exc,
+        (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError),
+    )
+
+
+def _retry_after_seconds(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") if hasattr(headers, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    """单个服务商的LLM调用网关"""
+
+    def __init__(
+        self,
+        provider: str,
+        max_concurrency: int,
+        rpm: int = 0,
+        tpm: int = 0,
+        shared: bool = True,
+        queue_timeout: float = 120.0,
+        max_retries: int = 2,
+    ):
+        """
+        Args:
+            provider: 服务商名称（用于限流键和指标标签）
+            max_concurrency: 最大并发请求数
+            rpm: 每分钟请求数上限，0表示不限
+            tpm: 每分钟token数上限，0表示不限
+            shared: 是否通过Redis在多个worker间共享令牌桶
+            queue_timeout: 排队等待的最长时间（秒）
+            max_retries: 429/瞬时错误的最大重试次数
+        """
+        self.provider = provider
+        self.limiter = PriorityConcurrencyLimiter(max_concurrency)
+        self.rpm_bucket = self._create_bucket("rpm", rpm, shared)
+        self.tpm_bucket = self._create_bucket("tpm", tpm, shared)
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self._blocked_until = 0.0
+
+    def _create_bucket(self, kind: str, per_minute: int, shared: bool):
+        if per_minute <= 0:
+            return None
+        local = LocalTokenBucket(per_minute)
+        if not shared:
+            return local
+        return _FallbackTokenBucket(RedisTokenBucket(f"llm_gateway:{self.provider}:{kind}", per_minute), local)
+
+    @staticmethod
+    def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: Optional[int]) -> int:
+        """粗略估算一次调用的token数（中文约1字1token，英文约4字符1token）"""
+        prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+        return int(prompt_chars * 0.75) + min(int(max_tokens or 0), 1024)
+
+    def _wait_for_bucket(self, bucket, amount: float, deadline: float) -> None:
+        if bucket is None:
+            return
+        while True:
+            wait = bucket.consume(amount)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise GatewayTimeoutError("LLM网关限流等待超时")
+            time.sleep(min(wait, 1.0))
+
+    def _wait_for_unblock(self, deadline: float) -> None:
+        """等待 429 退避结束（退避期间可能被延长）；超过排队截止时间时抛出 GatewayTimeoutError"""
+        while True:
+            blocked_for = self._blocked_until - time.monotonic()
+            if blocked_for <= 0:
+                return
+            if time.monotonic() + blocked_for > deadline:
+                raise GatewayTimeoutError("LLM网关退避等待超时")
+            time.sleep(min(blocked_for, 1.0))
+
+    def _acquire_slot(self, priority: int, deadline: float) -> None:
+        """
+        退避结束后再排队获取并发槽位，退避期间不占用槽位；
+        排队期间又进入退避时让出槽位，退避结束后重新排队
+        """
+        while True:
+            self._wait_for_unblock(deadline)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise GatewayTimeoutError("LLM网关排队超时")
+            self.limiter.acquire(priority, timeout=remaining)
+            if self._blocked_until <= time.monotonic():
+                return
+            self.limiter.release()
+
+    @contextmanager
+    def admit(self, estimated_tokens: int, priority: Optional[int] = None) -> Iterator[None]:
+        """获取一次调用许可：等待 429 退避结束，优先级排队获取并发槽位，再等待RPM/TPM令牌"""
+        priority = llm_priority_var.get() if priority is None else priority
+        started_at = time.monotonic()
+        deadline = started_at + self.queue_timeout
+
+        self._acquire_slot(priority, deadline)
+        try:
+            self._wait_for_bucket(self.rpm_bucket, 1, deadline)
+            self._wait_for_bucket(self.tpm_bucket, estimated_tokens, deadline)
+
+            waited = time.monotonic() - started_at
+            metrics_registry.observe(
+                "llm_gateway_queue_wait_seconds",
+                waited,
+                provider=self.provider,
+                priority="interactive" if priority <= PRIORITY_INTERACTIVE else "background",
+            )
+            yield
+        finally:
+            self.limiter.release()
+
+    def record_actual_tokens(self, estimated_tokens: int, actual_tokens: int) -> None:
+        if self.tpm_bucket is not None and actual_tokens:
+            self.tpm_bucket.adjust(actual_tokens - estimated_tokens)
+
+    def _penalize(self, exc: Exception, attempt: int) -> float:
+        retry_after = _retry_after_seconds(exc)
+        backoff = retry_after if retry_after is not None else min(30.0, 0.5 * (2 ** attempt))
+        self._blocked_until = max(self._blocked_until, time.monotonic() + backoff)
+        metrics_registry.inc("llm_gateway_retries_total", provider=self.provider, error=type(exc).__name__)
+        return backoff
+
+    def execute(
+        self,
+        call: Callable[[], Any],
+        estimated_tokens: int,
+        priority: Optional[int] = None,
+        usage_tokens: Optional[Callable[[Any], int]] = None,
+    ) -> Any:
+        """在网关准入控制下执行一次非流式调用，429和瞬时错误会有界重试"""
+        attempt = 0
+        while True:
+            try:
+                with self.admit(estimated_tokens, priority):
+                    result = call()
+                if usage_tokens is not None:
+                    self.record_actual_tokens(estimated_tokens, usage_tokens(result))
+                return result
+            except Exception as exc:
+                if attempt >= self.max_retries or not _is_retryable(exc):
+                    raise
+                backoff = self._penalize(exc, attempt)
+                logger.warning(
+                    "LLM provider call throttled, retrying through gateway",
+                    extra={
+                        "provider": self.provider,
+                        "attempt": attempt + 1,
+                        "backoff_seconds": backoff,
+                        "error": str(exc),
+                    },
+                )
+                attempt += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = self.limiter.get_state()
+        stats["blocked_for_seconds"] = round(max(0.0, self._blocked_until - time.monotonic()), 3)
+        return stats
+
+
+_gateways: Dict[str, LLMGateway] = {}
+_gateways_lock = threading.Lock()
+
+
+def _provider_limits(*names: str) -> Dict[str, Any]:
+    """默认限流配置，依次叠加 LLM_GATEWAY_PROVIDER_LIMITS 中各名称（服务商、端点）的覆盖项"""
+    limits = {
+        "max_concurrency": settings.LLM_GATEWAY_MAX_CONCURRENCY,
+        "rpm": settings.LLM_GATEWAY_RPM,
+        "tpm": settings.LLM_GATEWAY_TPM,
+    }
+    if settings.LLM_GATEWAY_PROVIDER_LIMITS:
+        try:
+            overrides = json.loads(settings.LLM_GATEWAY_PROVIDER_LIMITS)
+            for name in names:
+                limits.update(overrides.get(name, {}))
+        except (TypeError, ValueError) as exc:
+            logger.warning(f"LLM_GATEWAY_PROVIDER_LIMITS 配置无法解析，使用默认限流: {exc}")
+    return limits
+
+
+def get_llm_gateway(provider: str, name: Optional[str] = None) -> LLMGateway:
+    """
+    获取（或创建）共享网关实例
+
+    Args:
+        provider: 服务商名称，决定默认限流配置
+        name: 端点名称，多端点路由时每个端点独立限流（LLM_GATEWAY_PROVIDER_LIMITS 可按名称覆盖）
+    """
+    key = name or provider
+    gateway = _gateways.get(key)
+    if gateway is not None:
+        return gateway
+
+    with _gateways_lock:
+        if key not in _gateways:
+            limits = _provider_limits(provider, key) if key != provider else _provider_limits(provider)
+            _gateways[key] = LLMGateway(
+                provider=key,
+                max_concurrency=int(limits["max_concurrency"]),
+                rpm=int(limits["rpm"]),
+                tpm=int(limits["tpm"]),
+                shared=settings.LLM_GATEWAY_SHARED_BUCKETS,
+                queue_timeout=settings.LLM_GATEWAY_QUEUE_TIMEOUT,
+                max_retries=settings.LLM_GATEWAY_MAX_RETRIES,
+            )
+            logger.info(f"LLM网关初始化完成。Gateway: {key}, Limits: {limits}")
+        return _gateways[key]
+
+
+def get_gateway_stats() -> Dict[str, Any]:
+    with _gateways_lock:
+        gateways = dict(_gateways)
+    return {provider: gateway.get_stats() for provider, gateway in gateways.items()}
+
+
+metrics_registry.register_collector("llm_gateway", get_gateway_stats)
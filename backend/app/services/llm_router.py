@@ -0,0 +1,428 @@
+"""
+LLM多端点路由
+在多个 OpenAI 兼容端点（vLLM、Ollama、智谱、ModelScope 等）之间按实时表现路由：
+- 每个端点维护滚动窗口内的延迟分位数（p50/p95）与错误率
+- 每次调用选择得分最优的端点，失败时切换到下一个端点
+- 对延迟敏感的调用点可开启对冲请求：主请求超过 p95 延迟仍未返回时，
+  向次优端点发出相同请求，取先成功的结果
+- 每个端点有独立熔断器，熔断中的端点排在最后并直接跳过，全部熔断时快速失败
+- 流式调用按同样的排序依次尝试，收到首个片段前失败即切换端点，首片段延迟（TTFT）计入端点统计
+"""
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional
+
+import openai
+from openai import OpenAI
+
+from app.config import settings
+from app.exceptions.custom_exceptions import CircuitBreakerOpenException
+from app.middleware.circuit_breaker import CircuitBreaker, circuit_breaker_manager
+from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
+
+from .llm_gateway import LLMGateway, get_llm_gateway
+
+# 默认各服务商的 Base URL（与 LLMService 自动检测保持一致）
+DEFAULT_BASE_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "zhipu": "https://open.bigmodel.cn/api/paas/v4/",
+    "modelscope": "https://api-inference.modelscope.cn/v1",
+}
+
+# 计入端点熔断的错误（参数错误、鉴权失败等不说明端点不可用）
+ENDPOINT_FAILURE_EXCEPTIONS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+    openai.RateLimitError,
+)
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    position = min(len(sorted_values) - 1, int(round(percentile * (len(sorted_values) - 1))))
+    return sorted_values[position]
+
+
+class EndpointStats:
+    """单个端点的滚动延迟与错误率统计"""
+
+    def __init__(self, window_size: int):
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=window_size)
+        self._outcomes: Deque[bool] = deque(maxlen=window_size)
+        self.in_flight = 0
+
+    def start(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def record(self, latency: float, success: bool) -> None:
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._outcomes.append(success)
+            if success:
+                self._latencies.append(latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self._latencies)
+            outcomes = list(self._outcomes)
+            in_flight = self.in_flight
+        failures = sum(1 for outcome in outcomes if not outcome)
+        return {
+            "samples": len(outcomes),
+            "p50": _percentile(ordered, 0.50),
+            "p95": _percentile(ordered, 0.95),
+            "error_rate": failures / len(outcomes) if outcomes else 0.0,
+            "in_flight": in_flight,
+        }
+
+
+class LLMEndpoint:
+    """一个可路由的 OpenAI 兼容端点"""
+
+    def __init__(
+        self,
+        name: str,
+        provider: str,
+        base_url: Optional[str],
+        api_key: Optional[str],
+        model: str,
+        models: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        window_size: int = 100,
+    ):
+        """
+        Args:
+            name: 端点名称（日志、指标和网关限流键）
+            provider: 服务商类型
+            base_url: OpenAI 兼容接口地址
+            api_key: API密钥
+            model: 默认模型
+            models: 该端点可服务的其他模型（用于按模型筛选端点），包含 "*" 时可服务任意模型
+            timeout: 请求超时（秒）
+            window_size: 滚动统计窗口大小
+        """
+        self.name = name
+        self.provider = provider
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.models = set(models or []) | {model}
+        # 重试交由网关处理，失败切换交由路由器处理
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout or settings.LLM_TIMEOUT,
+            max_retries=0,
+        )
+        self.gateway: LLMGateway = get_llm_gateway(provider, name)
+        self.stats = EndpointStats(window_size)
+        # 接近请求超时的调用记为慢调用
+        self.breaker: CircuitBreaker = circuit_breaker_manager.get_breaker(
+            f"llm:{name}",
+            slow_call_seconds=0.8 * (timeout or settings.LLM_TIMEOUT),
+            failure_exceptions=ENDPOINT_FAILURE_EXCEPTIONS,
+        )
+
+    def serves(self, model: Optional[str]) -> bool:
+        return model is None or model in self.models or "*" in self.models
+
+    def __repr__(self) -> str:
+        return f"LLMEndpoint(name={self.name}, provider={self.provider}, model={self.model})"
+
+
+class LLMRouter:
+    """按延迟和错误率在多个端点间路由LLM调用，支持对冲请求"""
+
+    def __init__(
+        self,
+        endpoints: List[LLMEndpoint],
+        min_samples: int = 5,
+        error_penalty: float = 4.0,
+        hedge_min_delay: float = 1.0,
+        hedge_max_delay: float = 30.0,
+    ):
+        """
+        Args:
+            endpoints: 端点列表，顺序作为无统计数据时的优先级
+            min_samples: 样本数少于该值的端点视为"探索中"，按配置顺序优先尝试
+            error_penalty: 错误率对得分的惩罚系数
+            hedge_min_delay: 对冲请求的最短等待时间（秒）
+            hedge_max_delay: 对冲请求的最长等待时间（秒）
+        """
+        if not endpoints:
+            raise ValueError("LLMRouter 至少需要一个端点")
+        self.endpoints = endpoints
+        self.min_samples = min_samples
+        self.error_penalty = error_penalty
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def primary(self) -> LLMEndpoint:
+        return self.endpoints[0]
+
+    def _score(self, snapshot: Dict[str, Any]) -> float:
+        """得分越低越好：p50延迟按错误率放大，并对排队中的请求数做轻微惩罚"""
+        latency = snapshot["p50"] or self.hedge_min_delay
+        return latency * (1 + self.error_penalty * snapshot["error_rate"]) * (1 + 0.1 * snapshot["in_flight"])
+
+    def rank(self, model: Optional[str] = None) -> List[LLMEndpoint]:
+        """返回按得分排序的候选端点（样本不足的端点排在前面以收集数据，熔断中的端点排在最后）"""
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.serves(model)] or list(self.endpoints)
+        if len(candidates) == 1:
+            return candidates
+
+        order = {endpoint.name: position for position, endpoint in enumerate(candidates)}
+        snapshots = {endpoint.name: endpoint.stats.snapshot() for endpoint in candidates}
+        rejecting = {endpoint.name for endpoint in candidates if endpoint.breaker.is_rejecting()}
+
+        def sort_key(endpoint: LLMEndpoint):
+            snapshot = snapshots[endpoint.name]
+            exploring = snapshot["samples"] < self.min_samples
+            return (
+                endpoint.name in rejecting,
+                0 if exploring else 1,
+                order[endpoint.name] if exploring else self._score(snapshot),
+            )
+
+        return sorted(candidates, key=sort_key)
+
+    def available(self, model: Optional[str] = None) -> bool:
+        """是否至少有一个可服务该模型的端点未处于熔断中"""
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.serves(model)] or self.endpoints
+        return any(not endpoint.breaker.is_rejecting() for endpoint in candidates)
+
+    def _hedge_delay(self, endpoint: LLMEndpoint) -> float:
+        snapshot = endpoint.stats.snapshot()
+        if snapshot["samples"] < self.min_samples:
+            return self.hedge_max_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, snapshot["p95"]))
+
+    @staticmethod
+    def _record_result(endpoint: LLMEndpoint, latency: float, error: Optional[Exception] = None) -> None:
+        """把一次调用的结果计入端点统计、熔断器与指标"""
+        endpoint.stats.record(latency, success=error is None)
+        if error is not None:
+            endpoint.breaker.record_failure(error, latency)
+            metrics_registry.inc("llm_router_requests_total", endpoint=endpoint.name, outcome="error")
+            return
+        endpoint.breaker.record_success(latency)
+        metrics_registry.inc("llm_router_requests_total", endpoint=endpoint.name, outcome="success")
+        metrics_registry.observe("llm_router_latency_seconds", latency, endpoint=endpoint.name)
+
+    def _timed_call(self, endpoint: LLMEndpoint, call: Callable[[LLMEndpoint], Any]) -> Any:
+        # 熔断中直接抛出 CircuitBreakerOpenException，不计入端点延迟统计
+        endpoint.breaker.acquire()
+        endpoint.stats.start()
+        started_at = time.monotonic()
+        try:
+            result = call(endpoint)
+        except Exception as exc:
+            self._record_result(endpoint, time.monotonic() - started_at, exc)
+            raise
+        self._record_result(endpoint, time.monotonic() - started_at)
+        return result
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=max(4, 2 * len(self.endpoints)),
+                        thread_name_prefix="llm-hedge",
+                    )
+        return self._executor
+
+    def execute(
+        self,
+        call: Callable[[LLMEndpoint], Any],
+        model: Optional[str] = None,
+        hedge: bool = False,
+    ) -> Any:
+        """
+        在最优端点上执行调用，失败时依次切换到后续端点
+
+        Args:
+            call: 接收端点并发起请求的函数
+            model: 请求的模型，用于筛选可服务该模型的端点
+            hedge: 是否对该调用启用对冲请求
+        """
+        ranked = self.rank(model)
+        if hedge and len(ranked) > 1:
+            return self._execute_hedged(call, ranked)
+
+        last_error: Optional[Exception] = None
+        for position, endpoint in enumerate(ranked):
+            try:
+                return self._timed_call(endpoint, call)
+            except CircuitBreakerOpenException as exc:
+                last_error = exc
+            except Exception as exc:
+                last_error = exc
+                if position + 1 < len(ranked):
+                    logger.warning(
+                        "LLM endpoint failed, failing over",
+                        extra={"endpoint": endpoint.name, "next_endpoint": ranked[position + 1].name, "error": str(exc)},
+                    )
+        raise last_error
+
+    def stream(self, call: Callable[[LLMEndpoint], Iterable[Any]], model: Optional[str] = None) -> Iterator[Any]:
+        """
+        在最优端点上执行流式调用，收到首个片段前失败时依次切换到后续端点
+
+        端点的延迟样本为首片段延迟（TTFT），与非流式调用共用同一份统计参与排序；
+        已输出片段后的失败无法切换，计为该端点的错误后抛出。
+
+        Args:
+            call: 接收端点并返回片段迭代器的函数（通常为生成器，在迭代时才发起请求）
+            model: 请求的模型，用于筛选可服务该模型的端点
+        """
+        ranked = self.rank(model)
+        last_error: Optional[Exception] = None
+        for position, endpoint in enumerate(ranked):
+            try:
+                endpoint.breaker.acquire()
+            except CircuitBreakerOpenException as exc:
+                last_error = exc
+                continue
+            endpoint.stats.start()
+            started_at = time.monotonic()
+            chunks = None
+            try:
+                chunks = iter(call(endpoint))
+                first = next(chunks)
+            except StopIteration:
+                # 空响应也是成功的调用
+                self._record_result(endpoint, time.monotonic() - started_at)
+                return
+            except Exception as exc:
+                self._record_result(endpoint, time.monotonic() - started_at, exc)
+                last_error = exc
+                if position + 1 < len(ranked):
+                    logger.warning(
+                        "LLM stream failed before first chunk, failing over",
+                        extra={"endpoint": endpoint.name, "next_endpoint": ranked[position + 1].name, "error": str(exc)},
+                    )
+                continue
+
+            ttft = time.monotonic() - started_at
+            error: Optional[Exception] = None
+            try:
+                yield first
+                yield from chunks
+            except GeneratorExit:
+                # 调用方提前停止读取，不算端点错误
+                raise
+            except Exception as exc:
+                error = exc
+                raise
+            finally:
+                self._record_result(endpoint, ttft, error)
+            return
+        raise last_error
+
+    def _execute_hedged(self, call: Callable[[LLMEndpoint], Any], ranked: List[LLMEndpoint]) -> Any:
+        """主端点超过 p95 延迟未返回时向次优端点发出对冲请求，取先成功者"""
+        executor = self._get_executor()
+        primary, backups = ranked[0], list(ranked[1:])
+        futures = {executor.submit(copy_context().run, self._timed_call, primary, call): primary}
+
+        done, _ = wait(futures, timeout=self._hedge_delay(primary))
+        last_error: Optional[Exception] = None
+        while True:
+            for future in done:
+                endpoint = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    last_error = exc
+                    logger.warning(
+                        "Hedged LLM request failed",
+                        extra={"endpoint": endpoint.name, "error": str(exc)},
+                    )
+                    continue
+                if endpoint is not primary:
+                    metrics_registry.inc("llm_router_hedge_wins_total", endpoint=endpoint.name)
+                # 未完成的请求无法中断，其结果仅用于更新端点统计
+                return result
+
+            # 主请求仍在进行（对冲）或已失败（切换），都向下一个端点发出请求
+            if backups:
+                backup = backups.pop(0)
+                if futures:
+                    metrics_registry.inc("llm_router_hedges_total", endpoint=backup.name)
+                    logger.info(
+                        "Sending hedged LLM request",
+                        extra={"primary": primary.name, "hedge_endpoint": backup.name},
+                    )
+                futures[executor.submit(copy_context().run, self._timed_call, backup, call)] = backup
+
+            if not futures:
+                raise last_error
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {}
+        for endpoint in self.endpoints:
+            snapshot = endpoint.stats.snapshot()
+            stats[endpoint.name] = {
+                "provider": endpoint.provider,
+                "model": endpoint.model,
+                "samples": snapshot["samples"],
+                "p50_seconds": round(snapshot["p50"], 3),
+                "p95_seconds": round(snapshot["p95"], 3),
+                "error_rate": round(snapshot["error_rate"], 4),
+                "in_flight": snapshot["in_flight"],
+                "breaker": endpoint.breaker.get_state(),
+            }
+        return stats
+
+
+def load_endpoints_from_settings() -> List[LLMEndpoint]:
+    """
+    从 LLM_ENDPOINTS（JSON数组）解析端点配置，未配置或解析失败时返回空列表
+
+    每个元素形如 {"name", "provider", "base_url", "api_key", "model", "models"}，
+    未给出 api_key 时回退到对应服务商的密钥配置。
+    """
+    if not settings.LLM_ENDPOINTS:
+        return []
+    try:
+        configs = json.loads(settings.LLM_ENDPOINTS)
+    except (TypeError, ValueError) as exc:
+        logger.warning(f"LLM_ENDPOINTS 配置无法解析，使用单一端点: {exc}")
+        return []
+
+    endpoints = []
+    for position, config in enumerate(configs):
+        provider = config.get("provider", "custom")
+        api_key = (
+            config.get("api_key")
+            or getattr(settings, f"{provider.upper()}_API_KEY", None)
+            or settings.LLM_API_KEY
+            # Ollama / vLLM 本地部署通常不校验密钥，但客户端要求非空
+            or "EMPTY"
+        )
+        endpoints.append(
+            LLMEndpoint(
+                name=config.get("name") or f"{provider}-{position}",
+                provider=provider,
+                base_url=config.get("base_url") or DEFAULT_BASE_URLS.get(provider),
+                api_key=api_key,
+                model=config.get("model") or settings.LLM_MODEL_ID or "gpt-4-turbo",
+                models=config.get("models"),
+                window_size=settings.LLM_ROUTER_WINDOW_SIZE,
+            )
+        )
+    return endpoints
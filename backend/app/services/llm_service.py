@@ -1,27 +1,25 @@
+import json
 import os
-import threading
+import time
 from typing import Iterator, Literal, Optional
 
-from openai import OpenAI
-
 from ..config import settings
+from ..exceptions.custom_exceptions import CircuitBreakerOpenException
 from ..observability.logger import default_logger as logger
+from ..observability.metrics import metrics_registry
+from .llm_cache import CachePolicy, get_llm_response_cache
+from .llm_router import LLMEndpoint, LLMRouter, load_endpoints_from_settings
+from .semantic_cache import get_semantic_llm_cache
+from .usage_ledger import get_usage_ledger
 
 Provider = Literal["openai", "zhipu", "modelscope", "ollama", "vllm", "custom"]
 
 
-def _empty_usage_stats() -> dict[str, int]:
-    return {
-        "prompt_tokens": 0,
-        "completion_tokens": 0,
-        "total_tokens": 0,
-        "request_count": 0,
-    }
-
 class LLMService:
     """
     一个智能的、支持多服务商的LLM服务。
-    它能根据环境变量自动检测并配置LLM提供商。
+    它能根据环境变量自动检测并配置LLM提供商；
+    配置 LLM_ENDPOINTS 时在多个端点间按延迟与错误率路由。
     """
     def __init__(self,
                  temperature: float = 0.7,
@@ -41,8 +39,10 @@ class LLMService:
         self.max_tokens = max_tokens
         self.timeout = timeout or int(os.getenv("LLM_TIMEOUT", "60"))
         self.kwargs = kwargs
-        self._usage_lock = threading.Lock()
-        self._usage_by_key: dict[str, dict[str, int]] = {}
+        self.usage_ledger = get_usage_ledger()
+        self.stage_profiles = self._load_stage_profiles()
+        self.response_cache = get_llm_response_cache()
+        self.semantic_cache = get_semantic_llm_cache()
         # 核心逻辑：自动检测和解析凭证
         self._auto_detect_provider()
         self._resolve_credentials()
@@ -50,13 +50,39 @@ class LLMService:
         if not self.api_key:
             logger.warning("LLM API Key 未配置，LLM服务可能无法正常工作。")
 
-        # 初始化OpenAI客户端（兼容多种服务）
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url,
-            timeout=settings.LLM_TIMEOUT
+        # 初始化端点路由（未配置 LLM_ENDPOINTS 时只有自动检测出的单一端点）
+        # 每个端点使用OpenAI兼容客户端，重试交由网关统一处理，失败切换交由路由器处理
+        endpoints = load_endpoints_from_settings()
+        if not endpoints:
+            endpoints = [
+                LLMEndpoint(
+                    name=self.provider,
+                    provider=self.provider,
+                    base_url=self.base_url,
+                    api_key=self.api_key,
+                    model=self.model,
+                    # 自动检测的端点不限制模型，按阶段配置的模型直接发往该端点
+                    models=["*"],
+                    window_size=settings.LLM_ROUTER_WINDOW_SIZE,
+                )
+            ]
+        self.router = LLMRouter(
+            endpoints,
+            hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY,
+            hedge_max_delay=settings.LLM_HEDGE_MAX_DELAY,
+        )
+        primary = self.router.primary
+        self.provider = primary.provider
+        self.base_url = primary.base_url
+        self.api_key = primary.api_key
+        self.model = primary.model
+        self.client = primary.client
+        self.gateway = primary.gateway
+        metrics_registry.register_collector("llm_router", self.router.get_stats)
+        logger.info(
+            f"LLM服务初始化完成。Provider: {self.provider}, Model: {self.model}, Base URL: {self.base_url}, "
+            f"Endpoints: {[endpoint.name for endpoint in endpoints]}"
         )
-        logger.info(f"LLM服务初始化完成。Provider: {self.provider}, Model: {self.model}, Base URL: {self.base_url}")
 
     def _auto_detect_provider(self):
         """
@@ -105,33 +131,129 @@ class LLMService:
         # 3. 解析模型ID
         self.model = settings.LLM_MODEL_ID or "gpt-4-turbo" # 提供一个默认值
 
+    @staticmethod
+    def _load_stage_profiles() -> dict[str, dict]:
+        """解析 LLM_STAGE_MODELS：调用阶段 -> {model, temperature, max_tokens}"""
+        if not settings.LLM_STAGE_MODELS:
+            return {}
+        try:
+            profiles = json.loads(settings.LLM_STAGE_MODELS)
+        except (TypeError, ValueError) as exc:
+            logger.warning(f"LLM_STAGE_MODELS 配置无法解析，所有阶段使用默认模型: {exc}")
+            return {}
+        if not isinstance(profiles, dict):
+            logger.warning("LLM_STAGE_MODELS 应为JSON对象，所有阶段使用默认模型")
+            return {}
+        return {stage: profile for stage, profile in profiles.items() if isinstance(profile, dict)}
+
+    def resolve_stage(self, stage: Optional[str]) -> dict:
+        """
+        获取调用阶段的模型配置
+
+        先精确匹配阶段名（如 "synthesis:hotel_agent"），再匹配冒号前的前缀（如 "synthesis"），
+        均未配置时返回空字典，调用方使用默认模型与参数。
+        """
+        if not stage or not self.stage_profiles:
+            return {}
+        if stage in self.stage_profiles:
+            return self.stage_profiles[stage]
+        return self.stage_profiles.get(stage.split(":", 1)[0], {})
+
+    def structured_response_format(self, name: str, schema: dict) -> dict:
+        """
+        生成结构化输出的 response_format
+
+        所有端点的服务商都支持 json_schema（见 LLM_JSON_SCHEMA_PROVIDERS）时使用 json_schema，
+        否则退回 json_object（仍保证输出为JSON，但不约束结构）。
+        """
+        supported = {provider.strip() for provider in settings.LLM_JSON_SCHEMA_PROVIDERS.split(",") if provider.strip()}
+        if all(endpoint.provider in supported for endpoint in self.router.endpoints):
+            return {
+                "type": "json_schema",
+                "json_schema": {"name": name, "schema": schema, "strict": False},
+            }
+        return {"type": "json_object"}
+
+    def is_available(self, stage: Optional[str] = None) -> bool:
+        """该阶段使用的模型是否有未熔断的端点（全部熔断时调用会立即失败）"""
+        return self.router.available(self.resolve_stage(stage).get('model') or self.model)
+
     def reset_usage_stats(self, usage_key: str) -> None:
-        with self._usage_lock:
-            self._usage_by_key[usage_key] = _empty_usage_stats()
+        self.usage_ledger.reset(usage_key)
 
     def get_usage_stats(self, usage_key: str) -> dict[str, int]:
-        with self._usage_lock:
-            stats = self._usage_by_key.get(usage_key, _empty_usage_stats())
-            return dict(stats)
+        return self.usage_ledger.get(usage_key)
 
-    def _record_usage(self, response, usage_key: Optional[str]) -> None:
-        if not usage_key:
-            return
+    def bind_usage(self, usage_key: str, user_id: Optional[str], destination: Optional[str] = None) -> None:
+        """将请求的用量归属到用户与目的地（用于按用户汇总和费用查询）"""
+        self.usage_ledger.bind(usage_key, user_id, destination)
+
+    def get_cache_stats(self) -> dict:
+        stats = self.response_cache.get_stats() if self.response_cache else {}
+        if self.semantic_cache:
+            stats["semantic"] = self.semantic_cache.get_stats()
+        return stats
 
+    @staticmethod
+    def _extract_usage(response) -> dict[str, int]:
         usage = getattr(response, "usage", None)
+        if not usage:
+            return {}
+        # 命中服务端前缀缓存的提示词token：OpenAI / vLLM / 智谱在 prompt_tokens_details.cached_tokens，
+        # DeepSeek 在 prompt_cache_hit_tokens
+        details = getattr(usage, "prompt_tokens_details", None)
+        if isinstance(details, dict):
+            cached = details.get("cached_tokens")
+        else:
+            cached = getattr(details, "cached_tokens", None)
+        if cached is None:
+            cached = getattr(usage, "prompt_cache_hit_tokens", None)
+        return {
+            "prompt_tokens": int(getattr(usage, "prompt_tokens", 0) or 0),
+            "completion_tokens": int(getattr(usage, "completion_tokens", 0) or 0),
+            "total_tokens": int(getattr(usage, "total_tokens", 0) or 0),
+            "cached_prompt_tokens": int(cached or 0),
+        }
+
+    def _record_usage(
+        self,
+        response,
+        usage_key: Optional[str],
+        model: Optional[str] = None,
+        stage: Optional[str] = None,
+    ) -> None:
+        usage = self._extract_usage(response)
         if not usage:
             return
+        self.usage_ledger.record(usage_key, usage, model=model or self.model, stage=stage)
+        labels = {"stage": stage or "default", "model": model or self.model}
+        metrics_registry.inc("llm_prompt_tokens_total", usage["prompt_tokens"], **labels)
+        metrics_registry.inc("llm_cached_prompt_tokens_total", usage["cached_prompt_tokens"], **labels)
+
+    def _record_cache_hit(self, usage_key: Optional[str], model: Optional[str] = None, stage: Optional[str] = None) -> None:
+        self.usage_ledger.record(usage_key, {}, model=model or self.model, stage=stage, cache_hit=True)
+
+    def _create_completion(self, priority: Optional[int] = None, hedge: bool = False, **params):
+        """
+        通过路由器选择端点，并在该端点的网关下发起一次非流式调用
+        （并发、RPM/TPM 限流与有界重试；端点失败时切换，hedge=True 时发出对冲请求）
+        """
+        requested_model = params.pop("model", None)
 
-        prompt_tokens = int(getattr(usage, "prompt_tokens", 0) or 0)
-        completion_tokens = int(getattr(usage, "completion_tokens", 0) or 0)
-        total_tokens = int(getattr(usage, "total_tokens", 0) or 0)
+        def call(endpoint: LLMEndpoint):
+            endpoint_params = dict(params)
+            endpoint_params["model"] = requested_model if endpoint.serves(requested_model) else endpoint.model
+            estimated_tokens = endpoint.gateway.estimate_tokens(
+                endpoint_params.get("messages", []), endpoint_params.get("max_tokens")
+            )
+            return endpoint.gateway.execute(
+                lambda: endpoint.client.chat.completions.create(**endpoint_params),
+                estimated_tokens=estimated_tokens,
+                priority=priority,
+                usage_tokens=lambda response: self._extract_usage(response).get("total_tokens", 0),
+            )
 
-        with self._usage_lock:
-            current = self._usage_by_key.setdefault(usage_key, _empty_usage_stats())
-            current["prompt_tokens"] += prompt_tokens
-            current["completion_tokens"] += completion_tokens
-            current["total_tokens"] += total_tokens
-            current["request_count"] += 1
+        return self.router.execute(call, model=requested_model, hedge=hedge)
 
     def generate_json_plan(self, prompt: str) -> str:
         """
@@ -144,7 +266,7 @@ class LLMService:
         logger.info(f"向LLM ({self.provider}) 发起行程规划请求...")
         try:
             usage_key = self.kwargs.get("usage_key")
-            response = self.client.chat.completions.create(
+            response = self._create_completion(
                 model=self.model, # 使用解析后的模型
                 messages=[
                     {"role": "system", "content": "You are a helpful travel planner. You will output a travel plan in JSON format based on user requirements."},
@@ -159,59 +281,216 @@ class LLMService:
         except Exception as e:
             logger.error(f"调用LLM API时发生错误: {e}", exc_info=True)
             return ""
-    def think(self, messages: list[dict[str, str]], temperature: Optional[float] = None) -> Iterator[str]:
+    def think(
+        self,
+        messages: list[dict[str, str]],
+        temperature: Optional[float] = None,
+        stage: Optional[str] = None,
+    ) -> Iterator[str]:
         """
         调用大语言模型进行思考，并返回流式响应。
         这是主要的调用方法，默认使用流式响应以获得更好的用户体验。
 
+        每次调用记录首token延迟（TTFT）、token间延迟和总生成时间，
+        按调用阶段输出到结构化日志和 /metrics。
+        端点选择与失败切换交由路由器：收到首个片段前失败时换下一个端点，已输出片段后失败直接抛出。
+
         Args:
             messages: 消息列表
-            temperature: 温度参数，如果未提供则使用初始化时的值
+            temperature: 温度参数，如果未提供则使用阶段配置或初始化时的值
+            stage: 调用阶段（用于按阶段选择模型和统计延迟）
 
         Yields:
             str: 流式响应的文本片段
         """
-        print(f"🧠 正在调用 {self.model} 模型...")
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=temperature if temperature is not None else self.temperature,
-                max_tokens=self.max_tokens,
-                stream=True,
-            )
+        profile = self.resolve_stage(stage)
+        model = profile.get('model') or self.model
+        if temperature is None:
+            temperature = profile.get('temperature', self.temperature)
+        max_tokens = profile.get('max_tokens', self.max_tokens)
+
+        def call(endpoint: LLMEndpoint) -> Iterator[str]:
+            # 整个输出期间占用该端点网关的并发槽位；生成器在路由器读取首个片段时才发起请求
+            estimated_tokens = endpoint.gateway.estimate_tokens(messages, max_tokens)
+            with endpoint.gateway.admit(estimated_tokens):
+                started_at = time.monotonic()
+                response = endpoint.client.chat.completions.create(
+                    model=model if endpoint.serves(model) else endpoint.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                )
 
-            # 处理流式响应
-            print("✅ 大语言模型响应成功:")
-            for chunk in response:
-                content = chunk.choices[0].delta.content or ""
-                if content:
-                    print(content, end="", flush=True)
-                    yield content
-            print()  # 在流式输出结束后换行
+                first_token_at = None
+                last_token_at = None
+                max_gap = 0.0
+                chunks = 0
+                try:
+                    for chunk in response:
+                        if not chunk.choices:
+                            continue
+                        content = chunk.choices[0].delta.content or ""
+                        if not content:
+                            continue
+                        now = time.monotonic()
+                        if first_token_at is None:
+                            first_token_at = now
+                        else:
+                            max_gap = max(max_gap, now - last_token_at)
+                        last_token_at = now
+                        chunks += 1
+                        yield content
+                finally:
+                    # 首个片段前失败的端点由路由器切换，不记录生成耗时
+                    if first_token_at is not None:
+                        self._record_stream_timing(
+                            stage=stage,
+                            model=model,
+                            endpoint=endpoint.name,
+                            started_at=started_at,
+                            first_token_at=first_token_at,
+                            last_token_at=last_token_at,
+                            max_gap=max_gap,
+                            chunks=chunks,
+                        )
+
+        try:
+            # 按端点排序依次尝试，收到首个片段前失败时切换端点，首片段延迟计入端点统计
+            yield from self.router.stream(call, model=model)
 
         except Exception as e:
-            print(f"❌ 调用LLM API时发生错误: {e}")
+            logger.error(
+                "LLM stream failed",
+                extra={"stage": stage or "default", "model": model, "error": str(e)},
+            )
             raise Exception(f"LLM调用失败: {str(e)}")
 
+    @staticmethod
+    def _record_stream_timing(
+        stage: Optional[str],
+        model: str,
+        endpoint: str,
+        started_at: float,
+        first_token_at: Optional[float],
+        last_token_at: Optional[float],
+        max_gap: float,
+        chunks: int,
+    ) -> None:
+        """记录一次流式调用的 TTFT、平均/最大token间延迟和总生成时间（日志字段避开含 token 的键名，以免被脱敏）"""
+        stage = stage or "default"
+        total = time.monotonic() - started_at
+        labels = {"stage": stage, "model": model}
+        metrics_registry.observe("llm_generation_seconds", total, mode="stream", **labels)
+
+        timing = {"stage": stage, "model": model, "endpoint": endpoint, "chunks": chunks, "total_ms": round(total * 1000, 1)}
+        if first_token_at is not None:
+            ttft = first_token_at - started_at
+            metrics_registry.observe("llm_ttft_seconds", ttft, **labels)
+            timing["ttft_ms"] = round(ttft * 1000, 1)
+            if chunks > 1:
+                avg_gap = (last_token_at - first_token_at) / (chunks - 1)
+                metrics_registry.observe("llm_inter_token_seconds", avg_gap, **labels)
+                timing["avg_chunk_gap_ms"] = round(avg_gap * 1000, 2)
+                timing["max_chunk_gap_ms"] = round(max_gap * 1000, 1)
+        logger.info("LLM stream completed", extra=timing)
+
     def invoke(self, messages: list[dict[str, str]], **kwargs) -> str:
         """
         非流式调用LLM，返回完整响应。
         适用于不需要流式输出的场景。
+
+        传入 cache_policy（CachePolicy）时，会先查询精确匹配的响应缓存，
+        策略开启 semantic 时再查询语义缓存，均未命中才调用模型并写回缓存；
+        不传则与原行为一致。
+
+        priority 可覆盖网关排队优先级，默认取当前上下文（交互式请求优先于异步任务）。
+        hedge=True 时，若配置了多个端点，主请求超过其 p95 延迟仍未返回会向次优端点发出对冲请求。
+
+        stage 标识调用阶段（智能体名称或结构化整理角色），按 LLM_STAGE_MODELS
+        选择该阶段的模型、温度和 max_tokens；显式传入的参数优先。
         """
         try:
             usage_key = kwargs.pop('usage_key', None)
-            temperature = kwargs.pop('temperature', self.temperature)
-            max_tokens = kwargs.pop('max_tokens', self.max_tokens)
-            response = self.client.chat.completions.create(
-                model=self.model,
+            priority = kwargs.pop('priority', None)
+            hedge = kwargs.pop('hedge', False)
+            cache_policy: Optional[CachePolicy] = kwargs.pop('cache_policy', None)
+            stage = kwargs.pop('stage', None)
+            profile = self.resolve_stage(stage)
+            model = kwargs.pop('model', None) or profile.get('model') or self.model
+            temperature = kwargs.pop('temperature', profile.get('temperature', self.temperature))
+            max_tokens = kwargs.pop('max_tokens', profile.get('max_tokens', self.max_tokens))
+
+            # 其余透传给模型的参数（top_p、stop、seed、tools 等）同样影响输出，计入缓存键与语义作用域
+            extra_params = {name: value for name, value in kwargs.items() if name != 'response_format'}
+
+            cache_key = None
+            if cache_policy is not None and self.response_cache is not None:
+                cache_key = self.response_cache.build_key(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    response_format=kwargs.get('response_format'),
+                    extra_params=extra_params,
+                )
+                cached_content = self.response_cache.get(cache_key, cache_policy)
+                if cached_content is not None:
+                    self._record_cache_hit(usage_key, model, stage)
+                    return cached_content
+
+            semantic_scope = None
+            semantic_vector = None
+            if cache_policy is not None and cache_policy.semantic and self.semantic_cache is not None:
+                context_messages, user_text = self.semantic_cache.split_prompt(messages)
+                semantic_scope = self.semantic_cache.build_scope(
+                    namespace=cache_policy.namespace,
+                    model=model,
+                    context_messages=context_messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    response_format=kwargs.get('response_format'),
+                    extra_params=extra_params,
+                )
+                semantic_vector = self.semantic_cache.embed(user_text)
+                cached_content = self.semantic_cache.lookup(semantic_scope, semantic_vector)
+                if cached_content is not None:
+                    self._record_cache_hit(usage_key, model, stage)
+                    return cached_content
+
+            started_at = time.monotonic()
+            response = self._create_completion(
+                priority=priority,
+                hedge=hedge,
+                model=model,
                 messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
                 **kwargs
             )
-            self._record_usage(response, usage_key)
-            return response.choices[0].message.content
+            metrics_registry.observe(
+                "llm_generation_seconds",
+                time.monotonic() - started_at,
+                mode="invoke",
+                stage=stage or "default",
+                model=model,
+            )
+            self._record_usage(response, usage_key, model, stage)
+            content = response.choices[0].message.content
+            if cache_key and content:
+                self.response_cache.set(cache_key, content, self._extract_usage(response), cache_policy)
+            if semantic_scope and content:
+                self.semantic_cache.add(
+                    semantic_scope,
+                    semantic_vector,
+                    content,
+                    self._extract_usage(response),
+                    cache_policy.ttl_seconds,
+                )
+            return content
+        except CircuitBreakerOpenException:
+            # 所有端点均在熔断中，保留错误码让调用方快速降级
+            raise
         except Exception as e:
             raise Exception(f"LLM调用失败: {str(e)}")
 
@@ -221,6 +500,6 @@ class LLMService:
         保持向后兼容性。
         """
         temperature = kwargs.get('temperature')
-        yield from self.think(messages, temperature)
+        yield from self.think(messages, temperature, stage=kwargs.get('stage'))
 # 创建一个服务实例，FastAPI的依赖注入系统将使用它
 llm_service = LLMService()
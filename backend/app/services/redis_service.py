@@ -9,6 +9,7 @@ from contextlib import contextmanager
 import redis
 from redis.exceptions import WatchError
 import bcrypt
+from app.middleware.circuit_breaker import CircuitBreaker, circuit_breaker_manager
 from app.observability.logger import default_logger as logger
 from app.config import settings
 import datetime
@@ -17,6 +18,42 @@ import datetime
 # 密码加密轮数
 BCRYPT_ROUNDS = settings.BCRYPT_ROUNDS
 
+# 阻塞命令的耗时取决于等待时长，不计为慢调用
+BLOCKING_COMMANDS = {"BLPOP", "BRPOP", "BRPOPLPUSH", "BLMOVE", "BZPOPMIN", "BZPOPMAX", "XREAD", "XREADGROUP", "WAIT"}
+
+
+class CircuitBreakingRedis(redis.Redis):
+    """
+    命令和管道执行都经过熔断器的Redis客户端
+    只有连接错误和超时计入熔断，WatchError、ResponseError 等说明Redis可用
+    """
+
+    def __init__(self, *args, breaker: CircuitBreaker, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker
+
+    def execute_command(self, *args, **options):
+        if args and str(args[0]).upper() in BLOCKING_COMMANDS:
+            self.breaker.acquire()
+            try:
+                result = super().execute_command(*args, **options)
+            except BaseException as exc:
+                self.breaker.record_failure(exc)
+                raise
+            self.breaker.record_success()
+            return result
+        return self.breaker.call(super().execute_command, *args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        execute = pipe.execute
+
+        def guarded_execute(raise_on_error: bool = True):
+            return self.breaker.call(execute, raise_on_error)
+
+        pipe.execute = guarded_execute
+        return pipe
+
 
 class RedisService:
     """
@@ -31,7 +68,12 @@ class RedisService:
     def _initialize_redis(self):
         """初始化Redis连接"""
         try:
-            self._redis_client = redis.Redis(
+            self._redis_client = CircuitBreakingRedis(
+                breaker=circuit_breaker_manager.get_breaker(
+                    "redis",
+                    slow_call_seconds=1.0,
+                    failure_exceptions=(redis.ConnectionError, redis.TimeoutError),
+                ),
                 host=settings.REDIS_HOST,
                 port=settings.REDIS_PORT,
                 db=settings.REDIS_DB,
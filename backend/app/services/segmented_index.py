@@ -0,0 +1,147 @@
+"""
+分段向量索引
+快照中的索引以 mmap 方式加载（IO_FLAG_MMAP_IFC），向量数据不读入进程内存，
+多个 worker 进程共享同一份页缓存；mmap 加载的索引是只读视图，快照之后的新增向量写入内存中的增量段。
+检索时合并两段结果，写快照时在锁外把两段合并为一个新索引。
+"""
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.config import settings
+from app.observability.logger import default_logger as logger
+
+
+def read_index(path: str):
+    """读取快照中的索引，VECTOR_INDEX_MMAP 开启时使用 mmap，失败时回退为普通读取"""
+    if settings.VECTOR_INDEX_MMAP:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)
+        except Exception as exc:
+            logger.warning("Memory-mapped index load failed, reading into memory", extra={"path": path, "error": str(exc)})
+    return faiss.read_index(path)
+
+
+class SegmentedIndex:
+    """
+    只读快照段（base）+ 可写增量段（delta）
+
+    with_ids=True：向量带显式ID（IndexIDMap2），base 中的ID都小于 base_limit
+    with_ids=False：向量ID即写入顺序，delta 中的第 i 个向量ID为 base.ntotal + i
+    """
+
+    def __init__(self, base, with_ids: bool, base_limit: Optional[int] = None):
+        self.base = base
+        self.with_ids = with_ids
+        if base_limit is None:
+            if with_ids:
+                ids = faiss.vector_to_array(base.id_map)
+                base_limit = int(ids.max()) + 1 if len(ids) else 0
+            else:
+                base_limit = base.ntotal
+        self.base_limit = base_limit
+        self.delta = faiss.IndexIDMap2(faiss.IndexFlatIP(base.d)) if with_ids else faiss.IndexFlatIP(base.d)
+        # 增量段中的ID（with_ids=True），用于重放日志时去重
+        self._delta_ids = set()
+
+    @property
+    def d(self) -> int:
+        return self.base.d
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + self.delta.ntotal
+
+    def add(self, vectors: np.ndarray, ids: Optional[np.ndarray] = None) -> None:
+        if self.with_ids:
+            self.delta.add_with_ids(vectors, ids)
+            self._delta_ids.update(int(memory_id) for memory_id in ids)
+        else:
+            self.delta.add(vectors)
+
+    def contains(self, memory_id: int) -> bool:
+        """
+        向量ID是否已在索引中
+
+        with_ids=True 时 ID 按写入顺序分配，快照段包含 base_limit 以下的全部ID；
+        with_ids=False 时 ID 即写入位置。
+        """
+        if not self.with_ids:
+            return memory_id < self.ntotal
+        return memory_id < self.base_limit or memory_id in self._delta_ids
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """在两段中分别检索 top-k 后按内积合并"""
+        distances, labels = [], []
+        for segment, offset in ((self.base, 0), (self.delta, 0 if self.with_ids else self.base.ntotal)):
+            if not segment.ntotal:
+                continue
+            segment_distances, segment_labels = segment.search(queries, min(k, segment.ntotal))
+            distances.append(segment_distances)
+            labels.append(np.where(segment_labels >= 0, segment_labels + offset, -1))
+        if not distances:
+            return np.full((len(queries), k), -np.inf, dtype='float32'), np.full((len(queries), k), -1, dtype='int64')
+
+        distances = np.concatenate(distances, axis=1)
+        labels = np.concatenate(labels, axis=1)
+        distances = np.where(labels >= 0, distances, -np.inf)
+        order = np.argsort(-distances, axis=1)[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        labels = np.take_along_axis(labels, order, axis=1)
+        if labels.shape[1] < k:
+            padding = k - labels.shape[1]
+            distances = np.pad(distances, ((0, 0), (0, padding)), constant_values=-np.inf)
+            labels = np.pad(labels, ((0, 0), (0, padding)), constant_values=-1)
+        return distances, labels
+
+    def reconstruct_batch(self, ids: np.ndarray) -> np.ndarray:
+        ids = np.asarray(ids, dtype='int64')
+        vectors = np.empty((len(ids), self.d), dtype='float32')
+        in_base = ids < self.base_limit
+        if in_base.any():
+            vectors[in_base] = self.base.reconstruct_batch(ids[in_base])
+        if not in_base.all():
+            delta_ids = ids[~in_base] if self.with_ids else ids[~in_base] - self.base.ntotal
+            vectors[~in_base] = self.delta.reconstruct_batch(delta_ids)
+        return vectors
+
+    def reconstruct_n(self, start: int, count: int) -> np.ndarray:
+        """按写入顺序取出向量（仅 with_ids=False）"""
+        return self.reconstruct_batch(np.arange(start, start + count, dtype='int64'))
+
+    def delta_entries(self, min_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """增量段中ID不小于 min_id 的 (向量, ID)"""
+        if not self.delta.ntotal:
+            return np.empty((0, self.d), dtype='float32'), np.empty(0, dtype='int64')
+        if self.with_ids:
+            ids = faiss.vector_to_array(self.delta.id_map)
+            vectors = self.delta.index.reconstruct_n(0, self.delta.ntotal)
+        else:
+            ids = np.arange(self.base.ntotal, self.ntotal, dtype='int64')
+            vectors = self.delta.reconstruct_n(0, self.delta.ntotal)
+        keep = ids >= min_id
+        return vectors[keep], ids[keep]
+
+    def snapshot_parts(self) -> Tuple[object, np.ndarray, np.ndarray]:
+        """
+        写快照所需的 (快照段, 增量向量, 增量ID)，在索引锁内调用
+
+        快照段创建后不再修改，只取引用；增量段复制一份，开销只与增量大小相关。
+        合并与序列化交给 merge_segments 在锁外完成。
+        """
+        vectors, ids = self.delta_entries(0)
+        return self.base, vectors, ids
+
+
+def merge_segments(base, vectors: np.ndarray, ids: np.ndarray, with_ids: bool):
+    """把快照段与增量合并为一个索引用于写快照，没有增量时直接返回快照段"""
+    if not len(ids):
+        return base
+    # mmap 视图不能写入，先序列化再反序列化得到自有内存的副本
+    index = faiss.deserialize_index(faiss.serialize_index(base))
+    if with_ids:
+        index.add_with_ids(vectors, ids)
+    else:
+        index.add(vectors)
+    return index
@@ -0,0 +1,227 @@
+"""
+LLM语义响应缓存（二级缓存）
+对用户可见部分语义相近的提示词复用已有补全结果。
+使用 VectorMemoryService 已加载的嵌入模型生成向量，在独立的 FAISS 索引中检索近邻。
+只应在允许近似复用的调用点开启（如结构化整理），不能用于最终的个性化行程生成。
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.config import settings
+from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
+
+
+def _empty_semantic_stats() -> Dict[str, int]:
+    return {
+        "hits": 0,
+        "misses": 0,
+        "writes": 0,
+        "errors": 0,
+        "saved_prompt_tokens": 0,
+        "saved_completion_tokens": 0,
+        "saved_total_tokens": 0,
+    }
+
+
+class _SemanticScope:
+    """同一作用域（相同模型、系统提示词和参数）内的向量索引与条目"""
+
+    def __init__(self, vector_dim: int):
+        self.index = faiss.IndexFlatIP(vector_dim)
+        self.entries: List[Dict[str, Any]] = []
+
+
+class SemanticLLMCache:
+    """
+    LLM语义缓存
+    作用域由模型、系统消息、历史消息、温度、response_format 和调用点共同决定，
+    只有最后一条用户消息参与向量检索，相似度超过阈值时返回缓存结果。
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        max_entries_per_scope: int,
+        memory_service: Optional[Any] = None,
+    ):
+        """
+        Args:
+            threshold: 命中所需的最小余弦相似度
+            max_entries_per_scope: 每个作用域保留的最大条目数
+            memory_service: 提供 embed_text 的向量记忆服务（为None时延迟获取单例）
+        """
+        self.threshold = threshold
+        self.max_entries_per_scope = max_entries_per_scope
+        self._memory_service = memory_service
+        self._scopes: Dict[str, _SemanticScope] = {}
+        self._lock = threading.Lock()
+        self._stats = _empty_semantic_stats()
+
+    @property
+    def memory_service(self):
+        if self._memory_service is None:
+            # 延迟导入，复用进程内已初始化的向量记忆服务单例
+            from app.services.vector_memory_service import VectorMemoryService
+            self._memory_service = VectorMemoryService()
+        return self._memory_service
+
+    @staticmethod
+    def split_prompt(messages: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], str]:
+        """拆分出最后一条用户消息（用于语义检索）与其余消息（用于作用域）"""
+        for position in range(len(messages) - 1, -1, -1):
+            if messages[position].get("role") == "user":
+                return messages[:position] + messages[position + 1:], messages[position].get("content", "")
+        return list(messages), ""
+
+    @staticmethod
+    def build_scope(
+        namespace: str,
+        model: Optional[str],
+        context_messages: List[Dict[str, str]],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        response_format: Optional[Dict[str, Any]] = None,
+        extra_params: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        scope = {
+            "namespace": namespace,
+            "model": model,
+            "messages": context_messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "response_format": response_format,
+        }
+        if extra_params:
+            scope["extra_params"] = extra_params
+        payload = json.dumps(scope, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _incr(self, **deltas: int) -> None:
+        for name, delta in deltas.items():
+            self._stats[name] += delta
+
+    def embed(self, text: str) -> Optional[np.ndarray]:
+        try:
+            vector = self.memory_service.embed_text(text)
+        except Exception as exc:
+            with self._lock:
+                self._incr(errors=1)
+            logger.warning("Semantic cache embedding failed", extra={"error": str(exc)})
+            return None
+        if not np.any(vector):
+            return None
+        return np.asarray(vector, dtype="float32").reshape(1, -1)
+
+    def lookup(self, scope_key: str, vector: Optional[np.ndarray]) -> Optional[str]:
+        """在作用域内检索最近邻，相似度达到阈值且未过期时返回缓存内容"""
+        if vector is None:
+            return None
+
+        with self._lock:
+            scope = self._scopes.get(scope_key)
+            if scope is None or scope.index.ntotal == 0:
+                self._incr(misses=1)
+                return None
+
+            distances, indices = scope.index.search(vector, 1)
+            position = int(indices[0][0])
+            similarity = float(distances[0][0])
+            if position < 0 or similarity < self.threshold:
+                self._incr(misses=1)
+                return None
+
+            entry = scope.entries[position]
+            if entry["expires_at"] < time.time():
+                self._incr(misses=1)
+                return None
+
+            usage = entry.get("usage") or {}
+            self._incr(
+                hits=1,
+                saved_prompt_tokens=int(usage.get("prompt_tokens", 0)),
+                saved_completion_tokens=int(usage.get("completion_tokens", 0)),
+                saved_total_tokens=int(usage.get("total_tokens", 0)),
+            )
+
+        logger.debug("Semantic LLM cache hit", extra={"similarity": round(similarity, 4)})
+        return entry["content"]
+
+    def add(
+        self,
+        scope_key: str,
+        vector: Optional[np.ndarray],
+        content: str,
+        usage: Dict[str, int],
+        ttl_seconds: int,
+    ) -> None:
+        if vector is None or not content:
+            return
+
+        with self._lock:
+            scope = self._scopes.get(scope_key)
+            if scope is None:
+                scope = _SemanticScope(vector.shape[1])
+                self._scopes[scope_key] = scope
+
+            scope.index.add(vector)
+            scope.entries.append(
+                {
+                    "content": content,
+                    "usage": usage,
+                    "vector": vector[0],
+                    "expires_at": time.time() + ttl_seconds,
+                }
+            )
+            self._incr(writes=1)
+
+            if len(scope.entries) > self.max_entries_per_scope:
+                self._compact_scope(scope)
+
+    def _compact_scope(self, scope: _SemanticScope) -> None:
+        """丢弃过期条目和最旧的一半条目后重建索引"""
+        now = time.time()
+        alive = [entry for entry in scope.entries if entry["expires_at"] >= now]
+        keep = alive[-(self.max_entries_per_scope // 2):] if self.max_entries_per_scope > 1 else alive[-1:]
+
+        scope.index.reset()
+        if keep:
+            scope.index.add(np.stack([entry["vector"] for entry in keep]).astype("float32"))
+        scope.entries = keep
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["scopes"] = len(self._scopes)
+            stats["entries"] = sum(len(scope.entries) for scope in self._scopes.values())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["threshold"] = self.threshold
+        return stats
+
+
+_semantic_cache: Optional[SemanticLLMCache] = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_llm_cache() -> Optional[SemanticLLMCache]:
+    """获取进程内共享的语义缓存，未启用时返回None"""
+    global _semantic_cache
+    if not settings.LLM_SEMANTIC_CACHE_ENABLED:
+        return None
+
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticLLMCache(
+                    threshold=settings.LLM_SEMANTIC_CACHE_THRESHOLD,
+                    max_entries_per_scope=settings.LLM_SEMANTIC_CACHE_MAX_ENTRIES,
+                )
+                metrics_registry.register_collector("llm_semantic_cache", _semantic_cache.get_stats)
+    return _semantic_cache
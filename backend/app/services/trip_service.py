@@ -20,11 +20,18 @@ from app.models.trip_model import (
     TripPlanResponse,
     TripTaskResponse,
     TripVersionsResponse,
+    UsageSummaryResponse,
 )
 from app.observability.logger import default_logger as logger
 from app.services.city_service import city_support_service
+from app.services.llm_gateway import (
+    PRIORITY_BACKGROUND,
+    reset_llm_priority,
+    set_llm_priority,
+)
 from app.services.llm_service import LLMService
 from app.services.redis_service import RedisService
+from app.services.usage_ledger import get_usage_ledger
 from app.services.vector_memory_service import vector_memory_service
 
 
@@ -211,6 +218,19 @@ class TripService:
         city_names = list(cities.keys()) if isinstance(cities, dict) else list(cities)
         return CityListResponse(count=len(city_names), cities=city_names)
 
+    def get_usage_summary(self, user_id: str, destination: Optional[str] = None, days: int = 7) -> UsageSummaryResponse:
+        if days < 1 or days > settings.LLM_USAGE_ROLLUP_TTL_DAYS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"days must be between 1 and {settings.LLM_USAGE_ROLLUP_TTL_DAYS}",
+            )
+        try:
+            usage = get_usage_ledger().get_recent_usage(user_id=user_id, destination=destination, days=days)
+        except Exception as exc:
+            logger.error("Failed to query LLM usage", extra={"user_id": user_id, "error": str(exc)})
+            raise HTTPException(status_code=503, detail="Usage data is temporarily unavailable")
+        return UsageSummaryResponse(**usage)
+
     def _validate_request(self, request: TripPlanRequest) -> None:
         if not request.destination or not request.destination.strip():
             raise BusinessException(
@@ -230,34 +250,36 @@ class TripService:
         city_info: Optional[Dict[str, Any]] = None,
     ) -> TripPlanResponse:
         city_info = city_info or city_support_service.get_city_support_info(request.destination)
-        final_plan = self._get_planner_agent().plan_trip(request=request, user_id=user_id)
-        if not final_plan:
-            raise BusinessException(
-                ErrorCode.TRIP_PLAN_FAILED,
-                details={"message": "Failed to generate trip plan"},
-            )
+        # 规划过程和保存结果产生的用户记忆（请求偏好、行程、行程偏好）在退出时作为一批编码
+        with vector_memory_service.batched_writes():
+            final_plan = self._get_planner_agent().plan_trip(request=request, user_id=user_id)
+            if not final_plan:
+                raise BusinessException(
+                    ErrorCode.TRIP_PLAN_FAILED,
+                    details={"message": "Failed to generate trip plan"},
+                )
 
-        trip_data = {
-            "destination": request.destination,
-            "start_date": request.start_date,
-            "end_date": request.end_date,
-            "preferences": request.preferences,
-            "hotel_preferences": request.hotel_preferences,
-            "budget": request.budget,
-            "trip_title": final_plan.trip_title,
-            "days": [day.model_dump() for day in final_plan.days],
-        }
-        vector_memory_service.store_user_trip(user_id, trip_data)
-        vector_memory_service.store_user_preference(
-            user_id,
-            "trip_preferences",
-            {
+            trip_data = {
                 "destination": request.destination,
+                "start_date": request.start_date,
+                "end_date": request.end_date,
                 "preferences": request.preferences,
                 "hotel_preferences": request.hotel_preferences,
                 "budget": request.budget,
-            },
-        )
+                "trip_title": final_plan.trip_title,
+                "days": [day.model_dump() for day in final_plan.days],
+            }
+            vector_memory_service.store_user_trip(user_id, trip_data)
+            vector_memory_service.store_user_preference(
+                user_id,
+                "trip_preferences",
+                {
+                    "destination": request.destination,
+                    "preferences": request.preferences,
+                    "hotel_preferences": request.hotel_preferences,
+                    "budget": request.budget,
+                },
+            )
         vector_memory_service.schedule_save()
 
         trip_id = str(uuid.uuid4())
@@ -277,6 +299,8 @@ class TripService:
         return TripPlanResponse(**full_trip_data)
 
     def _plan_task_worker(self, task_id: str, user_id: str, request_data: Dict[str, Any]) -> None:
+        # 异步任务的LLM调用在网关中排在交互式 /plan 请求之后
+        priority_token = set_llm_priority(PRIORITY_BACKGROUND)
         try:
             self.redis_service.update_trip_task(
                 task_id,
@@ -314,6 +338,8 @@ class TripService:
                 message="Trip generation failed",
                 error="trip_generation_failed",
             )
+        finally:
+            reset_llm_priority(priority_token)
 
     def _task_worker_loop(self, worker_id: str) -> None:
         logger.info("Trip task worker started", extra={"worker_id": worker_id})
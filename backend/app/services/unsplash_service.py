@@ -9,7 +9,10 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from app.exceptions.custom_exceptions import CircuitBreakerOpenException
+from app.middleware.circuit_breaker import circuit_breaker_manager
 from app.models.common_model import Attraction
+from app.services.async_bridge import run_sync
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +34,12 @@ class UnsplashService:
         self.cache_size = cache_size
         self.executor = ThreadPoolExecutor(max_workers=5)
         self.session = self._create_session()
+        # 接口不可用时快速失败，直接使用占位图，不再为每张图片等待重试和超时
+        self.breaker = circuit_breaker_manager.get_breaker(
+            "unsplash",
+            slow_call_seconds=5.0,
+            failure_exceptions=(requests.RequestException,),
+        )
         logger.info("Unsplash service initialized", extra={"cache_size": cache_size})
 
     def _create_session(self) -> requests.Session:
@@ -58,6 +67,26 @@ class UnsplashService:
         logger.debug("Searching photos from cache", extra={"query": query, "per_page": per_page})
         return self._search_photos_internal(query, per_page)
 
+    def _request_search(self, query: str, per_page: int) -> requests.Response:
+        response = self.session.get(
+            f"{self.base_url}/search/photos",
+            params={
+                "query": query,
+                "per_page": per_page,
+                "client_id": self.access_key,
+            },
+            headers={
+                "User-Agent": (
+                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                    "AppleWebKit/537.36 (KHTML, like Gecko) "
+                    "Chrome/120.0.0.0 Safari/537.36"
+                )
+            },
+            timeout=10,
+        )
+        response.raise_for_status()
+        return response
+
     def _search_photos_internal(self, query: str, per_page: int = 10) -> List[Dict]:
         if not self.access_key:
             logger.warning("Unsplash access key missing, skipping remote image search")
@@ -65,23 +94,7 @@ class UnsplashService:
 
         try:
             logger.info("Searching Unsplash images", extra={"query": query, "per_page": per_page})
-            response = self.session.get(
-                f"{self.base_url}/search/photos",
-                params={
-                    "query": query,
-                    "per_page": per_page,
-                    "client_id": self.access_key,
-                },
-                headers={
-                    "User-Agent": (
-                        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/120.0.0.0 Safari/537.36"
-                    )
-                },
-                timeout=10,
-            )
-            response.raise_for_status()
+            response = self.breaker.call(self._request_search, query, per_page)
 
             results = response.json().get("results", [])
             photos = [
@@ -94,6 +107,9 @@ class UnsplashService:
             ]
             logger.info("Unsplash images found", extra={"query": query, "count": len(photos)})
             return photos
+        except CircuitBreakerOpenException:
+            logger.debug("Unsplash circuit open, skipping remote image search", extra={"query": query})
+            return []
         except requests.RequestException as exc:
             logger.warning("Unsplash request failed", extra={"query": query, "error": str(exc)})
             return []
@@ -175,7 +191,7 @@ class UnsplashService:
         use_fallback: bool = True,
         use_cache: bool = True,
     ) -> List[Optional[str]]:
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         resolver = self.get_photo_url_async if use_cache else self._get_photo_url_without_cache
         tasks = [
             loop.run_in_executor(
@@ -233,7 +249,7 @@ class UnsplashService:
 
         image_url_by_query: Dict[str, Optional[str]] = {}
         if unique_queries:
-            image_urls = asyncio.run(
+            image_urls = run_sync(
                 self.fetch_images_batch(
                     queries=unique_queries,
                     use_fallback=use_fallback,
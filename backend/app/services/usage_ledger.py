@@ -0,0 +1,274 @@
+"""
+LLM用量台账
+- 按请求ID记录用量，内存中的请求条目有 TTL 与 LRU 上限，不再随进程运行无限增长
+- 每次调用同时按天汇总到 Redis：用户、调用阶段、模型、用户+目的地四个维度
+- 根据 LLM_MODEL_PRICING 估算费用，并提供按用户/目的地查询近期用量与费用的接口
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
+
+USAGE_FIELDS = (
+    "prompt_tokens",
+    "cached_prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "request_count",
+    "cache_hits",
+)
+
+
+def empty_usage_stats() -> Dict[str, int]:
+    return {field: 0 for field in USAGE_FIELDS}
+
+
+class _RequestUsage:
+    """单个请求的用量及其归属（用户、目的地）"""
+
+    def __init__(self):
+        self.stats = empty_usage_stats()
+        self.user_id: Optional[str] = None
+        self.destination: Optional[str] = None
+        self.touched_at = time.monotonic()
+
+
+class UsageLedger:
+    """LLM用量台账，内存中保存近期请求明细，Redis中保存按天汇总"""
+
+    def __init__(
+        self,
+        max_request_keys: int = 2000,
+        request_ttl_seconds: int = 3600,
+        rollup_ttl_days: int = 90,
+        pricing: Optional[Dict[str, Dict[str, float]]] = None,
+        key_prefix: str = "llm_usage",
+    ):
+        """
+        Args:
+            max_request_keys: 内存中最多保留的请求条目数（超出时淘汰最久未使用的）
+            request_ttl_seconds: 请求条目在最后一次更新后的保留时间（秒）
+            rollup_ttl_days: Redis 按天汇总数据的保留天数
+            pricing: 模型单价，{模型: {"prompt": 每千token价格, "completion": 每千token价格,
+                "cached_prompt": 命中前缀缓存的提示词每千token价格（可选，默认同 prompt）}}
+            key_prefix: Redis 键前缀
+        """
+        self.max_request_keys = max_request_keys
+        self.request_ttl_seconds = request_ttl_seconds
+        self.rollup_ttl_seconds = rollup_ttl_days * 24 * 60 * 60
+        self.pricing = pricing or {}
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._requests: "OrderedDict[str, _RequestUsage]" = OrderedDict()
+        self._rollup_errors = 0
+
+    @property
+    def redis(self):
+        # 延迟导入，Redis不可用时只影响汇总，不影响请求内统计
+        from app.services.redis_service import redis_service
+        return redis_service.redis
+
+    # ---- 请求级明细 ----
+
+    def _prune_locked(self) -> None:
+        expire_before = time.monotonic() - self.request_ttl_seconds
+        while self._requests:
+            usage_key, entry = next(iter(self._requests.items()))
+            if len(self._requests) <= self.max_request_keys and entry.touched_at >= expire_before:
+                break
+            self._requests.pop(usage_key)
+
+    def _touch_locked(self, usage_key: str) -> _RequestUsage:
+        entry = self._requests.get(usage_key)
+        if entry is None:
+            entry = _RequestUsage()
+            self._requests[usage_key] = entry
+        else:
+            self._requests.move_to_end(usage_key)
+        entry.touched_at = time.monotonic()
+        self._prune_locked()
+        return entry
+
+    def reset(self, usage_key: str) -> None:
+        with self._lock:
+            self._touch_locked(usage_key).stats = empty_usage_stats()
+
+    def bind(self, usage_key: str, user_id: Optional[str], destination: Optional[str] = None) -> None:
+        """将请求归属到用户与目的地，之后的用量会汇总到对应维度"""
+        with self._lock:
+            entry = self._touch_locked(usage_key)
+            entry.user_id = user_id
+            entry.destination = destination
+
+    def get(self, usage_key: str) -> Dict[str, int]:
+        with self._lock:
+            entry = self._requests.get(usage_key)
+            return dict(entry.stats) if entry else empty_usage_stats()
+
+    def record(
+        self,
+        usage_key: Optional[str],
+        usage: Dict[str, int],
+        model: Optional[str],
+        stage: Optional[str] = None,
+        cache_hit: bool = False,
+    ) -> None:
+        """
+        记录一次LLM调用（或缓存命中）的用量
+
+        Args:
+            usage_key: 请求ID，为None时只做全局汇总
+            usage: prompt_tokens / cached_prompt_tokens / completion_tokens / total_tokens
+            model: 实际使用的模型
+            stage: 调用阶段
+            cache_hit: 是否为缓存命中（不产生token消耗）
+        """
+        delta = empty_usage_stats()
+        if cache_hit:
+            delta["cache_hits"] = 1
+        else:
+            for field in ("prompt_tokens", "cached_prompt_tokens", "completion_tokens", "total_tokens"):
+                delta[field] = int(usage.get(field, 0))
+            delta["request_count"] = 1
+
+        user_id = destination = None
+        if usage_key:
+            with self._lock:
+                entry = self._touch_locked(usage_key)
+                for field, value in delta.items():
+                    entry.stats[field] += value
+                user_id, destination = entry.user_id, entry.destination
+
+        self._rollup(delta, model=model, stage=stage, user_id=user_id, destination=destination)
+
+    # ---- Redis 按天汇总 ----
+
+    def estimate_cost(
+        self,
+        model: Optional[str],
+        prompt_tokens: int,
+        completion_tokens: int,
+        cached_prompt_tokens: int = 0,
+    ) -> float:
+        price = self.pricing.get(model or "", {})
+        prompt_price = float(price.get("prompt", 0.0))
+        cached_price = float(price.get("cached_prompt", prompt_price))
+        cached_prompt_tokens = min(cached_prompt_tokens, prompt_tokens)
+        return (
+            (prompt_tokens - cached_prompt_tokens) * prompt_price
+            + cached_prompt_tokens * cached_price
+            + completion_tokens * float(price.get("completion", 0.0))
+        ) / 1000
+
+    def _rollup_key(self, day: str, dimension: str, *values: str) -> str:
+        return ":".join([self.key_prefix, day, dimension, *values])
+
+    def _rollup(
+        self,
+        delta: Dict[str, int],
+        model: Optional[str],
+        stage: Optional[str],
+        user_id: Optional[str],
+        destination: Optional[str],
+    ) -> None:
+        day = date.today().isoformat()
+        keys = [
+            self._rollup_key(day, "model", model or "unknown"),
+            self._rollup_key(day, "stage", stage or "default"),
+        ]
+        if user_id:
+            keys.append(self._rollup_key(day, "user", user_id))
+            if destination:
+                keys.append(self._rollup_key(day, "user_dest", user_id, destination))
+
+        cost = self.estimate_cost(
+            model, delta["prompt_tokens"], delta["completion_tokens"], delta["cached_prompt_tokens"]
+        )
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key in keys:
+                for field, value in delta.items():
+                    if value:
+                        pipe.hincrby(key, field, value)
+                if cost:
+                    pipe.hincrbyfloat(key, "cost", cost)
+                pipe.expire(key, self.rollup_ttl_seconds)
+            pipe.execute()
+        except Exception as exc:
+            with self._lock:
+                self._rollup_errors += 1
+            logger.warning("LLM usage rollup failed", extra={"model": model, "stage": stage, "error": str(exc)})
+
+    def _sum_days(self, dimension: str, values: List[str], days: int) -> Dict[str, Any]:
+        today = date.today()
+        day_keys = [(today - timedelta(days=offset)).isoformat() for offset in range(days)]
+        pipe = self.redis.pipeline(transaction=False)
+        for day in day_keys:
+            pipe.hgetall(self._rollup_key(day, dimension, *values))
+        rows = pipe.execute()
+
+        totals: Dict[str, Any] = dict(empty_usage_stats(), cost=0.0)
+        by_day = []
+        for day, row in zip(day_keys, rows):
+            if not row:
+                continue
+            decoded = {
+                (field.decode() if isinstance(field, bytes) else field): (value.decode() if isinstance(value, bytes) else value)
+                for field, value in row.items()
+            }
+            day_stats: Dict[str, Any] = {field: int(decoded.get(field, 0)) for field in USAGE_FIELDS}
+            day_stats["cost"] = round(float(decoded.get("cost", 0.0)), 6)
+            for field, value in day_stats.items():
+                totals[field] += value
+            by_day.append(dict(day_stats, date=day))
+        totals["cost"] = round(totals["cost"], 6)
+        return {"totals": totals, "by_day": by_day}
+
+    def get_recent_usage(self, user_id: str, destination: Optional[str] = None, days: int = 7) -> Dict[str, Any]:
+        """查询用户最近若干天（含今天）的用量与费用，可按目的地过滤"""
+        if destination:
+            result = self._sum_days("user_dest", [user_id, destination], days)
+        else:
+            result = self._sum_days("user", [user_id], days)
+        result.update({"user_id": user_id, "destination": destination, "days": days})
+        return result
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"tracked_requests": len(self._requests), "rollup_errors": self._rollup_errors}
+
+
+def _load_pricing() -> Dict[str, Dict[str, float]]:
+    if not settings.LLM_MODEL_PRICING:
+        return {}
+    try:
+        return json.loads(settings.LLM_MODEL_PRICING)
+    except (TypeError, ValueError) as exc:
+        logger.warning(f"LLM_MODEL_PRICING 配置无法解析，费用将按0计算: {exc}")
+        return {}
+
+
+_ledger: Optional[UsageLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+    """获取进程内共享的用量台账"""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = UsageLedger(
+                    max_request_keys=settings.LLM_USAGE_MAX_REQUEST_KEYS,
+                    request_ttl_seconds=settings.LLM_USAGE_REQUEST_TTL_SECONDS,
+                    rollup_ttl_days=settings.LLM_USAGE_ROLLUP_TTL_DAYS,
+                    pricing=_load_pricing(),
+                )
+                metrics_registry.register_collector("llm_usage_ledger", _ledger.get_stats)
+    return _ledger
@@ -0,0 +1,186 @@
+"""
+压缩向量存储
+用户记忆索引可以用标量量化（fp16 / int8）或乘积量化（PQ）保存向量，384 维向量每条从 1536 字节
+降到 768 / 384 / VECTOR_PQ_M 字节。量化后的内积是近似值，原始 float32 向量另存一份
+追加写文件（ExactVectorStore），以 mmap 按行读取，只用于对候选结果做精确重排，不常驻内存。
+"""
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from app.config import settings
+from app.observability.logger import default_logger as logger
+
+STORAGE_KINDS = ("flat", "sq_fp16", "sq_int8", "pq")
+
+# 训练量化器时最多使用的样本数
+MAX_TRAINING_SAMPLES = 65536
+
+
+def _inner_index(index):
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+
+def storage_kind(index) -> str:
+    """索引的向量存储方式（IndexIDMap2 按内部索引判断）"""
+    inner = _inner_index(index)
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16:
+            return "sq_fp16"
+        if inner.sq.qtype == faiss.ScalarQuantizer.QT_8bit:
+            return "sq_int8"
+        return f"sq_{inner.sq.qtype}"
+    if isinstance(inner, faiss.IndexPQ):
+        return "pq"
+    return "flat" if isinstance(inner, faiss.IndexFlat) else type(inner).__name__
+
+
+def bytes_per_vector(index) -> int:
+    """每条向量在索引中占用的字节数"""
+    return _inner_index(index).sa_code_size()
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """PQ 子空间数须整除维度，取不超过 VECTOR_PQ_M 的最大约数"""
+    m = max(1, min(settings.VECTOR_PQ_M, dim))
+    while dim % m:
+        m -= 1
+    return m
+
+
+def min_training_vectors(kind: str) -> int:
+    """构建该存储方式至少需要的向量数（PQ 每个码本中心约 39 个训练样本）"""
+    if kind == "sq_int8":
+        return 1000
+    if kind == "pq":
+        return 39 * (1 << settings.VECTOR_PQ_NBITS)
+    return 0
+
+
+def create_storage_index(dim: int, kind: Optional[str] = None, training_vectors: Optional[np.ndarray] = None):
+    """
+    创建指定存储方式的空内积索引（IndexIDMap2），需要训练的量化器用 training_vectors 训练
+
+    Args:
+        dim: 向量维度
+        kind: STORAGE_KINDS 之一，默认使用 VECTOR_STORAGE
+        training_vectors: 训练样本（原始 float32 向量），超过 MAX_TRAINING_SAMPLES 时随机抽样
+    """
+    kind = (kind or settings.VECTOR_STORAGE or "flat").lower()
+    if kind == "flat":
+        inner = faiss.IndexFlatIP(dim)
+    elif kind == "sq_fp16":
+        inner = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    elif kind == "sq_int8":
+        inner = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    elif kind == "pq":
+        inner = faiss.IndexPQ(dim, _pq_subquantizers(dim), settings.VECTOR_PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+    else:
+        raise ValueError(f"Unsupported vector storage: {kind}")
+
+    if not inner.is_trained:
+        if training_vectors is None or not len(training_vectors):
+            raise ValueError(f"Vector storage {kind} requires training vectors")
+        sample = training_vectors
+        if len(sample) > MAX_TRAINING_SAMPLES:
+            rows = np.random.default_rng(0).choice(len(sample), MAX_TRAINING_SAMPLES, replace=False)
+            sample = sample[np.sort(rows)]
+        inner.train(np.ascontiguousarray(sample, dtype='float32'))
+    return faiss.IndexIDMap2(inner)
+
+
+def build_compressed_index(vectors: np.ndarray, ids: np.ndarray, kind: Optional[str] = None):
+    """
+    用已有向量构建指定存储方式的内积索引（IndexIDMap2，ID 与输入一致）
+
+    Args:
+        vectors: 形状为 (N, dim) 的原始 float32 向量
+        ids: 与 vectors 对应的向量ID
+        kind: STORAGE_KINDS 之一，默认使用 VECTOR_STORAGE
+    """
+    index = create_storage_index(vectors.shape[1], kind, vectors)
+    if len(ids):
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'), np.asarray(ids, dtype='int64'))
+    return index
+
+
+class ExactVectorStore:
+    """
+    原始向量文件：第 i 行即向量ID为 i 的 float32 向量（用户记忆ID按写入顺序连续分配）
+
+    按行写入同一位置是幂等的，预写日志重放时可以重复写入。
+    """
+
+    def __init__(self, path: Path, dim: int):
+        """
+        Args:
+            path: 向量文件路径
+            dim: 向量维度
+        """
+        self.path = Path(path)
+        self.dim = dim
+        self._row_bytes = dim * 4
+        self._lock = threading.Lock()
+        self._truncate_partial_row()
+        self._file = open(self.path, "r+b" if self.path.exists() else "w+b")
+        self._rows = os.path.getsize(self.path) // self._row_bytes
+        self._view: Optional[np.memmap] = None
+
+    def _truncate_partial_row(self) -> None:
+        """进程在写入中途退出时，文件末尾可能有不完整的一行"""
+        if not self.path.exists():
+            return
+        size = os.path.getsize(self.path)
+        partial = size % self._row_bytes
+        if partial:
+            os.truncate(self.path, size - partial)
+            logger.warning("Truncated partial exact vector row", extra={"path": str(self.path), "dropped_bytes": partial})
+
+    @property
+    def rows(self) -> int:
+        return self._rows
+
+    def put(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """按ID写入向量（连续ID一次写入）"""
+        ids = np.asarray(ids, dtype='int64')
+        if not len(ids):
+            return
+        vectors = np.ascontiguousarray(vectors, dtype='float32').reshape(len(ids), self.dim)
+        order = np.argsort(ids, kind='stable')
+        ids, vectors = ids[order], vectors[order]
+        # 按连续ID切分
+        breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+        with self._lock:
+            for start, end in zip(np.r_[0, breaks], np.r_[breaks, len(ids)]):
+                self._file.seek(int(ids[start]) * self._row_bytes)
+                self._file.write(vectors[start:end].tobytes())
+            self._file.flush()
+            self._rows = max(self._rows, int(ids[-1]) + 1)
+
+    def get(self, ids: np.ndarray) -> np.ndarray:
+        """读取一组向量（副本），ID须小于 rows"""
+        ids = np.asarray(ids, dtype='int64')
+        if not len(ids):
+            return np.empty((0, self.dim), dtype='float32')
+        with self._lock:
+            if self._view is None or len(self._view) < self._rows:
+                self._view = np.memmap(self.path, dtype='float32', mode='r', shape=(self._rows, self.dim))
+            view = self._view
+        return np.asarray(view[ids])
+
+    def sync(self) -> None:
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def size_bytes(self) -> int:
+        return self._rows * self._row_bytes
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+            self._view = None
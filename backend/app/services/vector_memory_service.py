@@ -2,19 +2,45 @@
 基于向量数据库的记忆服务
 支持用户记忆、知识记忆的向量存储和语义检索
 """
-import json
 import os
+import shutil
 import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
 
 from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
 from app.config import settings
+from app.services.ann_index import apply_search_params, build_ann_index, index_kind, is_flat_index, measure_recall
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.embedding_cache import create_embedding_cache, normalize_text
+from app.services.segmented_index import SegmentedIndex, merge_segments, read_index
+from app.services.vector_compression import (
+    MAX_TRAINING_SAMPLES,
+    ExactVectorStore,
+    bytes_per_vector,
+    create_storage_index,
+    min_training_vectors,
+    storage_kind,
+)
+from app.services.vector_metadata_store import MetadataStore
+from app.services.vector_wal import VectorWAL, decode_vector, encode_vector
+from app.services.vector_writer import VectorWriter
+
+# 指向当前快照目录的文件
+CURRENT_SNAPSHOT_FILE = "CURRENT"
+# 用户记忆原始向量文件（压缩存储时用于精确重排）
+EXACT_VECTORS_FILE = "user_vectors.f32"
+# 转换存储方式时每次编码的向量数
+STORAGE_CONVERT_CHUNK = 65536
 
 
 class VectorMemoryService:
@@ -68,6 +94,8 @@ class VectorMemoryService:
         self._save_timer: Optional[threading.Timer] = None
         self._pending_save = False
         self._save_delay_seconds = 2.0
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_generation = 0
         
         # 使用配置中的模型名称（如果没有提供）
         if model_name is None:
@@ -79,15 +107,47 @@ class VectorMemoryService:
         
         # 初始化嵌入模型
         self.embedding_model = self._load_embedding_model(model_name)
+        # 并发请求的文本在几毫秒内合并为一批编码
+        self._embedding_batcher = EmbeddingBatcher(
+            self._encode_batch,
+            max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=settings.EMBEDDING_BATCH_WAIT_MS,
+        )
+        metrics_registry.register_collector("embedding_batcher", self._embedding_batcher.get_stats)
+        # 重复文本（如同一城市的知识检索查询）直接使用缓存向量
+        self._embedding_cache = create_embedding_cache(model_name)
+        if self._embedding_cache is not None:
+            metrics_registry.register_collector("embedding_cache", self._embedding_cache.get_stats)
+        # batched_writes() 期间当前线程待写入的用户记忆
+        self._pending_writes = threading.local()
         
         # 初始化FAISS索引
-        self.user_memory_index = None
-        self.knowledge_memory_index = None
-        self.user_metadata = {}  # 存储用户记忆的元数据
-        self.knowledge_metadata = {}  # 存储知识记忆的元数据
+        # 快照段以 mmap 加载，快照之后的写入进入内存增量段
+        self.user_memory_index: Optional[SegmentedIndex] = None
+        self.knowledge_memory_index: Optional[SegmentedIndex] = None
+        # 元数据按ID惰性读取；用户记忆按 user_id 查询即为该用户的分区
+        self.user_metadata: Optional[MetadataStore] = None
+        self.knowledge_metadata: Optional[MetadataStore] = None
+        self._next_user_memory_id = 0
+        self._index_lock = threading.RLock()
+        # 知识索引超过阈值后在后台迁移为近似索引；最近的查询向量用于召回率检查
+        self._knowledge_query_vectors = deque(maxlen=settings.VECTOR_ANN_RECALL_SAMPLES)
+        self._ann_building = False
+        self._ann_retry_at = 0
+        self._ann_recall: Optional[float] = None
+        # 用户记忆索引压缩存储时，原始向量另存于 mmap 文件，用于精确重排
+        self._exact_vectors: Optional[ExactVectorStore] = None
         
-        # 加载或创建索引
+        # 加载快照并重放预写日志
         self._load_or_create_indexes()
+        self._open_exact_vectors()
+        self._wal = VectorWAL(self.memory_dir, fsync=settings.VECTOR_WAL_FSYNC)
+        self._replay_wal()
+        self._backfill_exact_vectors()
+        # 所有向量写入经由单写线程按批应用
+        self._writer = VectorWriter(self._apply_writes, max_batch_size=settings.VECTOR_WRITE_MAX_BATCH)
+        metrics_registry.register_collector("vector_writer", self._writer.get_stats)
+        self._maybe_migrate_knowledge_index()
         
         # 标记为已初始化
         self._initialized = True
@@ -182,60 +242,337 @@ class VectorMemoryService:
                     f"建议: 1) 检查网络连接 2) 配置HF_ENDPOINT镜像 3) 手动下载模型到本地"
                 )
     
+    def _current_snapshot_dir(self) -> Path:
+        """CURRENT 指向的快照目录；没有 CURRENT 时为旧版本直接保存在记忆目录下的文件"""
+        current_path = self.memory_dir / CURRENT_SNAPSHOT_FILE
+        if not current_path.exists():
+            return self.memory_dir
+        name = current_path.read_text(encoding='utf-8').strip()
+        self._snapshot_generation = int(name.rsplit("-", 1)[-1])
+        return self.memory_dir / name
+
     def _load_or_create_indexes(self):
-        """加载或创建FAISS索引"""
-        user_index_path = self.memory_dir / "user_memory.index"
-        knowledge_index_path = self.memory_dir / "knowledge_memory.index"
-        user_metadata_path = self.memory_dir / "user_metadata.json"
-        knowledge_metadata_path = self.memory_dir / "knowledge_metadata.json"
+        """从最近的快照加载或创建FAISS索引（索引 mmap 加载，元数据惰性读取）"""
+        snapshot_dir = self._current_snapshot_dir()
+        self.user_metadata = self._load_metadata(snapshot_dir, "user_metadata")
+        self.knowledge_metadata = self._load_metadata(snapshot_dir, "knowledge_metadata")
+        user_index_path = snapshot_dir / "user_memory.index"
+        knowledge_index_path = snapshot_dir / "knowledge_memory.index"
         
         # 尝试加载用户记忆索引
         if user_index_path.exists():
-            self.user_memory_index = faiss.read_index(str(user_index_path))
-            if user_metadata_path.exists():
-                with open(user_metadata_path, 'r', encoding='utf-8') as f:
-                    self.user_metadata = json.load(f)
-            logger.info(f"已加载用户记忆索引，包含 {self.user_memory_index.ntotal} 条记录")
+            base = self._ensure_id_map(read_index(str(user_index_path)))
+            logger.info(f"已加载用户记忆索引，包含 {base.ntotal} 条记录")
         else:
-            self.user_memory_index = faiss.IndexFlatIP(self.vector_dim)  # 内积相似度
-            self.user_metadata = {}
+            # 内积相似度；以元数据键作为向量ID，便于按用户取出向量
+            base = faiss.IndexIDMap2(faiss.IndexFlatIP(self.vector_dim))
             logger.info("创建了新的用户记忆索引")
+        self.user_memory_index = SegmentedIndex(base, with_ids=True)
         
         # 尝试加载知识记忆索引
         if knowledge_index_path.exists():
-            self.knowledge_memory_index = faiss.read_index(str(knowledge_index_path))
-            if knowledge_metadata_path.exists():
-                with open(knowledge_metadata_path, 'r', encoding='utf-8') as f:
-                    self.knowledge_metadata = json.load(f)
-            logger.info(f"已加载知识记忆索引，包含 {self.knowledge_memory_index.ntotal} 条记录")
+            base = read_index(str(knowledge_index_path))
+            apply_search_params(base)
+            logger.info(f"已加载知识记忆索引，包含 {base.ntotal} 条记录")
         else:
-            self.knowledge_memory_index = faiss.IndexFlatIP(self.vector_dim)  # 内积相似度
-            self.knowledge_metadata = {}
+            base = faiss.IndexFlatIP(self.vector_dim)  # 内积相似度
             logger.info("创建了新的知识记忆索引")
+        self.knowledge_memory_index = SegmentedIndex(base, with_ids=False)
+
+    def _load_metadata(self, snapshot_dir: Path, name: str) -> MetadataStore:
+        """
+        打开记忆目录下的元数据 SQLite（所有快照共用一个数据库）
+
+        上一版本把 SQLite 放在快照目录中，首次启动时移到记忆目录；
+        旧版本只有 JSON 时读入内存增量，下次快照时写入数据库。
+        """
+        sqlite_path = self.memory_dir / f"{name}.sqlite"
+        snapshot_sqlite_path = snapshot_dir / f"{name}.sqlite"
+        if not sqlite_path.exists() and snapshot_sqlite_path.exists():
+            os.replace(snapshot_sqlite_path, sqlite_path)
+        store = MetadataStore(sqlite_path)
+        json_path = snapshot_dir / f"{name}.json"
+        if json_path.exists():
+            store.load_legacy_json(json_path)
+        return store
     
+    @staticmethod
+    def _ensure_id_map(index):
+        """旧版本保存的是不带ID映射的平面索引（向量ID即写入顺序），转换为 IndexIDMap2"""
+        if isinstance(index, faiss.IndexIDMap2):
+            return index
+        id_map = faiss.IndexIDMap2(faiss.IndexFlatIP(index.d))
+        if index.ntotal:
+            id_map.add_with_ids(index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype='int64'))
+        logger.info(f"用户记忆索引已转换为按ID映射的索引，共 {index.ntotal} 条记录")
+        return id_map
+
+    def _open_exact_vectors(self) -> None:
+        """VECTOR_STORAGE 不是 flat 或已有原始向量文件时打开该文件"""
+        path = self.memory_dir / EXACT_VECTORS_FILE
+        if settings.VECTOR_STORAGE.lower() != "flat" or path.exists():
+            self._exact_vectors = ExactVectorStore(path, self.vector_dim)
+
+    def _backfill_exact_vectors(self) -> None:
+        """
+        补齐原始向量文件缺少的行：快照段从平面索引读取（刚开启压缩存储时），
+        快照之后的写入从增量段读取（预写日志重放的结果）
+        """
+        store = self._exact_vectors
+        if store is None or store.rows >= self._next_user_memory_id:
+            return
+        base = self.user_memory_index.base
+        if base.ntotal and self.user_memory_index.base_limit > store.rows:
+            if storage_kind(base) == "flat":
+                ids = faiss.vector_to_array(base.id_map)
+                ids = ids[ids >= store.rows]
+                for start in range(0, len(ids), STORAGE_CONVERT_CHUNK):
+                    chunk = ids[start:start + STORAGE_CONVERT_CHUNK]
+                    store.put(chunk, base.reconstruct_batch(chunk))
+            else:
+                # 写快照前会 fsync 原始向量文件，正常情况下不会出现
+                logger.warning(
+                    "Exact vectors missing for compressed user index",
+                    extra={"exact_rows": store.rows, "snapshot_limit": self.user_memory_index.base_limit},
+                )
+        vectors, ids = self.user_memory_index.delta_entries(store.rows)
+        store.put(ids, vectors)
+        logger.info("Exact user vectors backfilled", extra={"rows": store.rows})
+
+    def _replay_wal(self) -> None:
+        """把预写日志中快照之后的写入应用到索引，已在索引或元数据中的记录跳过（可重复重放）"""
+        applied = 0
+        for record in self._wal.replay():
+            try:
+                if self._apply_wal_record(record):
+                    applied += 1
+            except Exception as e:
+                logger.warning(f"跳过无法应用的向量日志记录: {e}")
+        self._next_user_memory_id = self.user_metadata.max_id() + 1
+        if applied:
+            logger.info(f"已从预写日志恢复 {applied} 条记忆")
+
+    def _apply_wal_record(self, record: Dict[str, Any]) -> bool:
+        """
+        应用一条日志记录，返回是否实际写入
+
+        向量与元数据分别按ID去重：同一ID重复出现（写快照中断后日志与快照重叠）时不会重复写入索引。
+        """
+        memory_id = int(record["id"])
+        vector = decode_vector(record["vector"])
+        if record["index"] == "user":
+            applied = False
+            if not self.user_memory_index.contains(memory_id):
+                self.user_memory_index.add(np.array([vector]), np.array([memory_id], dtype='int64'))
+                applied = True
+            if memory_id not in self.user_metadata:
+                self.user_metadata.put(memory_id, record["metadata"])
+                applied = True
+            return applied
+        # 知识索引的向量ID即写入顺序
+        if self.knowledge_memory_index.contains(memory_id):
+            return False
+        if memory_id > self.knowledge_memory_index.ntotal:
+            raise ValueError(f"knowledge WAL gap at id {memory_id}")
+        self.knowledge_memory_index.add(np.array([vector]))
+        self.knowledge_metadata.put(memory_id, record["metadata"])
+        return True
+
+    def _apply_writes(self, items: List[Tuple[str, np.ndarray, Dict[str, Any]]]) -> List[int]:
+        """
+        在单写线程中应用一批写入：分配ID、先追加预写日志，再每个索引一次 add
+
+        向量在追加日志前整理并校验维度，避免日志写入后 add 失败；
+        用户记忆ID在日志追加后即视为已使用，即使之后的写入失败也不会被下一批重复分配。
+
+        Args:
+            items: (索引名 "user"/"knowledge", 向量, 元数据) 列表
+
+        Returns:
+            与 items 对应的向量ID
+        """
+        batches = []
+        for index in ("user", "knowledge"):
+            positions = [position for position, item in enumerate(items) if item[0] == index]
+            if not positions:
+                continue
+            vectors = np.stack([np.asarray(items[position][1], dtype='float32') for position in positions])
+            if vectors.ndim != 2 or vectors.shape[1] != self.vector_dim:
+                raise ValueError(f"vector shape {vectors.shape[1:]} does not match dimension {self.vector_dim}")
+            batches.append((index, positions, np.ascontiguousarray(vectors)))
+
+        with self._index_lock:
+            memory_ids: List[int] = []
+            next_ids = {"user": self._next_user_memory_id, "knowledge": self.knowledge_memory_index.ntotal}
+            for index, _, _ in items:
+                memory_ids.append(next_ids[index])
+                next_ids[index] += 1
+
+            self._wal.append([
+                {"index": index, "id": memory_id, "vector": encode_vector(vector), "metadata": metadata}
+                for (index, vector, metadata), memory_id in zip(items, memory_ids)
+            ])
+            self._next_user_memory_id = next_ids["user"]
+
+            for index, positions, vectors in batches:
+                target = self.user_memory_index if index == "user" else self.knowledge_memory_index
+                store = self.user_metadata if index == "user" else self.knowledge_metadata
+                ids = np.array([memory_ids[position] for position in positions], dtype='int64')
+                if index == "user":
+                    target.add(vectors, ids)
+                    if self._exact_vectors is not None:
+                        self._exact_vectors.put(ids, vectors)
+                else:
+                    target.add(vectors)
+                for position in positions:
+                    store.put(memory_ids[position], items[position][2])
+        return memory_ids
+
+    @staticmethod
+    def _write_file(path: Path, data: bytes) -> None:
+        """先写临时文件再原子替换"""
+        temp_path = path.with_name(path.name + ".tmp")
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
     def _save_indexes(self):
-        """保存FAISS索引和元数据"""
+        """
+        把索引和元数据压缩为新的快照
+
+        锁内只取快照段引用、复制索引与元数据的增量并轮转日志，合并、序列化与文件写入在锁外进行。
+        索引写入新的 snapshot-N 目录，元数据增量在一个事务内写入记忆目录下的 SQLite，
+        完成后原子替换 CURRENT、以 mmap 重新打开新快照，再删除旧快照和旧日志；
+        任一步骤中断时，重启仍从旧快照加日志恢复。
+        """
+        with self._snapshot_lock:
+            try:
+                with self._index_lock:
+                    user_parts = self.user_memory_index.snapshot_parts()
+                    knowledge_parts = self.knowledge_memory_index.snapshot_parts()
+                    user_metadata = self.user_metadata.delta_items()
+                    knowledge_metadata = self.knowledge_metadata.delta_items()
+                    user_limit = self._next_user_memory_id
+                    knowledge_total = self.knowledge_memory_index.ntotal
+                    self._wal.rotate()
+                # 快照中的向量须已落盘到原始向量文件，之后转换存储方式或重启补齐时依赖它
+                if self._exact_vectors is not None:
+                    self._exact_vectors.sync()
+                # 快照段只读，合并、转换存储方式与序列化都在锁外进行，不阻塞检索和写入
+                user_index = merge_segments(*user_parts, with_ids=True)
+                user_index = faiss.serialize_index(self._convert_user_storage(user_index))
+                knowledge_index = faiss.serialize_index(merge_segments(*knowledge_parts, with_ids=False))
+
+                previous_dir = self._current_snapshot_dir()
+                generation = self._snapshot_generation + 1
+                snapshot_name = f"snapshot-{generation:06d}"
+                snapshot_dir = self.memory_dir / snapshot_name
+                snapshot_dir.mkdir(parents=True, exist_ok=True)
+                self._write_file(snapshot_dir / "user_memory.index", user_index.tobytes())
+                self._write_file(snapshot_dir / "knowledge_memory.index", knowledge_index.tobytes())
+                # 元数据只插入增量行；提交后 CURRENT 更新前中断时，重放日志会跳过数据库中已有的元数据
+                self.user_metadata.commit(user_metadata, user_limit, generation)
+                self.knowledge_metadata.commit(knowledge_metadata, knowledge_total, generation)
+                self._write_file(self.memory_dir / CURRENT_SNAPSHOT_FILE, snapshot_name.encode('utf-8'))
+                self._snapshot_generation = generation
+                self._reopen_snapshot(snapshot_dir, user_limit, knowledge_total)
+
+                self._wal.discard_rotated()
+                if previous_dir != self.memory_dir:
+                    shutil.rmtree(previous_dir, ignore_errors=True)
+                logger.info(
+                    "Vector memory snapshot written",
+                    extra={
+                        "snapshot": snapshot_name,
+                        "user_memories": user_limit,
+                        "knowledge_memories": knowledge_total,
+                        "metadata_changes": len(user_metadata) + len(knowledge_metadata),
+                    },
+                )
+            except Exception as e:
+                logger.error(f"保存向量索引失败: {e}")
+
+    def _convert_user_storage(self, index):
+        """
+        把合并后的用户记忆索引转换为 VECTOR_STORAGE 指定的存储方式，用原始向量重新编码
+
+        向量数不足以训练量化器或原始向量不完整时保持原样，下次快照时再尝试。
+        """
+        target = settings.VECTOR_STORAGE.lower()
+        current = storage_kind(index)
+        if current == target or not index.ntotal:
+            return index
+        if index.ntotal < min_training_vectors(target):
+            logger.debug(f"用户记忆数 {index.ntotal} 不足以训练 {target} 量化器，暂不转换")
+            return index
+        ids = faiss.vector_to_array(index.id_map)
+        store = self._exact_vectors
+        if store is None or store.rows <= int(ids.max()):
+            logger.warning(
+                "Exact vectors incomplete, keeping user index storage",
+                extra={"storage": current, "target": target},
+            )
+            return index
+
+        started = time.perf_counter()
         try:
-            # 保存用户记忆索引
-            user_index_path = self.memory_dir / "user_memory.index"
-            user_metadata_path = self.memory_dir / "user_metadata.json"
-            faiss.write_index(self.user_memory_index, str(user_index_path))
-            with open(user_metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(self.user_metadata, f, ensure_ascii=False, indent=2)
-            
-            # 保存知识记忆索引
-            knowledge_index_path = self.memory_dir / "knowledge_memory.index"
-            knowledge_metadata_path = self.memory_dir / "knowledge_metadata.json"
-            faiss.write_index(self.knowledge_memory_index, str(knowledge_index_path))
-            with open(knowledge_metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(self.knowledge_metadata, f, ensure_ascii=False, indent=2)
-            
-            logger.info("向量索引保存成功")
+            # 只读取训练样本，不把全部原始向量载入内存
+            sample = ids
+            if len(ids) > MAX_TRAINING_SAMPLES:
+                sample = np.sort(np.random.default_rng(0).choice(ids, MAX_TRAINING_SAMPLES, replace=False))
+            converted = create_storage_index(self.vector_dim, target, store.get(sample))
+            for start in range(0, len(ids), STORAGE_CONVERT_CHUNK):
+                chunk = ids[start:start + STORAGE_CONVERT_CHUNK]
+                converted.add_with_ids(store.get(chunk), chunk)
         except Exception as e:
-            logger.error(f"保存向量索引失败: {e}")
+            logger.error(f"转换用户记忆索引存储方式失败: {e}")
+            return index
+        logger.info(
+            "User memory index storage converted",
+            extra={
+                "from": current,
+                "to": target,
+                "vectors": len(ids),
+                "bytes_per_vector": bytes_per_vector(converted),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            },
+        )
+        return converted
+
+    def _reopen_snapshot(self, snapshot_dir: Path, user_limit: int, knowledge_total: int) -> None:
+        """以新快照为快照段，写快照期间的新增写入保留在增量段（元数据已在提交时丢弃写入的增量）"""
+        user_base = read_index(str(snapshot_dir / "user_memory.index"))
+        knowledge_base = read_index(str(snapshot_dir / "knowledge_memory.index"))
+        apply_search_params(knowledge_base)
+
+        with self._index_lock:
+            user_index = SegmentedIndex(user_base, with_ids=True, base_limit=user_limit)
+            vectors, ids = self.user_memory_index.delta_entries(user_limit)
+            if len(ids):
+                user_index.add(vectors, ids)
+
+            knowledge_index = SegmentedIndex(knowledge_base, with_ids=False)
+            vectors, _ = self.knowledge_memory_index.delta_entries(knowledge_total)
+            if len(vectors):
+                knowledge_index.add(vectors)
+
+            self.user_memory_index = user_index
+            self.knowledge_memory_index = knowledge_index
+
+    def _compact_if_needed(self) -> None:
+        """预写日志超过 VECTOR_WAL_COMPACT_BYTES 时写入新快照"""
+        if self._wal.size_bytes() >= settings.VECTOR_WAL_COMPACT_BYTES:
+            self._save_indexes()
 
     def schedule_save(self, delay_seconds: Optional[float] = None) -> None:
-        """Debounce vector index persistence to keep request paths responsive."""
+        """
+        Debounce snapshot compaction to keep request paths responsive.
+
+        Writes are already durable in the WAL; the deferred check only writes a
+        snapshot once the WAL has grown past VECTOR_WAL_COMPACT_BYTES.
+        """
         delay = self._save_delay_seconds if delay_seconds is None else delay_seconds
 
         with self._save_lock:
@@ -254,25 +591,102 @@ class VectorMemoryService:
                 return
             self._pending_save = False
 
-        self._save_indexes()
+        self._compact_if_needed()
     
-    def _text_to_vector(self, text: str) -> np.ndarray:
-        """将文本转换为向量"""
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """由微批处理线程调用，一次编码整批文本"""
+        return self.embedding_model.encode(
+            texts,
+            batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+            convert_to_numpy=True,
+        )
+
+    def _encode_normalized(self, texts: List[str]) -> np.ndarray:
+        """编码并归一化（用于内积相似度计算），整组作为一个请求提交给微批处理"""
+        vectors = np.asarray(self._embedding_batcher.embed(texts), dtype='float32').reshape(len(texts), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _texts_to_vectors(self, texts: List[str]) -> np.ndarray:
+        """将多条文本转换为向量矩阵（每行一条），缓存命中的文本不再经过模型"""
         try:
-            vector = self.embedding_model.encode(text, convert_to_numpy=True)
-            # 归一化向量，用于内积相似度计算
-            vector = vector / np.linalg.norm(vector)
-            return vector.astype('float32')
+            texts = [normalize_text(text) for text in texts]
+            if self._embedding_cache is None:
+                return self._encode_normalized(texts)
+
+            cached = self._embedding_cache.get_many(texts)
+            missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+            encoded: Dict[str, np.ndarray] = {}
+            if missing:
+                encoded = dict(zip(missing, self._encode_normalized(missing)))
+                self._embedding_cache.set_many(missing, list(encoded.values()))
+            return np.stack([
+                vector if vector is not None else encoded[text]
+                for text, vector in zip(texts, cached)
+            ]).astype('float32')
         except Exception as e:
             logger.error(f"文本向量化失败: {e}")
             # 返回零向量
-            return np.zeros(self.vector_dim, dtype='float32')
+            return np.zeros((len(texts), self.vector_dim), dtype='float32')
+
+    def _text_to_vector(self, text: str) -> np.ndarray:
+        """将文本转换为向量"""
+        return self._texts_to_vectors([text])[0]
     
+    def embed_text(self, text: str) -> np.ndarray:
+        """
+        使用已加载的嵌入模型将文本转换为归一化向量
+        供其他服务（如LLM语义缓存）复用同一个模型，避免重复加载
+        """
+        return self._text_to_vector(text)
+
     def _vector_to_text(self, vector: np.ndarray) -> str:
         """将向量转换为文本表示（用于调试）"""
         return f"Vector(dim={len(vector)}, norm={np.linalg.norm(vector):.4f})"
     
     # ============ 用户记忆操作 ============
+
+    def _add_user_memories(self, entries: List[Tuple[str, np.ndarray, Dict[str, Any]]]) -> List[int]:
+        """通过单写线程写入一组 (user_id, 向量, 元数据) 用户记忆，返回分配的向量ID"""
+        return self._writer.write([
+            ("user", vector, {"user_id": user_id, **metadata}) for user_id, vector, metadata in entries
+        ])
+
+    def _store_user_memory(self, user_id: str, metadata: Dict[str, Any]) -> None:
+        """向量化 text_representation 并写入；处于 batched_writes() 中时先暂存，退出时统一编码"""
+        pending = getattr(self._pending_writes, "items", None)
+        if pending is not None:
+            pending.append((user_id, metadata))
+            return
+        vector = self._text_to_vector(metadata["text_representation"])
+        self._add_user_memories([(user_id, vector, metadata)])
+
+    @contextmanager
+    def batched_writes(self) -> Iterator[None]:
+        """
+        合并当前线程的用户记忆写入
+
+        上下文内的 store_user_* 调用只暂存记忆，退出时把全部文本作为一批编码后写入索引，
+        一次行程规划产生的多条记忆只需一次模型调用。支持嵌套，以最外层退出为准。
+        """
+        if getattr(self._pending_writes, "items", None) is not None:
+            yield
+            return
+        self._pending_writes.items = []
+        try:
+            yield
+        finally:
+            pending, self._pending_writes.items = self._pending_writes.items, None
+            if pending:
+                try:
+                    vectors = self._texts_to_vectors([metadata["text_representation"] for _, metadata in pending])
+                    self._add_user_memories([
+                        (user_id, vector, metadata) for (user_id, metadata), vector in zip(pending, vectors)
+                    ])
+                    logger.debug("Batched user memory writes flushed", extra={"count": len(pending)})
+                except Exception as e:
+                    logger.error(f"批量存储用户记忆失败: {e}")
     
     def store_user_preference(
         self,
@@ -292,22 +706,14 @@ class VectorMemoryService:
             # 构建文本表示
             text_representation = self._preference_to_text(preference_type, preference_data)
             
-            # 转换为向量
-            vector = self._text_to_vector(text_representation)
-            
-            # 添加到索引
-            index_id = self.user_memory_index.ntotal
-            self.user_memory_index.add(np.array([vector]))
-            
-            # 存储元数据
-            self.user_metadata[str(index_id)] = {
-                "user_id": user_id,
+            # 向量化并添加到索引（batched_writes 中延迟到退出时批量编码）
+            self._store_user_memory(user_id, {
                 "type": "preference",
                 "preference_type": preference_type,
                 "data": preference_data,
                 "text_representation": text_representation,
                 "timestamp": datetime.now().isoformat()
-            }
+            })
             
             logger.info(f"用户偏好已存储到向量数据库 - UserID: {user_id}, Type: {preference_type}")
         except Exception as e:
@@ -329,21 +735,13 @@ class VectorMemoryService:
             # 构建文本表示
             text_representation = self._trip_to_text(trip_data)
             
-            # 转换为向量
-            vector = self._text_to_vector(text_representation)
-            
-            # 添加到索引
-            index_id = self.user_memory_index.ntotal
-            self.user_memory_index.add(np.array([vector]))
-            
-            # 存储元数据
-            self.user_metadata[str(index_id)] = {
-                "user_id": user_id,
+            # 向量化并添加到索引（batched_writes 中延迟到退出时批量编码）
+            self._store_user_memory(user_id, {
                 "type": "trip",
                 "data": trip_data,
                 "text_representation": text_representation,
                 "timestamp": datetime.now().isoformat()
-            }
+            })
             
             logger.info(f"用户行程已存储到向量数据库 - UserID: {user_id}")
         except Exception as e:
@@ -367,22 +765,14 @@ class VectorMemoryService:
             # 构建文本表示
             text_representation = self._feedback_to_text(feedback_data)
             
-            # 转换为向量
-            vector = self._text_to_vector(text_representation)
-            
-            # 添加到索引
-            index_id = self.user_memory_index.ntotal
-            self.user_memory_index.add(np.array([vector]))
-            
-            # 存储元数据
-            self.user_metadata[str(index_id)] = {
-                "user_id": user_id,
+            # 向量化并添加到索引（batched_writes 中延迟到退出时批量编码）
+            self._store_user_memory(user_id, {
                 "type": "feedback",
                 "trip_id": trip_id,
                 "data": feedback_data,
                 "text_representation": text_representation,
                 "timestamp": datetime.now().isoformat()
-            }
+            })
             
             logger.info(f"用户反馈已存储到向量数据库 - UserID: {user_id}, TripID: {trip_id}")
         except Exception as e:
@@ -412,38 +802,26 @@ class VectorMemoryService:
             if not query:
                 return self._get_recent_user_memories(user_id, limit, memory_types)
             
-            # 转换查询为向量
+            # 只在该用户自己的记忆中精确检索：按ID取出该用户（及指定类型）的向量计算内积，
+            # 耗时只与该用户的记忆数量相关，不会被其他用户的记忆挤出 top-k
+            with self._index_lock:
+                memory_ids = self.user_metadata.ids_for_user(user_id, memory_types)
+                if not memory_ids:
+                    return []
+                vectors = self.user_memory_index.reconstruct_batch(np.array(memory_ids, dtype='int64'))
+                metadata_store = self.user_metadata
+                compressed = storage_kind(self.user_memory_index.base) != "flat"
+
             query_vector = self._text_to_vector(query)
-            
-            # 在用户记忆中搜索
-            distances, indices = self.user_memory_index.search(
-                np.array([query_vector]), 
-                min(self.user_memory_index.ntotal, limit * 2)  # 搜索更多结果进行过滤
-            )
-            
-            # 过滤结果
-            results = []
-            for i, idx in enumerate(indices[0]):
-                if idx == -1:  # FAISS返回-1表示无效结果
-                    continue
-                    
-                metadata = self.user_metadata.get(str(idx))
-                if not metadata:
-                    continue
-                
-                # 过滤用户ID和记忆类型
-                if metadata.get("user_id") != user_id:
-                    continue
-                    
-                if memory_types and metadata.get("type") not in memory_types:
-                    continue
-                
-                # 添加相似度分数
-                metadata["similarity_score"] = float(distances[0][i])
-                results.append(metadata)
-                
-                if len(results) >= limit:
-                    break
+            scores = vectors @ query_vector
+            top = np.argsort(-scores)[:limit]
+            if compressed and self._exact_vectors is not None and settings.VECTOR_RERANK_FACTOR > 0:
+                top = self._rerank_user_candidates(memory_ids, scores, query_vector, limit)
+
+            results = [
+                dict(metadata_store.get(memory_ids[position]), similarity_score=float(scores[position]))
+                for position in top
+            ]
             
             logger.info(f"检索到 {len(results)} 条用户记忆 - UserID: {user_id}, Query: {query}")
             return results
@@ -451,6 +829,28 @@ class VectorMemoryService:
             logger.error(f"检索用户记忆失败: {e}")
             return []
     
+    def _rerank_user_candidates(
+        self,
+        memory_ids: List[int],
+        scores: np.ndarray,
+        query_vector: np.ndarray,
+        limit: int
+    ) -> np.ndarray:
+        """
+        压缩存储的内积是近似值：取近似分数前 limit * VECTOR_RERANK_FACTOR 个候选，
+        用原始向量重新计算内积后排序（原地更新 scores）
+
+        Returns:
+            重排后前 limit 个候选在 memory_ids 中的位置
+        """
+        candidates = np.argsort(-scores)[:limit * settings.VECTOR_RERANK_FACTOR]
+        candidate_ids = np.array(memory_ids, dtype='int64')[candidates]
+        # 原始向量缺失的行保留近似分数
+        available = candidate_ids < self._exact_vectors.rows
+        if available.any():
+            scores[candidates[available]] = self._exact_vectors.get(candidate_ids[available]) @ query_vector
+        return candidates[np.argsort(-scores[candidates])][:limit]
+
     def _get_recent_user_memories(
         self,
         user_id: str,
@@ -458,15 +858,10 @@ class VectorMemoryService:
         memory_types: Optional[List[str]]
     ) -> List[Dict[str, Any]]:
         """获取用户最近的记忆"""
-        user_memories = []
-        for metadata in self.user_metadata.values():
-            if metadata.get("user_id") != user_id:
-                continue
-                
-            if memory_types and metadata.get("type") not in memory_types:
-                continue
-                
-            user_memories.append(metadata)
+        with self._index_lock:
+            # 向量ID按写入顺序递增，只读取最后 limit 条的元数据
+            memory_ids = self.user_metadata.ids_for_user(user_id, memory_types)[-limit:]
+            user_memories = [self.user_metadata.get(memory_id) for memory_id in memory_ids]
         
         # 按时间戳排序
         user_memories.sort(
@@ -497,18 +892,16 @@ class VectorMemoryService:
             # 转换为向量
             vector = self._text_to_vector(text_representation)
             
-            # 添加到索引
-            index_id = self.knowledge_memory_index.ntotal
-            self.knowledge_memory_index.add(np.array([vector]))
-            
-            # 存储元数据
-            self.knowledge_metadata[str(index_id)] = {
+            # 通过单写线程添加到索引并存储元数据
+            self._writer.write([("knowledge", vector, {
                 "type": "destination",
                 "destination": destination,
                 "data": knowledge_data,
                 "text_representation": text_representation,
                 "timestamp": datetime.now().isoformat()
-            }
+            })])
+            
+            self._maybe_migrate_knowledge_index()
             
             logger.info(f"目的地知识已存储到向量数据库 - Destination: {destination}")
         except Exception as e:
@@ -533,18 +926,16 @@ class VectorMemoryService:
             # 转换为向量
             vector = self._text_to_vector(text_representation)
             
-            # 添加到索引
-            index_id = self.knowledge_memory_index.ntotal
-            self.knowledge_memory_index.add(np.array([vector]))
-            
-            # 存储元数据
-            self.knowledge_metadata[str(index_id)] = {
+            # 通过单写线程添加到索引并存储元数据
+            self._writer.write([("knowledge", vector, {
                 "type": "experience",
                 "experience_type": experience_type,
                 "data": experience_data,
                 "text_representation": text_representation,
                 "timestamp": datetime.now().isoformat()
-            }
+            })])
+            
+            self._maybe_migrate_knowledge_index()
             
             logger.info(f"旅行经验已存储到向量数据库 - Type: {experience_type}")
         except Exception as e:
@@ -575,14 +966,16 @@ class VectorMemoryService:
             
             # 转换查询为向量
             query_vector = self._text_to_vector(query)
+            self._knowledge_query_vectors.append(query_vector)
             
             # 在知识记忆中搜索
             # 确保k值至少为1，避免FAISS在k=0时报错
-            k = min(self.knowledge_memory_index.ntotal, limit * 2)
-            distances, indices = self.knowledge_memory_index.search(
-                np.array([query_vector]),
-                k
-            )
+            with self._index_lock:
+                k = min(self.knowledge_memory_index.ntotal, limit * 2)
+                distances, indices = self.knowledge_memory_index.search(
+                    np.array([query_vector]),
+                    k
+                )
             
             # 过滤结果
             results = []
@@ -590,7 +983,7 @@ class VectorMemoryService:
                 if idx == -1:  # FAISS返回-1表示无效结果
                     continue
                     
-                metadata = self.knowledge_metadata.get(str(idx))
+                metadata = self.knowledge_metadata.get(int(idx))
                 if not metadata:
                     continue
                 
@@ -598,9 +991,8 @@ class VectorMemoryService:
                 if knowledge_types and metadata.get("type") not in knowledge_types:
                     continue
                 
-                # 添加相似度分数
-                metadata["similarity_score"] = float(distances[0][i])
-                results.append(metadata)
+                # 添加相似度分数（返回副本，不修改快照可能正在序列化的元数据）
+                results.append(dict(metadata, similarity_score=float(distances[0][i])))
                 
                 if len(results) >= limit:
                     break
@@ -611,6 +1003,82 @@ class VectorMemoryService:
             logger.error(f"检索知识记忆失败: {e}")
             return []
     
+    # ============ 近似索引迁移 ============
+
+    def _maybe_migrate_knowledge_index(self) -> None:
+        """知识索引仍为平面索引且向量数达到 VECTOR_ANN_THRESHOLD 时，启动后台迁移"""
+        if not settings.VECTOR_ANN_ENABLED:
+            return
+        with self._index_lock:
+            index = self.knowledge_memory_index
+            threshold = max(settings.VECTOR_ANN_THRESHOLD, self._ann_retry_at)
+            if self._ann_building or not is_flat_index(index.base) or index.ntotal < threshold:
+                return
+            self._ann_building = True
+        threading.Thread(target=self._migrate_knowledge_index, name="knowledge-ann-build", daemon=True).start()
+
+    def _recall_queries(self, vectors: np.ndarray, recent: List[np.ndarray]) -> np.ndarray:
+        """召回率检查用的查询：最近的真实查询，不足时用加噪声的已有向量补齐"""
+        samples = settings.VECTOR_ANN_RECALL_SAMPLES
+        queries = list(recent)[-samples:]
+        missing = samples - len(queries)
+        if missing > 0:
+            rng = np.random.default_rng(0)
+            picked = vectors[rng.choice(len(vectors), size=min(missing, len(vectors)), replace=False)]
+            noisy = picked + rng.normal(scale=0.3 / np.sqrt(vectors.shape[1]), size=picked.shape).astype('float32')
+            noisy /= np.linalg.norm(noisy, axis=1, keepdims=True)
+            queries.extend(noisy)
+        return np.asarray(queries, dtype='float32')
+
+    def _migrate_knowledge_index(self) -> None:
+        """
+        后台构建近似索引并替换平面索引
+
+        构建期间平面索引照常读写；召回率达到 VECTOR_ANN_MIN_RECALL 后在锁内补齐构建期间新增的向量并替换，
+        不达标则保留平面索引，向量数翻倍后再重试。
+        """
+        try:
+            with self._index_lock:
+                snapshot = self.knowledge_memory_index.ntotal
+                vectors = self.knowledge_memory_index.reconstruct_n(0, snapshot)
+                recent = list(self._knowledge_query_vectors)
+
+            started_at = time.monotonic()
+            ann = build_ann_index(vectors)
+            recall = measure_recall(ann, vectors, self._recall_queries(vectors, recent))
+            self._ann_recall = recall
+            metrics_registry.set_gauge("vector_index_ann_recall", recall, index="knowledge")
+            log_extra = {
+                "kind": index_kind(ann),
+                "vectors": snapshot,
+                "recall": round(recall, 4),
+                "build_seconds": round(time.monotonic() - started_at, 2),
+            }
+            if recall < settings.VECTOR_ANN_MIN_RECALL:
+                self._ann_retry_at = snapshot * 2
+                metrics_registry.inc("vector_index_migrations_total", index="knowledge", result="rejected")
+                logger.warning("Knowledge ANN index recall too low, keeping flat index", extra=log_extra)
+                return
+
+            with self._index_lock:
+                # 向量ID即写入顺序，写快照重新打开索引不影响补齐
+                current = self.knowledge_memory_index
+                if not is_flat_index(current.base):
+                    return
+                if current.ntotal > snapshot:
+                    ann.add(current.reconstruct_n(snapshot, current.ntotal - snapshot))
+                self.knowledge_memory_index = SegmentedIndex(ann, with_ids=False)
+            metrics_registry.inc("vector_index_migrations_total", index="knowledge", result="swapped")
+            logger.info("Knowledge index migrated to ANN index", extra=log_extra)
+            # 近似索引不在预写日志中，立即写入快照，避免重启后重新构建
+            self._save_indexes()
+        except Exception as e:
+            self._ann_retry_at = self.knowledge_memory_index.ntotal * 2
+            metrics_registry.inc("vector_index_migrations_total", index="knowledge", result="failed")
+            logger.error(f"知识索引迁移失败: {e}")
+        finally:
+            self._ann_building = False
+
     # ============ 混合检索 ============
     
     def hybrid_search(
@@ -756,7 +1224,7 @@ class VectorMemoryService:
     # ============ 维护方法 ============
     
     def save(self):
-        """保存索引和元数据"""
+        """立即写入快照（压缩预写日志）"""
         with self._save_lock:
             if self._save_timer:
                 self._save_timer.cancel()
@@ -769,7 +1237,15 @@ class VectorMemoryService:
         return {
             "user_memory_count": self.user_memory_index.ntotal,
             "knowledge_memory_count": self.knowledge_memory_index.ntotal,
+            "knowledge_index_type": index_kind(self.knowledge_memory_index.base),
+            "user_storage": storage_kind(self.user_memory_index.base),
+            "user_bytes_per_vector": bytes_per_vector(self.user_memory_index.base),
+            "exact_vector_bytes": self._exact_vectors.size_bytes() if self._exact_vectors is not None else 0,
+            "index_mmap": settings.VECTOR_INDEX_MMAP,
+            "knowledge_ann_recall": self._ann_recall,
             "vector_dimension": self.vector_dim,
+            "wal_bytes": self._wal.size_bytes(),
+            "snapshot_generation": self._snapshot_generation,
             "memory_directory": str(self.memory_dir)
         }
 
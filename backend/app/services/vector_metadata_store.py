@@ -0,0 +1,160 @@
+"""
+记忆元数据存储
+元数据保存在记忆目录下的 SQLite 数据库中（WAL 模式），启动时只打开连接，不再把整份 JSON 解析成字典；
+按ID读取单条元数据，按 user_id / type 的查询走索引。
+快照之后的写入（预写日志重放与新写入）保存在内存增量中，写快照时在一个事务内只插入增量行，
+不复制已有数据；数据库记录已包含的ID上界与快照代数。
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.observability.logger import default_logger as logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    type TEXT,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_memories_user ON memories (user_id, type, id);
+CREATE TABLE IF NOT EXISTS snapshot_info (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class MetadataStore:
+    """SQLite 元数据库（惰性按ID读取）+ 内存增量"""
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path: SQLite 数据库文件，不存在时创建
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        # 读连接；写快照时另开连接写入，WAL 模式下读写互不阻塞
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        info = dict(self._conn.execute("SELECT key, value FROM snapshot_info").fetchall())
+        max_id = self._conn.execute("SELECT MAX(id) FROM memories").fetchone()[0]
+        self._snapshot_max_id = -1 if max_id is None else max_id
+        # 数据库已包含全部ID小于 committed_limit 的条目；旧版本快照文件没有记录时按最大ID推算
+        self._committed_limit = info.get("limit", self._snapshot_max_id + 1)
+        self._snapshot_count = info["count"] if "count" in info else (
+            self._conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+        )
+        self.generation = info.get("generation", 0)
+        self._delta: Dict[int, Dict[str, Any]] = {}
+        self._delta_by_user: Dict[Any, List[int]] = {}
+
+    def load_legacy_json(self, path: Path) -> None:
+        """读取旧版本的 JSON 元数据（放入增量，下次快照时写入数据库）"""
+        with open(path, 'r', encoding='utf-8') as f:
+            for key, metadata in json.load(f).items():
+                self.put(int(key), metadata)
+        logger.info(f"已读取旧版本元数据 {path.name}，共 {len(self._delta)} 条，将在下次快照时写入 SQLite")
+
+    @property
+    def committed_limit(self) -> int:
+        return self._committed_limit
+
+    def get(self, memory_id: int) -> Optional[Dict[str, Any]]:
+        metadata = self._delta.get(memory_id)
+        if metadata is not None:
+            return metadata
+        with self._lock:
+            row = self._conn.execute("SELECT metadata FROM memories WHERE id = ?", (memory_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __contains__(self, memory_id: int) -> bool:
+        return self.get(memory_id) is not None
+
+    def __len__(self) -> int:
+        return self._snapshot_count + len(self._delta)
+
+    def put(self, memory_id: int, metadata: Dict[str, Any]) -> None:
+        """写入增量；元数据按ID只写一次，数据库中已有的ID（重放已提交的日志）直接跳过"""
+        with self._lock:
+            if memory_id < self._committed_limit or memory_id in self._delta:
+                return
+            self._delta[memory_id] = metadata
+            self._delta_by_user.setdefault(metadata.get("user_id"), []).append(memory_id)
+
+    def max_id(self) -> int:
+        return max(self._snapshot_max_id, max(self._delta, default=-1))
+
+    def ids_for_user(self, user_id: str, memory_types: Optional[List[str]] = None) -> List[int]:
+        """该用户（及指定记忆类型）的ID，按写入顺序"""
+        # 只读取已登记提交的行：写快照提交后、丢弃增量前，新行同时存在于数据库与增量中
+        sql = "SELECT id FROM memories WHERE user_id = ? AND id < ?"
+        with self._lock:
+            params: List[Any] = [user_id, self._committed_limit]
+            if memory_types:
+                sql += f" AND type IN ({','.join('?' * len(memory_types))})"
+                params.extend(memory_types)
+            ids = [row[0] for row in self._conn.execute(sql + " ORDER BY id", params)]
+            ids.extend(
+                memory_id for memory_id in self._delta_by_user.get(user_id, [])
+                if not memory_types or self._delta[memory_id].get("type") in memory_types
+            )
+        return ids
+
+    def delta_items(self, min_id: int = 0) -> Dict[int, Dict[str, Any]]:
+        """内存增量中ID不小于 min_id 的条目（副本）"""
+        with self._lock:
+            return {memory_id: metadata for memory_id, metadata in self._delta.items() if memory_id >= min_id}
+
+    def commit(self, items: Dict[int, Dict[str, Any]], limit: int, generation: int) -> None:
+        """
+        写快照：在一个事务内插入增量行并记录ID上界与快照代数，提交后丢弃已写入的内存增量
+
+        Args:
+            items: 需要写入的增量元数据（delta_items() 的结果）
+            limit: 本次快照包含的ID上界（不含）
+            generation: 快照代数
+        """
+        conn = sqlite3.connect(str(self.path))
+        try:
+            with conn:
+                before = conn.total_changes
+                conn.executemany(
+                    "INSERT OR IGNORE INTO memories (id, user_id, type, metadata) VALUES (?, ?, ?, ?)",
+                    [
+                        (memory_id, metadata.get("user_id"), metadata.get("type"), json.dumps(metadata, ensure_ascii=False))
+                        for memory_id, metadata in items.items()
+                    ],
+                )
+                inserted = conn.total_changes - before
+                conn.executemany(
+                    "INSERT OR REPLACE INTO snapshot_info (key, value) VALUES (?, ?)",
+                    [
+                        ("count", self._snapshot_count + inserted),
+                        ("limit", max(limit, self._committed_limit)),
+                        ("generation", generation),
+                    ],
+                )
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._snapshot_count += inserted
+            self._committed_limit = max(limit, self._committed_limit)
+            self._snapshot_max_id = max(self._snapshot_max_id, max(items, default=-1))
+            self.generation = generation
+            for memory_id in [memory_id for memory_id in self._delta if memory_id < self._committed_limit]:
+                del self._delta[memory_id]
+            delta_by_user: Dict[Any, List[int]] = {}
+            for memory_id, metadata in self._delta.items():
+                delta_by_user.setdefault(metadata.get("user_id"), []).append(memory_id)
+            self._delta_by_user = delta_by_user
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,119 @@
+"""
+向量记忆预写日志（WAL）
+每次写入记忆只把新增的向量与元数据追加到 wal.log（每行一条 JSON，向量为 base64 float32），
+不再重写整个索引和元数据文件。VectorMemoryService 定期把内存中的索引压缩为快照，
+快照开始前把当前日志轮转为 wal.old.log，快照写完后删除。
+启动时先加载快照，再依次重放 wal.old.log 与 wal.log；重放按向量ID去重，重复重放是安全的。
+"""
+import base64
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+from app.observability.logger import default_logger as logger
+
+
+def encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype="float32").tobytes()).decode("ascii")
+
+
+def decode_vector(encoded: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(encoded), dtype="float32")
+
+
+class VectorWAL:
+    """追加写日志（进程内线程安全）"""
+
+    def __init__(self, directory: Path, fsync: bool = False):
+        """
+        Args:
+            directory: 日志所在目录（与快照同目录）
+            fsync: 每次追加后是否 fsync；关闭时进程崩溃不丢数据，但掉电可能丢失最近的写入
+        """
+        self.path = Path(directory) / "wal.log"
+        self.rotated_path = Path(directory) / "wal.old.log"
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._truncate_torn_tail(self.path)
+        self._file = open(self.path, "ab")
+
+    @staticmethod
+    def _truncate_torn_tail(path: Path) -> None:
+        """进程在写入中途退出时，最后一行可能不完整；截断到最后一个换行，避免与后续记录粘连"""
+        if not path.exists() or path.stat().st_size == 0:
+            return
+        with open(path, "rb+") as file:
+            data = file.read()
+            if data.endswith(b"\n"):
+                return
+            keep = data.rfind(b"\n") + 1
+            file.truncate(keep)
+        logger.warning("Truncated torn vector WAL tail", extra={"path": str(path), "dropped_bytes": len(data) - keep})
+
+    def append(self, records: List[Dict[str, Any]]) -> None:
+        """追加一组记录（一次写入）"""
+        if not records:
+            return
+        payload = b"".join(
+            json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            for record in records
+        )
+        with self._lock:
+            self._file.write(payload)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def rotate(self) -> None:
+        """快照开始前调用：当前日志并入 wal.old.log，之后的写入进入新的 wal.log"""
+        with self._lock:
+            self._file.close()
+            if self.rotated_path.exists():
+                # 上次快照没有完成，旧日志仍需保留
+                with open(self.rotated_path, "ab") as rotated, open(self.path, "rb") as current:
+                    rotated.write(current.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.rotated_path)
+            self._file = open(self.path, "ab")
+
+    def discard_rotated(self) -> None:
+        """快照写入完成后删除已包含在快照中的旧日志"""
+        try:
+            os.remove(self.rotated_path)
+        except FileNotFoundError:
+            pass
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """按写入顺序读出 wal.old.log 与 wal.log 中的记录，无法解析的行跳过"""
+        for path in (self.rotated_path, self.path):
+            if not path.exists():
+                continue
+            with open(path, "rb") as file:
+                for line_number, line in enumerate(file, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logger.warning(
+                            "Skipping unreadable vector WAL record",
+                            extra={"path": str(path), "line": line_number},
+                        )
+
+    def size_bytes(self) -> int:
+        total = 0
+        for path in (self.rotated_path, self.path):
+            try:
+                total += path.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
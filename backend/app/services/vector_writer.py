@@ -0,0 +1,99 @@
+"""
+向量记忆单写线程
+所有向量写入提交到同一个队列，由一个后台线程按批应用：分配ID、一次 add 写入整批向量、
+一次追加预写日志。写入方等待 Future 返回分配到的ID；读取方在索引锁内看到的要么是整批写入之前、要么是之后的状态。
+"""
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.observability.logger import default_logger as logger
+from app.observability.metrics import metrics_registry
+
+
+class VectorWriter:
+    """单写线程队列"""
+
+    def __init__(
+        self,
+        apply_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 256,
+        name: str = "vector-writer",
+    ):
+        """
+        Args:
+            apply_batch: 在写线程中应用一批写操作，返回与输入一一对应的结果
+            max_batch_size: 单批最多写操作数
+            name: 后台线程名称
+        """
+        self._apply_batch = apply_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue: "queue.Queue[Tuple[List[Any], Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._writes = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, items: Sequence[Any]) -> Future:
+        """提交一组写操作（在同一批中连续应用），Future 的结果为对应的结果列表"""
+        future: Future = Future()
+        items = list(items)
+        if not items:
+            future.set_result([])
+            return future
+        self._queue.put((items, future))
+        return future
+
+    def write(self, items: Sequence[Any], timeout: Optional[float] = None) -> List[Any]:
+        """提交并等待写入完成"""
+        if threading.current_thread() is self._thread:
+            return self._apply_batch(list(items))
+        return self.submit(items).result(timeout=timeout)
+
+    def _collect(self) -> List[Tuple[List[Any], Future]]:
+        """阻塞等待第一个请求，再取走队列中已有的请求（不额外等待）"""
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        while size < self.max_batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            pending = [(items, future) for items, future in batch if future.set_running_or_notify_cancel()]
+            if not pending:
+                continue
+            items = [item for request_items, _ in pending for item in request_items]
+            try:
+                results = self._apply_batch(items)
+            except Exception as exc:
+                logger.error("Vector write batch failed", extra={"batch_size": len(items), "error": str(exc)})
+                for _, future in pending:
+                    future.set_exception(exc)
+                continue
+
+            offset = 0
+            for request_items, future in pending:
+                future.set_result(results[offset:offset + len(request_items)])
+                offset += len(request_items)
+            with self._lock:
+                self._batches += 1
+                self._writes += len(items)
+            metrics_registry.observe("vector_write_batch_size", len(items))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "writes": self._writes,
+                "avg_batch_size": round(self._writes / self._batches, 2) if self._batches else 0.0,
+                "queued": self._queue.qsize(),
+            }
@@ -55,6 +55,31 @@ except ImportError:
     StreamableHttpTransport = None
 
 
+def pooled_httpx_client_factory(max_connections: int = 10, keepalive_expiry: float = 60.0):
+    """
+    创建 Streamable HTTP 传输使用的 httpx 客户端工厂：限制连接数并保持 keep-alive，
+    配合长连接会话使多个请求复用同一组到 MCP 服务器的 TCP 连接
+    """
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+
+    def factory(headers=None, timeout=None, auth=None):
+        return httpx.AsyncClient(
+            headers=headers,
+            timeout=timeout or httpx.Timeout(30.0, read=300.0),
+            auth=auth,
+            limits=limits,
+            follow_redirects=True,
+        )
+
+    return factory
+
+
 class MCPClient:
     """MCP 客户端，支持多种传输方式"""
 
@@ -212,6 +237,13 @@ class MCPClient:
             self._context_manager = None
         print("🔌 连接已断开")
 
+    @property
+    def server_version(self) -> Optional[str]:
+        """服务器在握手时上报的版本（未连接或服务器未上报时为None）"""
+        initialize_result = getattr(self.client, "initialize_result", None)
+        server_info = getattr(initialize_result, "serverInfo", None)
+        return getattr(server_info, "version", None)
+
     async def list_tools(self) -> List[Dict[str, Any]]:
         """列出所有可用的工具"""
         if not self.client:
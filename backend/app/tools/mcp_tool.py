@@ -1,6 +1,15 @@
 from typing import Dict, Any, List, Optional
 from .base import Tool, ToolParameter
 import os
+import time
+
+import anyio
+import httpx
+
+from app.exceptions.custom_exceptions import CircuitBreakerOpenException
+from app.middleware.circuit_breaker import circuit_breaker_manager
+from app.observability.logger import default_logger as logger
+from app.services.llm_gateway import GatewayTimeoutError
 
 
 # MCP服务器环境变量映射表
@@ -14,6 +23,34 @@ MCP_SERVER_ENV_MAP = {
     "server-filesystem": [],  # 不需要环境变量
 }
 
+# 说明连接或会话已不可用的错误：长连接会话遇到这些错误时重建会话重试
+# （工具调用错误、参数错误等说明会话可用，直接抛出）
+MCP_TRANSPORT_ERRORS = (
+    httpx.TransportError,
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+)
+
+# 计入服务器熔断的错误：连接失败与超时（工具调用错误、参数错误等不说明服务器不可用）
+MCP_FAILURE_EXCEPTIONS = MCP_TRANSPORT_ERRORS + (
+    ConnectionError,
+    TimeoutError,
+    GatewayTimeoutError,
+)
+
+
+def is_session_closed_error(exc: BaseException) -> bool:
+    """是否为传输层错误或 MCP 连接已关闭的错误"""
+    if isinstance(exc, MCP_TRANSPORT_ERRORS):
+        return True
+    try:
+        from mcp.shared.exceptions import McpError
+        from mcp.types import CONNECTION_CLOSED
+    except ImportError:
+        return False
+    return isinstance(exc, McpError) and exc.error.code == CONNECTION_CLOSED
+
 
 class MCPTool(Tool):
     """MCP (Model Context Protocol) 工具
@@ -53,7 +90,13 @@ class MCPTool(Tool):
                  server: Optional[Any] = None,
                  auto_expand: bool = True,
                  env: Optional[Dict[str, str]] = None,
-                 env_keys: Optional[List[str]] = None):
+                 env_keys: Optional[List[str]] = None,
+                 schema_cache_path: Optional[str] = None,
+                 schema_refresh_seconds: float = 3600,
+                 server_url: Optional[str] = None,
+                 persistent_session: bool = False,
+                 http_max_connections: int = 10,
+                 slow_call_seconds: float = 15.0):
         """
         初始化 MCP 工具
 
@@ -66,6 +109,12 @@ class MCPTool(Tool):
             auto_expand: 是否自动展开为独立工具（默认True）
             env: 环境变量字典（优先级最高，直接传递给MCP服务器）
             env_keys: 要从系统环境变量加载的key列表（优先级中等）
+            schema_cache_path: 工具列表缓存文件路径（可选，仅对 server_command 启动的服务器生效）
+            schema_refresh_seconds: 缓存超过该时长（秒）时在后台重新发现工具，0 表示每次启动都刷新
+            server_url: 远程 MCP 服务器地址（Streamable HTTP 传输，优先于 server_command）
+            persistent_session: 是否保持一个长连接会话跨调用复用（默认每次调用新建连接）
+            http_max_connections: HTTP 传输时连接池的最大连接数
+            slow_call_seconds: 调用耗时超过该值（秒）记为慢调用，计入该服务器的熔断统计
 
         环境变量优先级（从高到低）：
             1. 直接传递的env参数
@@ -99,8 +148,19 @@ class MCPTool(Tool):
         self.server_command = server_command
         self.server_args = server_args or []
         self.server = server
+        self.server_url = server_url
+        self.persistent_session = persistent_session
+        self._transport_kwargs = self._http_transport_kwargs(http_max_connections) if server_url else {}
+        self._session = None
+        self._session_lock = None
         self._client = None
         self._available_tools = []
+        # 每个 MCP 服务器一个熔断器，展开后的各个工具共享
+        self._breaker = circuit_breaker_manager.get_breaker(
+            f"mcp:{name}",
+            slow_call_seconds=slow_call_seconds,
+            failure_exceptions=MCP_FAILURE_EXCEPTIONS,
+        )
         self.auto_expand = auto_expand
         self.prefix = f"{name}_" if auto_expand else ""
 
@@ -108,11 +168,18 @@ class MCPTool(Tool):
         self.env = self._prepare_env(env, env_keys, server_command)
 
         # 如果没有指定任何服务器，创建内置演示服务器
-        if not server_command and not server:
+        if not server_command and not server and not server_url:
             self.server = self._create_builtin_server()
 
-        # 自动发现工具
-        self._discover_tools()
+        # 自动发现工具（有缓存时直接使用缓存，并在后台刷新）
+        self._schema_cache_key = None
+        self._schema_cache = None
+        if schema_cache_path and (server_url or server_command) and not server:
+            from .schema_cache import ToolSchemaCache, schema_cache_key
+            self._schema_cache = ToolSchemaCache(schema_cache_path)
+            self._schema_cache_key = schema_cache_key(self._server_identity, self.server_args)
+        self.schema_refresh_seconds = schema_refresh_seconds
+        self._load_tools()
 
         # 设置默认描述或自动生成
         if description is None:
@@ -178,25 +245,99 @@ class MCPTool(Tool):
                 print(f"🔑 使用直接传递的环境变量: {key}")
 
         return result_env
+
+    @property
+    def _server_identity(self) -> List[str]:
+        """用于缓存键和日志的服务器标识（远程地址或启动命令）"""
+        return [self.server_url] if self.server_url else list(self.server_command or [])
+
+    def _client_source(self):
+        """连接源：内存服务器 > 远程地址 > 启动命令"""
+        return self.server or self.server_url or self.server_command
+
+    @staticmethod
+    def _http_transport_kwargs(max_connections: int) -> Dict[str, Any]:
+        """HTTP 传输使用带连接上限和 keep-alive 的连接池（fastmcp 版本不支持自定义客户端时使用默认客户端）"""
+        import inspect
+
+        from .client import StreamableHttpTransport, pooled_httpx_client_factory
+
+        try:
+            parameters = inspect.signature(StreamableHttpTransport.__init__).parameters
+        except (TypeError, ValueError):
+            return {}
+        if "httpx_client_factory" not in parameters:
+            return {}
+        return {"httpx_client_factory": pooled_httpx_client_factory(max_connections)}
+
+    def _new_client(self):
+        from .client import MCPClient
+        return MCPClient(self._client_source(), self.server_args, env=self.env, **self._transport_kwargs)
+
+    async def _get_session(self):
+        """返回已连接的长连接会话（在共享的后台事件循环中创建和使用）"""
+        import asyncio
+
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+        async with self._session_lock:
+            if self._session is None:
+                session = self._new_client()
+                await session.__aenter__()
+                self._session = session
+                logger.info("MCP session opened", extra={"server": " ".join(self._server_identity)})
+            return self._session
+
+    async def _close_session(self) -> None:
+        session, self._session = self._session, None
+        if session is not None:
+            try:
+                await session.__aexit__(None, None, None)
+            except Exception as exc:
+                logger.debug("Failed to close MCP session cleanly", extra={"error": str(exc)})
+
+    async def _with_client(self, operation):
+        """
+        使用 MCP 客户端执行操作
+
+        persistent_session 为 True 时复用长连接会话；复用的会话遇到传输层错误（如连接已被服务端关闭）时重建会话重试一次，
+        其他错误（工具调用失败、参数错误等）保留会话直接抛出
+        """
+        if not self.persistent_session:
+            async with self._new_client() as client:
+                return await operation(client)
+
+        reused = self._session is not None
+        client = await self._get_session()
+        try:
+            return await operation(client)
+        except Exception as exc:
+            if not is_session_closed_error(exc):
+                raise
+            await self._close_session()
+            if not reused:
+                raise
+            logger.warning(
+                "MCP session call failed, reconnecting",
+                extra={"server": " ".join(self._server_identity), "error": str(exc)},
+            )
+            client = await self._get_session()
+            return await operation(client)
+
     # === 新增以下方法以支持 Agent 的合规调用 ===
     async def execute_tool(self, tool_name: str, arguments: Dict[str, Any] = None) -> Any:
         """
         执行工具并返回原始数据结构 (Dict/List)，而非字符串描述。
         使用 async with 确保连接在使用后立即关闭，解决 'Event loop is closed' 问题。
         """
-        from .client import MCPClient
-        
         arguments = arguments or {}
         
-        # 确定连接源 (优先使用 server 实例，其次是命令)
-        client_source = self.server if self.server else self.server_command
-        if not client_source:
+        # 确定连接源 (优先使用 server 实例，其次是远程地址和命令)
+        if not self._client_source():
              # 如果没有配置，这里需要根据您的实际情况处理，或者抛出异常
-             raise ValueError("MCPTool 未配置 server_command 或 server 实例")
+             raise ValueError("MCPTool 未配置 server_command、server_url 或 server 实例")
 
-        # 使用上下文管理器，确保 Transport 在 block 结束时正确关闭
-        async with MCPClient(client_source, self.server_args, env=self.env) as client:
-            return await client.call_tool(tool_name, arguments)
+        return await self._with_client(lambda client: client.call_tool(tool_name, arguments))
     def _create_builtin_server(self):
         """创建内置演示服务器"""
         try:
@@ -250,40 +391,92 @@ class MCPTool(Tool):
                 "创建内置 MCP 服务器需要 fastmcp 库。请安装: pip install fastmcp"
             )
 
+    async def _discover_tools_async(self):
+        """连接服务器列出工具，返回 (工具列表, 服务器版本)"""
+        async def discover(client):
+            return await client.list_tools(), client.server_version
+
+        return await self._with_client(discover)
+
+    def _save_tools_to_cache(self, tools: List[Dict[str, Any]], server_version: Optional[str]) -> None:
+        if self._schema_cache is not None and tools:
+            self._schema_cache.save(self._schema_cache_key, self._server_identity, tools, server_version)
+
+    def _load_tools(self):
+        """加载工具列表：优先使用本地缓存（过期时后台刷新），没有缓存时同步发现"""
+        if self._schema_cache is None:
+            self._discover_tools()
+            return
+
+        entry = self._schema_cache.load(self._schema_cache_key)
+        if entry is None:
+            self._discover_tools()
+            return
+
+        self._available_tools = entry["tools"]
+        age = time.time() - float(entry.get("discovered_at") or 0)
+        logger.info(
+            "Loaded MCP tools from cache",
+            extra={
+                "command": " ".join(self._server_identity),
+                "tool_count": len(self._available_tools),
+                "server_version": entry.get("server_version"),
+                "age_seconds": round(age),
+            },
+        )
+        if age >= self.schema_refresh_seconds:
+            self._refresh_tools_in_background(entry)
+
+    def _refresh_tools_in_background(self, cached_entry: Dict[str, Any]) -> None:
+        """在共享的后台事件循环中重新发现工具并更新缓存，不阻塞启动"""
+        from app.services.async_bridge import get_event_loop_bridge
+
+        async def refresh():
+            try:
+                tools, server_version = await self._discover_tools_async()
+            except Exception as exc:
+                logger.warning(
+                    "Background MCP tool refresh failed, keeping cached tools",
+                    extra={"command": " ".join(self._server_identity), "error": str(exc)},
+                )
+                return
+            if not tools:
+                return
+            changed = (
+                [tool.get("name") for tool in tools] != [tool.get("name") for tool in cached_entry["tools"]]
+                or server_version != cached_entry.get("server_version")
+            )
+            self._save_tools_to_cache(tools, server_version)
+            if changed:
+                self._available_tools = tools
+                # 已展开注册的子工具在下次启动时才会更新
+                logger.info(
+                    "MCP tool list changed since cache was written",
+                    extra={
+                        "command": " ".join(self._server_identity),
+                        "tool_count": len(tools),
+                        "server_version": server_version,
+                    },
+                )
+
+        get_event_loop_bridge().submit(refresh())
+
     def _discover_tools(self):
         """发现MCP服务器提供的所有工具"""
         try:
-            from .client import MCPClient
-            import asyncio
+            from app.services.async_bridge import run_sync
 
-            async def discover():
-                client_source = self.server if self.server else self.server_command
-                async with MCPClient(client_source, self.server_args, env=self.env) as client:
-                    tools = await client.list_tools()
-                    return tools
-
-            # 运行异步发现
-            try:
-                loop = asyncio.get_running_loop()
-                # 如果已有循环，在新线程中运行
-                import concurrent.futures
-                def run_in_thread():
-                    new_loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(new_loop)
-                    try:
-                        return new_loop.run_until_complete(discover())
-                    finally:
-                        new_loop.close()
-
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future = executor.submit(run_in_thread)
-                    self._available_tools = future.result()
-            except RuntimeError:
-                # 没有运行中的循环
-                self._available_tools = asyncio.run(discover())
+            # 在共享的后台事件循环中运行异步发现
+            tools, server_version = run_sync(self._discover_tools_async())
+            self._available_tools = tools
+            self._save_tools_to_cache(tools, server_version)
 
         except Exception as e:
-            # 工具发现失败不影响初始化
+            # 工具发现失败不影响初始化，但需要记录，否则智能体会在没有工具的情况下静默运行
+            logger.warning(
+                "MCP tool discovery failed, continuing without tools",
+                extra={"command": " ".join(self._server_identity), "error": str(e)},
+            )
             self._available_tools = []
 
     def _generate_description(self) -> str:
@@ -376,99 +569,75 @@ class MCPTool(Tool):
         
         try:
             # 使用增强的异步客户端
-            import asyncio
-            from .client import MCPClient
+            from app.services.async_bridge import run_sync
+
+            async def mcp_operation(client):
+                if action == "list_tools":
+                    tools = await client.list_tools()
+                    if not tools:
+                        return "没有找到可用的工具"
+                    result = f"找到 {len(tools)} 个工具:\n"
+                    for tool in tools:
+                        result += f"- {tool['name']}: {tool['description']}\n"
+                    return result
+
+                elif action == "call_tool":
+                    tool_name = parameters.get("tool_name")
+                    arguments = parameters.get("arguments", {})
+                    if not tool_name:
+                        return "错误：必须指定 tool_name 参数"
+                    result = await client.call_tool(tool_name, arguments)
+                    return f"工具 '{tool_name}' 执行结果:\n{result}"
+
+                elif action == "list_resources":
+                    resources = await client.list_resources()
+                    if not resources:
+                        return "没有找到可用的资源"
+                    result = f"找到 {len(resources)} 个资源:\n"
+                    for resource in resources:
+                        result += f"- {resource['uri']}: {resource['name']}\n"
+                    return result
+
+                elif action == "read_resource":
+                    uri = parameters.get("uri")
+                    if not uri:
+                        return "错误：必须指定 uri 参数"
+                    content = await client.read_resource(uri)
+                    return f"资源 '{uri}' 内容:\n{content}"
+
+                elif action == "list_prompts":
+                    prompts = await client.list_prompts()
+                    if not prompts:
+                        return "没有找到可用的提示词"
+                    result = f"找到 {len(prompts)} 个提示词:\n"
+                    for prompt in prompts:
+                        result += f"- {prompt['name']}: {prompt['description']}\n"
+                    return result
+
+                elif action == "get_prompt":
+                    prompt_name = parameters.get("prompt_name")
+                    prompt_arguments = parameters.get("prompt_arguments", {})
+                    if not prompt_name:
+                        return "错误：必须指定 prompt_name 参数"
+                    messages = await client.get_prompt(prompt_name, prompt_arguments)
+                    result = f"提示词 '{prompt_name}':\n"
+                    for msg in messages:
+                        result += f"[{msg['role']}] {msg['content']}\n"
+                    return result
 
-            async def run_mcp_operation():
-                # 根据配置选择客户端创建方式
-                if self.server:
-                    # 使用内置服务器（内存传输）
-                    client_source = self.server
                 else:
-                    # 使用外部服务器命令
-                    client_source = self.server_command
-
-                async with MCPClient(client_source, self.server_args, env=self.env) as client:
-                    if action == "list_tools":
-                        tools = await client.list_tools()
-                        if not tools:
-                            return "没有找到可用的工具"
-                        result = f"找到 {len(tools)} 个工具:\n"
-                        for tool in tools:
-                            result += f"- {tool['name']}: {tool['description']}\n"
-                        return result
-
-                    elif action == "call_tool":
-                        tool_name = parameters.get("tool_name")
-                        arguments = parameters.get("arguments", {})
-                        if not tool_name:
-                            return "错误：必须指定 tool_name 参数"
-                        result = await client.call_tool(tool_name, arguments)
-                        return f"工具 '{tool_name}' 执行结果:\n{result}"
-
-                    elif action == "list_resources":
-                        resources = await client.list_resources()
-                        if not resources:
-                            return "没有找到可用的资源"
-                        result = f"找到 {len(resources)} 个资源:\n"
-                        for resource in resources:
-                            result += f"- {resource['uri']}: {resource['name']}\n"
-                        return result
-
-                    elif action == "read_resource":
-                        uri = parameters.get("uri")
-                        if not uri:
-                            return "错误：必须指定 uri 参数"
-                        content = await client.read_resource(uri)
-                        return f"资源 '{uri}' 内容:\n{content}"
-
-                    elif action == "list_prompts":
-                        prompts = await client.list_prompts()
-                        if not prompts:
-                            return "没有找到可用的提示词"
-                        result = f"找到 {len(prompts)} 个提示词:\n"
-                        for prompt in prompts:
-                            result += f"- {prompt['name']}: {prompt['description']}\n"
-                        return result
-
-                    elif action == "get_prompt":
-                        prompt_name = parameters.get("prompt_name")
-                        prompt_arguments = parameters.get("prompt_arguments", {})
-                        if not prompt_name:
-                            return "错误：必须指定 prompt_name 参数"
-                        messages = await client.get_prompt(prompt_name, prompt_arguments)
-                        result = f"提示词 '{prompt_name}':\n"
-                        for msg in messages:
-                            result += f"[{msg['role']}] {msg['content']}\n"
-                        return result
-
-                    else:
-                        return f"错误：不支持的操作 '{action}'"
-
-            # 运行异步操作
+                    return f"错误：不支持的操作 '{action}'"
+
+            async def run_mcp_operation():
+                # 内置服务器使用内存传输，其余按远程地址或启动命令连接（可复用长连接会话）
+                return await self._with_client(mcp_operation)
+
+            # 运行异步操作（共享的后台事件循环，不再为每次调用新建线程和循环）
+            # 服务器熔断时直接返回，不再等待连接或调用超时
             try:
-                # 检查是否已有运行中的事件循环
-                try:
-                    loop = asyncio.get_running_loop()
-                    # 如果有运行中的循环，在新线程中运行新的事件循环
-                    import concurrent.futures
-                    import threading
-
-                    def run_in_thread():
-                        # 在新线程中创建新的事件循环
-                        new_loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(new_loop)
-                        try:
-                            return new_loop.run_until_complete(run_mcp_operation())
-                        finally:
-                            new_loop.close()
-
-                    with concurrent.futures.ThreadPoolExecutor() as executor:
-                        future = executor.submit(run_in_thread)
-                        return future.result()
-                except RuntimeError:
-                    # 没有运行中的循环，直接运行
-                    return asyncio.run(run_mcp_operation())
+                return self._breaker.call(lambda: run_sync(run_mcp_operation()))
+            except CircuitBreakerOpenException as e:
+                return f"MCP 服务暂时不可用（熔断中，约 {e.details['retry_after']} 秒后重试）"
             except Exception as e:
                 return f"异步操作失败: {str(e)}"
                     
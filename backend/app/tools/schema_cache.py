@@ -0,0 +1,87 @@
+"""
+MCP 工具列表缓存
+
+把服务器发现到的工具（名称、描述、input_schema）持久化到本地 JSON 文件，
+启动时直接读取，不必为了列出工具而先启动一次 MCP 服务器。
+
+缓存条目以服务器启动命令（含参数，版本号通常写在命令中，如 amap-mcp-server@1.0）为键，
+并记录服务器握手时上报的版本；后台刷新发现工具或版本变化时覆盖该条目。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.observability.logger import default_logger as logger
+
+CACHE_FORMAT_VERSION = 1
+
+
+def schema_cache_key(server_command: List[str], server_args: Optional[List[str]] = None) -> str:
+    """以服务器命令与参数生成缓存键"""
+    raw = json.dumps([list(server_command or []), list(server_args or [])], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class ToolSchemaCache:
+    """基于单个 JSON 文件的工具列表缓存（进程内线程安全，写入为原子替换）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read_all(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exc:
+            logger.warning("MCP tool cache unreadable, ignoring", extra={"path": self.path, "error": str(exc)})
+            return {}
+        if not isinstance(data, dict) or data.get("format") != CACHE_FORMAT_VERSION:
+            return {}
+        return data.get("servers") or {}
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存条目
+
+        Returns:
+            {"command", "server_version", "discovered_at", "tools"}，没有缓存时返回None
+        """
+        with self._lock:
+            entry = self._read_all().get(key)
+        if not isinstance(entry, dict) or not isinstance(entry.get("tools"), list) or not entry["tools"]:
+            return None
+        return entry
+
+    def save(
+        self,
+        key: str,
+        command: List[str],
+        tools: List[Dict[str, Any]],
+        server_version: Optional[str] = None,
+    ) -> None:
+        """写入缓存条目，失败只记录日志"""
+        entry = {
+            "command": list(command or []),
+            "server_version": server_version,
+            "discovered_at": time.time(),
+            "tools": tools,
+        }
+        with self._lock:
+            servers = self._read_all()
+            servers[key] = entry
+            directory = os.path.dirname(self.path)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(temp_path, "w", encoding="utf-8") as file:
+                    json.dump({"format": CACHE_FORMAT_VERSION, "servers": servers}, file, ensure_ascii=False)
+                os.replace(temp_path, self.path)
+            except OSError as exc:
+                logger.warning("Failed to write MCP tool cache", extra={"path": self.path, "error": str(exc)})
@@ -0,0 +1,160 @@
+"""
+压缩向量存储基准测试
+对比 flat / sq_fp16 / sq_int8 / pq 四种存储方式的每条向量字节数、索引大小、检索耗时，
+以及以 float32 精确检索为基准的 recall@10（不重排 / 按原始向量重排）
+使用带聚类结构的合成归一化向量，不需要加载嵌入模型
+
+运行: python benchmarks/vector_compression.py [--count 200000] [--output results.json]
+"""
+import argparse
+import json
+import sys
+import time
+import traceback
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings
+from app.observability.logger import default_logger as logger
+from app.services.vector_compression import STORAGE_KINDS, build_compressed_index, bytes_per_vector
+
+TOP_K = 10
+
+
+def make_vectors(count: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """生成带聚类结构的归一化向量（接近句向量的分布：同主题文本彼此相近）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype('float32')
+    labels = rng.integers(0, clusters, count)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((count, dim)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def make_queries(vectors: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """在已有向量附近生成查询（模拟与已存记忆语义相近的检索）"""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), count)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype('float32')
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries.astype('float32')
+
+
+def recall(approximate: np.ndarray, exact: np.ndarray) -> float:
+    hits = sum(len(set(approximate[row]) & set(exact[row])) for row in range(len(exact)))
+    return hits / exact.size
+
+
+def rerank(vectors: np.ndarray, queries: np.ndarray, candidates: np.ndarray, k: int) -> np.ndarray:
+    """用原始向量重新计算候选的内积，取前 k 个"""
+    reranked = np.empty((len(queries), k), dtype='int64')
+    for row, query in enumerate(queries):
+        ids = candidates[row][candidates[row] >= 0]
+        scores = vectors[ids] @ query
+        reranked[row] = ids[np.argsort(-scores)[:k]]
+    return reranked
+
+
+def benchmark_storage(kind: str, vectors: np.ndarray, queries: np.ndarray, exact: np.ndarray, factor: int) -> dict:
+    """构建一种存储方式的索引并测量内存、耗时与召回率"""
+    ids = np.arange(len(vectors), dtype='int64')
+    started = time.perf_counter()
+    index = build_compressed_index(vectors, ids, kind)
+    build_seconds = time.perf_counter() - started
+    index_bytes = len(faiss.serialize_index(index))
+
+    started = time.perf_counter()
+    _, labels = index.search(queries, TOP_K)
+    search_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    result = {
+        "storage": kind,
+        "bytes_per_vector": bytes_per_vector(index),
+        "index_mb": round(index_bytes / 1024 / 1024, 1),
+        "build_seconds": round(build_seconds, 2),
+        "search_ms_per_query": round(search_ms, 3),
+        "recall_at_10": round(recall(labels, exact), 4),
+    }
+
+    if kind != "flat" and factor > 0:
+        started = time.perf_counter()
+        _, candidates = index.search(queries, TOP_K * factor)
+        reranked = rerank(vectors, queries, candidates, TOP_K)
+        result["search_ms_per_query_reranked"] = round((time.perf_counter() - started) * 1000 / len(queries), 3)
+        result["recall_at_10_reranked"] = round(recall(reranked, exact), 4)
+    return result
+
+
+def run_compression_benchmark(count: int, query_count: int, clusters: int, factor: int) -> dict:
+    dim = settings.VECTOR_DIM
+    logger.info(f"生成 {count} 条 {dim} 维向量（{clusters} 个聚类），{query_count} 条查询...")
+    vectors = make_vectors(count, dim, clusters)
+    queries = make_queries(vectors, query_count)
+
+    # 精确 float32 内积 top-10 作为基准
+    exact_index = faiss.IndexFlatIP(dim)
+    exact_index.add(vectors)
+    _, exact = exact_index.search(queries, TOP_K)
+
+    results = []
+    for kind in STORAGE_KINDS:
+        logger.info(f"测试存储方式: {kind}")
+        results.append(benchmark_storage(kind, vectors, queries, exact, factor))
+
+    logger.info("=" * 100)
+    logger.info(
+        f"{'存储方式':<10}{'字节/条':>8}{'索引MB':>10}{'百万条GB':>10}"
+        f"{'检索ms':>10}{'recall@10':>12}{'重排ms':>10}{'重排recall@10':>16}"
+    )
+    for result in results:
+        per_million_gb = result["bytes_per_vector"] * 1_000_000 / 1024 ** 3
+        logger.info(
+            f"{result['storage']:<10}{result['bytes_per_vector']:>8}{result['index_mb']:>10}"
+            f"{per_million_gb:>10.2f}{result['search_ms_per_query']:>10}{result['recall_at_10']:>12}"
+            f"{result.get('search_ms_per_query_reranked', '-'):>10}{result.get('recall_at_10_reranked', '-'):>16}"
+        )
+    logger.info("=" * 100)
+
+    return {
+        "vectors": count,
+        "queries": query_count,
+        "dimension": dim,
+        "clusters": clusters,
+        "rerank_factor": factor,
+        "pq_m": settings.VECTOR_PQ_M,
+        "pq_nbits": settings.VECTOR_PQ_NBITS,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="压缩向量存储基准测试")
+    parser.add_argument("--count", type=int, default=200000, help="向量数")
+    parser.add_argument("--queries", type=int, default=1000, help="查询数")
+    parser.add_argument("--clusters", type=int, default=512, help="合成数据的聚类数")
+    parser.add_argument(
+        "--rerank-factor", type=int, default=settings.VECTOR_RERANK_FACTOR, help="重排候选数为 10 * 倍数"
+    )
+    parser.add_argument("--output", type=Path, default=None, help="结果 JSON 的保存路径，不指定时只输出日志")
+    args = parser.parse_args()
+
+    try:
+        report = run_compression_benchmark(args.count, args.queries, args.clusters, args.rerank_factor)
+        logger.info("\n✅ 压缩存储基准测试完成!")
+
+        if args.output is not None:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            logger.info(f"📄 测试结果已保存到: {args.output}")
+
+    except KeyboardInterrupt:
+        logger.warning("\n⚠️  测试被用户中断")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
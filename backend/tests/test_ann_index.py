@@ -0,0 +1,138 @@
+"""
+近似最近邻索引测试
+检查 HNSW / IVF 索引在带聚类结构的合成向量上的召回率、measure_recall 对错误结果的识别，
+以及知识索引迁移：召回率达标时替换平面索引并补齐构建期间新增的向量，不达标时保留平面索引
+"""
+import sys
+import threading
+import traceback
+from collections import deque
+from pathlib import Path
+from types import SimpleNamespace
+
+import faiss
+import numpy as np
+
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings
+from app.services.ann_index import build_ann_index, index_kind, measure_recall
+from app.services.segmented_index import SegmentedIndex
+from benchmarks.vector_compression import make_queries, make_vectors
+
+VECTOR_COUNT = 3000
+DIM = 64
+
+
+def _dataset():
+    vectors = make_vectors(VECTOR_COUNT, DIM, clusters=30)
+    return vectors, make_queries(vectors, 100)
+
+
+def test_hnsw_and_ivf_recall():
+    """按默认参数构建的 HNSW / IVF 索引召回率不低于 VECTOR_ANN_MIN_RECALL，并应用检索参数"""
+    vectors, queries = _dataset()
+
+    hnsw = build_ann_index(vectors, "hnsw")
+    assert index_kind(hnsw) == "hnsw" and hnsw.ntotal == VECTOR_COUNT
+    assert hnsw.hnsw.efSearch == settings.VECTOR_HNSW_EF_SEARCH
+    assert measure_recall(hnsw, vectors, queries) >= settings.VECTOR_ANN_MIN_RECALL
+
+    ivf = build_ann_index(vectors, "ivf")
+    assert index_kind(ivf) == "ivf" and ivf.ntotal == VECTOR_COUNT
+    assert ivf.nprobe == min(settings.VECTOR_IVF_NPROBE, ivf.nlist)
+    assert measure_recall(ivf, vectors, queries) >= settings.VECTOR_ANN_MIN_RECALL
+    # 向量ID与写入顺序一致，可以按ID取回
+    assert np.allclose(ivf.reconstruct(7), vectors[7])
+
+
+def test_measure_recall_detects_wrong_results():
+    """精确索引的召回率为 1；向量ID错位的索引召回率接近 0"""
+    vectors, queries = _dataset()
+    exact = faiss.IndexFlatIP(DIM)
+    exact.add(vectors)
+    assert measure_recall(exact, vectors, queries) == 1.0
+
+    shuffled = faiss.IndexFlatIP(DIM)
+    shuffled.add(vectors[np.random.default_rng(0).permutation(VECTOR_COUNT)])
+    assert measure_recall(shuffled, vectors, queries) < 0.1
+
+
+def _fake_service(vectors: np.ndarray, added_during_build: np.ndarray):
+    """只包含迁移所需属性的服务对象；召回率检查时写入新向量，模拟构建期间的并发写入"""
+    from app.services.vector_memory_service import VectorMemoryService
+
+    base = faiss.IndexFlatIP(DIM)
+    base.add(vectors)
+    service = SimpleNamespace(
+        _index_lock=threading.RLock(),
+        knowledge_memory_index=SegmentedIndex(base, with_ids=False),
+        _knowledge_query_vectors=deque(maxlen=settings.VECTOR_ANN_RECALL_SAMPLES),
+        _ann_building=True,
+        _ann_retry_at=0,
+        _ann_recall=None,
+        saved=[],
+    )
+
+    def recall_queries(all_vectors, recent):
+        service.knowledge_memory_index.add(added_during_build)
+        return VectorMemoryService._recall_queries(service, all_vectors, recent)
+
+    service._recall_queries = recall_queries
+    service._save_indexes = lambda: service.saved.append(True)
+    return service, VectorMemoryService._migrate_knowledge_index
+
+
+def test_knowledge_index_migration():
+    """召回率达标时替换为 HNSW 索引，补齐构建期间新增的向量，并立即写入快照"""
+    vectors, queries = _dataset()
+    extra = make_vectors(50, DIM, clusters=5, seed=7)
+    service, migrate = _fake_service(vectors, extra)
+
+    migrate(service)
+
+    index = service.knowledge_memory_index
+    assert index_kind(index.base) == "hnsw"
+    assert index.ntotal == VECTOR_COUNT + len(extra)
+    assert service._ann_recall >= settings.VECTOR_ANN_MIN_RECALL
+    assert service.saved == [True] and service._ann_building is False
+    # 构建期间新增的向量也能检索到，ID 接在原有向量之后
+    _, labels = index.search(extra[:5], 1)
+    assert list(labels[:, 0]) == list(range(VECTOR_COUNT, VECTOR_COUNT + 5))
+    assert measure_recall(index.base, np.vstack([vectors, extra]), queries) >= settings.VECTOR_ANN_MIN_RECALL
+
+
+def test_knowledge_index_migration_rejected():
+    """召回率不达标时保留平面索引，向量数翻倍后再重试"""
+    vectors, _ = _dataset()
+    service, migrate = _fake_service(vectors, np.empty((0, DIM), dtype='float32'))
+    min_recall = settings.VECTOR_ANN_MIN_RECALL
+    settings.VECTOR_ANN_MIN_RECALL = 1.01
+    try:
+        migrate(service)
+    finally:
+        settings.VECTOR_ANN_MIN_RECALL = min_recall
+
+    assert index_kind(service.knowledge_memory_index.base) == "flat"
+    assert service._ann_retry_at == VECTOR_COUNT * 2
+    assert service.saved == [] and service._ann_building is False
+
+
+if __name__ == "__main__":
+    from app.observability.logger import default_logger as logger
+
+    tests = (
+        test_hnsw_and_ivf_recall,
+        test_measure_recall_detects_wrong_results,
+        test_knowledge_index_migration,
+        test_knowledge_index_migration_rejected,
+    )
+    try:
+        for test in tests:
+            test()
+            logger.info(f"✅ {test.__name__} 通过")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,172 @@
+"""
+熔断器测试
+检查按失败率在达到最少调用数后打开、熔断中拒绝调用、半开状态的试探名额、
+试探调用全部成功后关闭、试探失败重新打开，以及不属于 failure_exceptions 的异常不计为失败
+"""
+import sys
+import time
+import traceback
+from pathlib import Path
+
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.exceptions.custom_exceptions import CircuitBreakerOpenException
+from app.exceptions.error_codes import ErrorCode
+from app.middleware.circuit_breaker import CircuitBreaker, CircuitState
+
+
+def make_breaker(**kwargs) -> CircuitBreaker:
+    options = dict(
+        name="test-breaker",
+        failure_rate_threshold=0.5,
+        window_size=10,
+        minimum_calls=4,
+        open_seconds=30.0,
+        half_open_max_calls=2,
+        failure_exceptions=(ConnectionError, TimeoutError),
+    )
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+def _expect_rejected(breaker: CircuitBreaker) -> None:
+    try:
+        breaker.acquire()
+    except CircuitBreakerOpenException:
+        return
+    raise AssertionError("call was not rejected")
+
+
+def _elapse_open_period(breaker: CircuitBreaker) -> None:
+    """把打开时间往前拨，模拟已经过了 open_seconds"""
+    breaker._opened_at = time.monotonic() - breaker.open_seconds - 1
+
+
+def _trip(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.minimum_calls):
+        breaker.record_failure(ConnectionError("connection refused"))
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_opens_on_failure_rate_after_minimum_calls():
+    """调用数少于 minimum_calls 时不打开；达到后失败率超过阈值才打开"""
+    breaker = make_breaker()
+    for _ in range(breaker.minimum_calls - 1):
+        breaker.record_failure(ConnectionError("connection refused"))
+    assert breaker.state == CircuitState.CLOSED
+
+    # 4 次中 3 次失败，失败率 0.75
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitState.OPEN
+
+    healthy = make_breaker(name="test-healthy")
+    for number in range(8):
+        if number % 4 == 0:
+            healthy.record_failure(ConnectionError("connection refused"))
+        else:
+            healthy.record_success(0.1)
+    # 失败率 0.25，低于阈值
+    assert healthy.state == CircuitState.CLOSED
+    assert healthy.get_stats()["failure_rate"] == 0.25
+
+
+def test_rejects_while_open():
+    """熔断中直接拒绝调用，call 不执行函数，并累计拒绝次数"""
+    breaker = make_breaker()
+    _trip(breaker)
+
+    calls = []
+    for _ in range(3):
+        try:
+            breaker.call(lambda: calls.append(1))
+        except CircuitBreakerOpenException as exc:
+            assert exc.error_code == ErrorCode.CIRCUIT_BREAKER_OPEN
+        else:
+            raise AssertionError("call was not rejected")
+    assert calls == []
+    assert breaker.is_rejecting()
+    assert breaker.get_stats()["rejected"] == 3
+
+
+def test_half_open_permit_limit():
+    """open_seconds 后进入半开，只放行 half_open_max_calls 个试探调用"""
+    breaker = make_breaker()
+    _trip(breaker)
+    _elapse_open_period(breaker)
+
+    assert breaker.state == CircuitState.HALF_OPEN
+    for _ in range(breaker.half_open_max_calls):
+        breaker.acquire()
+    assert breaker.is_rejecting()
+    _expect_rejected(breaker)
+
+
+def test_closes_after_trial_calls_succeed():
+    """试探调用全部成功后关闭，窗口清空后重新统计"""
+    breaker = make_breaker()
+    _trip(breaker)
+    _elapse_open_period(breaker)
+
+    breaker.acquire()
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitState.HALF_OPEN
+    breaker.acquire()
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.get_stats()["window_calls"] == 0
+    breaker.acquire()
+
+
+def test_reopens_on_half_open_failure():
+    """任一试探调用失败即重新打开，并重新开始计算 open_seconds"""
+    breaker = make_breaker()
+    _trip(breaker)
+    _elapse_open_period(breaker)
+
+    breaker.acquire()
+    breaker.record_failure(TimeoutError("read timed out"))
+    assert breaker.state == CircuitState.OPEN
+    _expect_rejected(breaker)
+
+
+def test_non_failure_exceptions_do_not_count():
+    """不属于 failure_exceptions 的异常（如参数错误）说明依赖可用，记为成功"""
+    breaker = make_breaker()
+    for _ in range(breaker.minimum_calls * 2):
+        try:
+            breaker.call(lambda: int("not a number"))
+        except ValueError:
+            pass
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.get_stats()["failure_rate"] == 0.0
+
+    # 半开试探时同样按成功处理
+    breaker.reset()
+    _trip(breaker)
+    _elapse_open_period(breaker)
+    for _ in range(breaker.half_open_max_calls):
+        breaker.acquire()
+        breaker.record_failure(ValueError("bad arguments"))
+    assert breaker.state == CircuitState.CLOSED
+
+
+if __name__ == "__main__":
+    from app.observability.logger import default_logger as logger
+
+    tests = (
+        test_opens_on_failure_rate_after_minimum_calls,
+        test_rejects_while_open,
+        test_half_open_permit_limit,
+        test_closes_after_trial_calls_succeed,
+        test_reopens_on_half_open_failure,
+        test_non_failure_exceptions_do_not_count,
+    )
+    try:
+        for test in tests:
+            test()
+            logger.info(f"✅ {test.__name__} 通过")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,153 @@
+"""
+LLM精确匹配响应缓存测试
+检查缓存键的组成、磁盘后端的命中/过期/淘汰，以及 LLMService.invoke 只对传入 cache_policy 的调用读写缓存
+"""
+import os
+import sys
+import tempfile
+import time
+import traceback
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.llm_cache import CachePolicy, DiskCacheBackend, LLMResponseCache
+from app.services.llm_router import LLMEndpoint, LLMRouter
+
+MESSAGES = [
+    {"role": "system", "content": "你是旅行规划助手"},
+    {"role": "user", "content": "整理北京的景点信息"},
+]
+
+
+def test_cache_key_scoping():
+    """模型、消息、温度、max_tokens、response_format 或其他透传参数任一不同都得到不同的键"""
+    base = dict(model="model-a", messages=MESSAGES, temperature=0.2, max_tokens=512, response_format=None)
+    key = LLMResponseCache.build_key(**base)
+    assert key == LLMResponseCache.build_key(**base)
+
+    variants = [
+        dict(base, model="model-b"),
+        dict(base, messages=MESSAGES[:1] + [{"role": "user", "content": "整理上海的景点信息"}]),
+        dict(base, temperature=0.7),
+        dict(base, max_tokens=1024),
+        dict(base, response_format={"type": "json_object"}),
+        dict(base, extra_params={"top_p": 0.5}),
+        dict(base, extra_params={"stop": ["\n"]}),
+        dict(base, extra_params={"seed": 7}),
+    ]
+    keys = {LLMResponseCache.build_key(**variant) for variant in variants}
+    assert key not in keys and len(keys) == len(variants)
+    # 没有额外参数时键与不传 extra_params 相同
+    assert LLMResponseCache.build_key(**dict(base, extra_params={})) == key
+
+
+def test_disk_cache_hit_miss_and_expiry():
+    """未写入时未命中，写入后命中并累计节省的token；过期条目视为未命中并被删除"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = LLMResponseCache(DiskCacheBackend(cache_dir, max_bytes=1024 * 1024))
+        policy = CachePolicy(namespace="test")
+        key = LLMResponseCache.build_key("model-a", MESSAGES, 0.2, 512)
+
+        assert cache.get(key, policy) is None
+        cache.set(key, "故宫、天坛", {"prompt_tokens": 30, "completion_tokens": 10, "total_tokens": 40}, policy)
+        assert cache.get(key, policy) == "故宫、天坛"
+
+        stats = cache.get_stats()
+        assert (stats["hits"], stats["misses"], stats["writes"]) == (1, 1, 1), stats
+        assert stats["saved_total_tokens"] == 40 and stats["hit_rate"] == 0.5, stats
+
+        expired_key = LLMResponseCache.build_key("model-a", MESSAGES, 0.9, 512)
+        cache.backend.set(expired_key, {"content": "过期内容", "usage": {}}, ttl_seconds=-1)
+        assert cache.get(expired_key, policy) is None
+        assert not cache.backend._entry_path(expired_key).exists()
+
+
+def test_disk_cache_evicts_least_recently_used():
+    """总大小超过上限时按访问时间淘汰，最近读取过的条目保留"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        backend = DiskCacheBackend(cache_dir, max_bytes=2000)
+        keys = [f"{number:02d}{uuid.uuid4().hex}" for number in range(6)]
+        for position, key in enumerate(keys[:5]):
+            backend.set(key, {"content": "x" * 300}, ttl_seconds=3600)
+            # 显式设置修改时间，避免文件系统时间精度影响访问顺序
+            os.utime(backend._entry_path(key), (time.time() - 100 + position, time.time() - 100 + position))
+        # 读取最旧的条目，刷新其访问时间
+        assert backend.get(keys[0]) == {"content": "x" * 300}
+
+        backend.set(keys[5], {"content": "x" * 300}, ttl_seconds=3600)
+        assert backend._total_bytes <= backend.max_bytes
+        assert backend.get(keys[0]) is not None
+        assert backend.get(keys[5]) is not None
+        assert backend.get(keys[1]) is None
+
+
+def test_invoke_reads_cache_only_with_policy():
+    """传入 cache_policy 的相同请求只调用一次模型；不传时每次都调用"""
+    from app.services.llm_service import LLMService
+
+    calls = []
+
+    def create(**params):
+        calls.append(params)
+        usage = SimpleNamespace(prompt_tokens=30, completion_tokens=10, total_tokens=40, prompt_tokens_details=None)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=f"第 {len(calls)} 次回答"))],
+            usage=usage,
+        )
+
+    endpoint = LLMEndpoint(
+        name=f"test-cache-{uuid.uuid4().hex[:8]}",
+        provider="custom",
+        base_url="http://127.0.0.1:9/v1",
+        api_key="EMPTY",
+        model="test-model",
+    )
+    endpoint.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        service = LLMService()
+        service.router = LLMRouter([endpoint])
+        service.response_cache = LLMResponseCache(DiskCacheBackend(cache_dir, max_bytes=1024 * 1024))
+        service.semantic_cache = None
+        policy = CachePolicy(namespace="test")
+
+        first = service.invoke(MESSAGES, cache_policy=policy, model="test-model")
+        second = service.invoke(MESSAGES, cache_policy=policy, model="test-model")
+        assert first == second == "第 1 次回答"
+        assert len(calls) == 1
+
+        # 温度不同属于不同的请求
+        assert service.invoke(MESSAGES, cache_policy=policy, model="test-model", temperature=0.1) == "第 2 次回答"
+        # 不传 cache_policy 时不读缓存
+        assert service.invoke(MESSAGES, model="test-model") == "第 3 次回答"
+        assert len(calls) == 3
+
+        # 透传给模型的其他参数不同也属于不同的请求，且参数照常传给模型
+        assert service.invoke(MESSAGES, cache_policy=policy, model="test-model", top_p=0.5) == "第 4 次回答"
+        assert calls[-1]["top_p"] == 0.5
+        assert service.invoke(MESSAGES, cache_policy=policy, model="test-model", top_p=0.5) == "第 4 次回答"
+        assert service.invoke(MESSAGES, cache_policy=policy, model="test-model", seed=7) == "第 5 次回答"
+        assert len(calls) == 5
+
+
+if __name__ == "__main__":
+    from app.observability.logger import default_logger as logger
+
+    tests = (
+        test_cache_key_scoping,
+        test_disk_cache_hit_miss_and_expiry,
+        test_disk_cache_evicts_least_recently_used,
+        test_invoke_reads_cache_only_with_policy,
+    )
+    try:
+        for test in tests:
+            test()
+            logger.info(f"✅ {test.__name__} 通过")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
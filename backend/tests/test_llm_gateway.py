@@ -0,0 +1,206 @@
+"""
+LLM网关测试
+检查令牌桶的补充与透支修正、并发槽位按优先级分配、排队超时、429 退避期间不占用并发槽位，以及 429 的有界重试
+"""
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import httpx
+import openai
+
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.llm_gateway import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    GatewayTimeoutError,
+    LLMGateway,
+    LocalTokenBucket,
+    PriorityConcurrencyLimiter,
+)
+
+
+def _rewind(bucket: LocalTokenBucket, seconds: float) -> None:
+    """把上次补充时间往前拨，模拟经过了 seconds 秒"""
+    bucket._updated_at -= seconds
+
+
+def test_token_bucket_refill():
+    """每分钟 60 个令牌即每秒补充 1 个；用尽后返回需要等待的秒数，补充不超过容量"""
+    bucket = LocalTokenBucket(per_minute=60)
+    assert bucket.consume(60) == 0.0
+    wait = bucket.consume(2)
+    assert 1.9 < wait <= 2.0, wait
+
+    _rewind(bucket, 2.0)
+    assert bucket.consume(2) == 0.0
+
+    _rewind(bucket, 600.0)
+    bucket._refill_locked()
+    assert bucket._tokens == bucket.capacity
+
+    # 单次请求超过容量时按容量计算，不会永远等待
+    assert bucket.consume(1000) == 0.0
+
+
+def test_token_bucket_adjust():
+    """按实际用量修正：用量超出估算时透支，低于估算时返还"""
+    bucket = LocalTokenBucket(per_minute=600)
+    assert bucket.consume(600) == 0.0
+    bucket.adjust(60)  # 实际多用 60，透支 60
+    assert 6.9 < bucket.consume(10) <= 7.0
+    bucket.adjust(-120)  # 返还 120
+    assert bucket.consume(10) == 0.0
+
+
+def _wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+def test_priority_ordering():
+    """槽位释放后先分配给交互式请求，即使后台请求先到达；同优先级按到达顺序"""
+    limiter = PriorityConcurrencyLimiter(max_concurrency=1)
+    limiter.acquire(PRIORITY_INTERACTIVE)
+    order = []
+
+    def worker(label: str, priority: int) -> None:
+        limiter.acquire(priority, timeout=5)
+        order.append(label)
+        limiter.release()
+
+    threads = []
+    for label, priority in [
+        ("background-1", PRIORITY_BACKGROUND),
+        ("background-2", PRIORITY_BACKGROUND),
+        ("interactive", PRIORITY_INTERACTIVE),
+    ]:
+        thread = threading.Thread(target=worker, args=(label, priority))
+        thread.start()
+        threads.append(thread)
+        _wait_until(lambda count=len(threads): limiter.get_state()["queued"] == count)
+
+    limiter.release()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert order == ["interactive", "background-1", "background-2"], order
+    assert limiter.get_state() == {"in_use": 0, "queued": 0, "max_concurrency": 1}
+
+
+def test_queue_timeout():
+    """排队超时抛出 GatewayTimeoutError，并从队列中移除"""
+    limiter = PriorityConcurrencyLimiter(max_concurrency=1)
+    limiter.acquire(PRIORITY_INTERACTIVE)
+    try:
+        limiter.acquire(PRIORITY_BACKGROUND, timeout=0.05)
+    except GatewayTimeoutError:
+        pass
+    else:
+        raise AssertionError("acquire did not time out")
+    assert limiter.get_state()["queued"] == 0
+    limiter.release()
+
+
+def test_backoff_does_not_hold_slot():
+    """退避期间不占用并发槽位；退避超过排队截止时间时直接抛出 GatewayTimeoutError"""
+    gateway = LLMGateway("test-backoff", max_concurrency=1, shared=False, queue_timeout=5.0)
+    gateway._blocked_until = time.monotonic() + 0.3
+    admitted = threading.Event()
+
+    def worker() -> None:
+        with gateway.admit(estimated_tokens=10):
+            admitted.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.1)
+    assert not admitted.is_set()
+    assert gateway.limiter.get_state()["in_use"] == 0
+    thread.join(timeout=5)
+    assert admitted.is_set()
+
+    gateway = LLMGateway("test-backoff-timeout", max_concurrency=1, shared=False, queue_timeout=0.2)
+    gateway._blocked_until = time.monotonic() + 30
+    started_at = time.monotonic()
+    try:
+        with gateway.admit(estimated_tokens=10):
+            raise AssertionError("admitted while blocked")
+    except GatewayTimeoutError:
+        pass
+    assert time.monotonic() - started_at < 0.1
+    assert gateway.limiter.get_state()["in_use"] == 0
+
+
+def _rate_limit_error(retry_after: str) -> openai.RateLimitError:
+    request = httpx.Request("POST", "http://127.0.0.1:9/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_execute_retries_rate_limit():
+    """429 按 Retry-After 等待后重试；不可重试的错误直接抛出；超过重试次数后抛出最后的错误"""
+    gateway = LLMGateway("test-gateway", max_concurrency=1, shared=False, max_retries=2)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise _rate_limit_error("0.1")
+        return "ok"
+
+    assert gateway.execute(flaky, estimated_tokens=10) == "ok"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.09
+
+    calls = []
+
+    def invalid():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    try:
+        gateway.execute(invalid, estimated_tokens=10)
+    except ValueError:
+        pass
+    assert len(calls) == 1
+
+    def always_limited():
+        calls.append(1)
+        raise _rate_limit_error("0.01")
+
+    calls.clear()
+    try:
+        gateway.execute(always_limited, estimated_tokens=10)
+    except openai.RateLimitError:
+        pass
+    else:
+        raise AssertionError("rate limit error was swallowed")
+    assert len(calls) == gateway.max_retries + 1
+
+
+if __name__ == "__main__":
+    from app.observability.logger import default_logger as logger
+
+    tests = (
+        test_token_bucket_refill,
+        test_token_bucket_adjust,
+        test_priority_ordering,
+        test_queue_timeout,
+        test_backoff_does_not_hold_slot,
+        test_execute_retries_rate_limit,
+    )
+    try:
+        for test in tests:
+            test()
+            logger.info(f"✅ {test.__name__} 通过")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,244 @@
+"""
+LLM多端点路由测试
+使用不发出网络请求的假端点调用，检查按延迟与错误率排序、失败切换、熔断端点跳过、对冲请求，
+以及流式调用在首个片段前的失败切换与端点统计的记录
+"""
+import sys
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.llm_router import LLMEndpoint, LLMRouter
+
+
+def make_endpoint(label: str) -> LLMEndpoint:
+    """创建一个端点（名称唯一，避免共用熔断器与网关状态）；客户端不会被调用"""
+    return LLMEndpoint(
+        name=f"test-{label}-{uuid.uuid4().hex[:8]}",
+        provider="custom",
+        base_url="http://127.0.0.1:9/v1",
+        api_key="EMPTY",
+        model="test-model",
+    )
+
+
+def _record_samples(endpoint: LLMEndpoint, latency: float, count: int, failures: int = 0) -> None:
+    for number in range(count):
+        endpoint.stats.start()
+        endpoint.stats.record(latency, success=number >= failures)
+
+
+def test_rank_by_latency_and_errors():
+    """样本不足的端点按配置顺序优先探索；样本足够后按 p50 延迟与错误率排序"""
+    slow, fast, flaky = make_endpoint("slow"), make_endpoint("fast"), make_endpoint("flaky")
+    router = LLMRouter([slow, fast, flaky], min_samples=5)
+    assert router.rank() == [slow, fast, flaky]
+
+    _record_samples(slow, 2.0, 10)
+    _record_samples(fast, 0.5, 10)
+    # 延迟最低但一半失败：0.3 * (1 + 4 * 0.5) = 0.9，排在 fast 之后
+    _record_samples(flaky, 0.3, 10, failures=5)
+    assert router.rank() == [fast, flaky, slow]
+
+    exploring = make_endpoint("new")
+    router = LLMRouter([slow, fast, exploring], min_samples=5)
+    assert router.rank()[0] is exploring
+
+
+def test_execute_fails_over():
+    """端点调用失败时切换到下一个端点，失败计入该端点统计；全部失败时抛出最后的错误"""
+    broken, healthy = make_endpoint("broken"), make_endpoint("healthy")
+    router = LLMRouter([broken, healthy])
+
+    def call(endpoint: LLMEndpoint):
+        if endpoint is broken:
+            raise ConnectionError("connection refused")
+        return endpoint.name
+
+    assert router.execute(call) == healthy.name
+    assert broken.stats.snapshot()["error_rate"] == 1.0
+    assert healthy.stats.snapshot()["error_rate"] == 0.0
+
+    def always_fails(endpoint: LLMEndpoint):
+        raise ConnectionError(endpoint.name)
+
+    try:
+        router.execute(always_fails)
+    except ConnectionError as exc:
+        # 两个端点样本都不足，按配置顺序尝试，最后失败的是 healthy
+        assert str(exc) == healthy.name
+    else:
+        raise AssertionError("all endpoints failed but no error was raised")
+
+
+def test_open_breaker_is_skipped():
+    """熔断中的端点排在最后，调用直接跳过，不计入其延迟统计"""
+    tripped, healthy = make_endpoint("tripped"), make_endpoint("healthy")
+    request = httpx.Request("POST", "http://127.0.0.1:9/v1/chat/completions")
+    for _ in range(tripped.breaker.minimum_calls):
+        tripped.breaker.record_failure(openai.APIConnectionError(request=request))
+    assert tripped.breaker.is_rejecting()
+
+    router = LLMRouter([tripped, healthy])
+    assert router.rank() == [healthy, tripped]
+    calls = []
+    assert router.execute(lambda endpoint: calls.append(endpoint.name) or "ok") == "ok"
+    assert calls == [healthy.name]
+    assert tripped.stats.snapshot()["samples"] == 0
+    assert router.available()
+
+
+def test_hedged_request():
+    """主端点超过对冲延迟仍未返回时向次优端点发出相同请求，取先成功的结果"""
+    slow, fast = make_endpoint("hedge-slow"), make_endpoint("hedge-fast")
+    router = LLMRouter([slow, fast], hedge_min_delay=0.05, hedge_max_delay=0.1)
+    release = threading.Event()
+
+    def call(endpoint: LLMEndpoint):
+        if endpoint is slow:
+            release.wait(5)
+        return endpoint.name
+
+    started_at = time.monotonic()
+    try:
+        assert router.execute(call, hedge=True) == fast.name
+        assert time.monotonic() - started_at < 1.0
+    finally:
+        release.set()
+
+    # 主端点快速返回时不发出对冲请求
+    calls = []
+
+    def quick(endpoint: LLMEndpoint):
+        calls.append(endpoint.name)
+        return endpoint.name
+
+    router = LLMRouter([make_endpoint("hedge-quick"), make_endpoint("hedge-idle")], hedge_max_delay=1.0)
+    assert router.execute(quick, hedge=True) == calls[0]
+    assert len(calls) == 1
+
+
+def test_stream_fails_over_before_first_chunk():
+    """主端点在首个片段前失败时切换到次优端点，失败与首片段延迟分别计入两个端点的统计"""
+    broken, healthy = make_endpoint("broken"), make_endpoint("healthy")
+    router = LLMRouter([broken, healthy])
+    calls = []
+
+    def call(endpoint: LLMEndpoint):
+        calls.append(endpoint.name)
+        if endpoint is broken:
+            raise ConnectionError("connection refused")
+        yield "你"
+        yield "好"
+
+    assert list(router.stream(call)) == ["你", "好"]
+    assert calls == [broken.name, healthy.name]
+
+    broken_stats, healthy_stats = broken.stats.snapshot(), healthy.stats.snapshot()
+    assert broken_stats["samples"] == 1 and broken_stats["error_rate"] == 1.0, broken_stats
+    assert healthy_stats["samples"] == 1 and healthy_stats["error_rate"] == 0.0, healthy_stats
+    assert broken_stats["in_flight"] == 0 and healthy_stats["in_flight"] == 0
+
+
+def test_stream_error_after_first_chunk_is_not_retried():
+    """已输出片段后失败不能切换（调用方已收到部分内容），计为该端点的错误后抛出"""
+    flaky, backup = make_endpoint("flaky"), make_endpoint("backup")
+    router = LLMRouter([flaky, backup])
+    calls = []
+
+    def call(endpoint: LLMEndpoint):
+        calls.append(endpoint.name)
+        yield "部分"
+        raise ConnectionError("stream reset")
+
+    received = []
+    try:
+        for chunk in router.stream(call):
+            received.append(chunk)
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("mid-stream error was swallowed")
+
+    assert received == ["部分"]
+    assert calls == [flaky.name]
+    assert flaky.stats.snapshot()["error_rate"] == 1.0
+    assert backup.stats.snapshot()["samples"] == 0
+
+
+def test_stream_consumer_stop_counts_as_success():
+    """调用方提前停止读取不算端点错误"""
+    endpoint = make_endpoint("single")
+    router = LLMRouter([endpoint])
+
+    def call(_endpoint: LLMEndpoint):
+        for number in range(10):
+            yield str(number)
+
+    stream = router.stream(call)
+    assert next(stream) == "0"
+    stream.close()
+    stats = endpoint.stats.snapshot()
+    assert stats["samples"] == 1 and stats["error_rate"] == 0.0 and stats["in_flight"] == 0, stats
+
+
+def test_think_fails_over_through_router():
+    """LLMService.think 通过路由器流式调用：首个端点建立连接失败时由次优端点输出"""
+    from app.services.llm_service import LLMService
+
+    def chunk(content):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+    def refuse(**_params):
+        raise ConnectionError("connection refused")
+
+    requested = []
+
+    def stream(**params):
+        requested.append(params)
+        return iter([chunk("北京"), chunk(""), chunk("三日游")])
+
+    broken, healthy = make_endpoint("think-broken"), make_endpoint("think-healthy")
+    broken.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=refuse)))
+    healthy.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=stream)))
+
+    service = LLMService()
+    service.router = LLMRouter([broken, healthy])
+    output = "".join(service.think([{"role": "user", "content": "规划行程"}]))
+
+    assert output == "北京三日游"
+    assert len(requested) == 1 and requested[0]["stream"] is True
+    assert broken.stats.snapshot()["error_rate"] == 1.0
+    assert healthy.stats.snapshot()["samples"] == 1
+
+
+if __name__ == "__main__":
+    from app.observability.logger import default_logger as logger
+
+    tests = (
+        test_rank_by_latency_and_errors,
+        test_execute_fails_over,
+        test_open_breaker_is_skipped,
+        test_hedged_request,
+        test_stream_fails_over_before_first_chunk,
+        test_stream_error_after_first_chunk_is_not_retried,
+        test_stream_consumer_stop_counts_as_success,
+        test_think_fails_over_through_router,
+    )
+    try:
+        for test in tests:
+            test()
+            logger.info(f"✅ {test.__name__} 通过")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
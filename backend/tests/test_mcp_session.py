@@ -0,0 +1,150 @@
+"""
+MCP长连接会话与熔断测试
+用假会话代替真实连接，检查复用的会话只在传输层错误时重建并重试，工具调用错误直接抛出且保留会话，
+以及服务器熔断只统计连接失败与超时
+"""
+import asyncio
+import sys
+import traceback
+from pathlib import Path
+
+import anyio
+import httpx
+
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.middleware.circuit_breaker import CircuitBreaker, CircuitState
+from app.tools.mcp_tool import MCP_FAILURE_EXCEPTIONS, MCPTool, is_session_closed_error
+
+
+class FakeSessionTool:
+    """只包含 _with_client 所需属性的工具对象；每次建立会话编号加一"""
+
+    persistent_session = True
+    _server_identity = ["http://127.0.0.1:8001/mcp"]
+    _with_client = MCPTool._with_client
+
+    def __init__(self):
+        self._session = None
+        self.opened = 0
+        self.closed = 0
+
+    async def _get_session(self):
+        if self._session is None:
+            self.opened += 1
+            self._session = f"session-{self.opened}"
+        return self._session
+
+    async def _close_session(self):
+        self.closed += 1
+        self._session = None
+
+
+def _run(tool: FakeSessionTool, operation):
+    return asyncio.run(tool._with_client(operation))
+
+
+def test_transport_error_reconnects_reused_session():
+    """复用的会话遇到传输层错误时关闭会话，重建后重试一次"""
+    tool = FakeSessionTool()
+    assert _run(tool, lambda session: asyncio.sleep(0, session)) == "session-1"
+
+    calls = []
+
+    async def operation(session):
+        calls.append(session)
+        if session == "session-1":
+            raise httpx.RemoteProtocolError("server disconnected")
+        return "ok"
+
+    assert _run(tool, operation) == "ok"
+    assert calls == ["session-1", "session-2"]
+    assert (tool.opened, tool.closed) == (2, 1)
+
+
+def test_tool_error_keeps_session():
+    """工具调用错误（参数错误、配额用尽等）说明会话可用：直接抛出，不关闭也不重试"""
+    tool = FakeSessionTool()
+    _run(tool, lambda session: asyncio.sleep(0))
+    calls = []
+
+    async def operation(session):
+        calls.append(session)
+        raise RuntimeError("amap quota exceeded")
+
+    try:
+        _run(tool, operation)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("tool error was swallowed")
+    assert calls == ["session-1"]
+    assert tool._session == "session-1" and tool.closed == 0
+
+
+def test_new_session_failure_is_not_retried():
+    """新建的会话第一次调用就遇到传输层错误时关闭会话并抛出，不再重试"""
+    tool = FakeSessionTool()
+    calls = []
+
+    async def operation(session):
+        calls.append(session)
+        raise anyio.ClosedResourceError()
+
+    try:
+        _run(tool, operation)
+    except anyio.ClosedResourceError:
+        pass
+    else:
+        raise AssertionError("transport error was swallowed")
+    assert calls == ["session-1"]
+    assert tool._session is None and tool.closed == 1
+
+
+def test_is_session_closed_error():
+    """传输层错误与 anyio 流关闭错误视为会话不可用，其他异常不是"""
+    request = httpx.Request("POST", "http://127.0.0.1:8001/mcp")
+    assert is_session_closed_error(httpx.ConnectError("refused", request=request))
+    assert is_session_closed_error(httpx.ReadTimeout("timed out", request=request))
+    assert is_session_closed_error(anyio.BrokenResourceError())
+    assert not is_session_closed_error(ValueError("bad arguments"))
+    assert not is_session_closed_error(httpx.HTTPStatusError(
+        "bad request", request=request, response=httpx.Response(400, request=request)
+    ))
+
+
+def test_breaker_counts_only_transport_failures():
+    """工具调用错误不计入服务器熔断；连接失败与超时计入"""
+    breaker = CircuitBreaker("test-mcp", minimum_calls=4, failure_exceptions=MCP_FAILURE_EXCEPTIONS)
+    for _ in range(8):
+        breaker.record_failure(RuntimeError("amap quota exceeded"))
+    assert breaker.state == CircuitState.CLOSED
+
+    request = httpx.Request("POST", "http://127.0.0.1:8001/mcp")
+    breaker.reset()
+    breaker.record_failure(httpx.ConnectError("refused", request=request))
+    breaker.record_failure(httpx.ReadTimeout("timed out", request=request))
+    breaker.record_failure(TimeoutError("协程执行超过 30 秒"))
+    breaker.record_failure(anyio.ClosedResourceError())
+    assert breaker.state == CircuitState.OPEN
+
+
+if __name__ == "__main__":
+    from app.observability.logger import default_logger as logger
+
+    tests = (
+        test_transport_error_reconnects_reused_session,
+        test_tool_error_keeps_session,
+        test_new_session_failure_is_not_retried,
+        test_is_session_closed_error,
+        test_breaker_counts_only_transport_failures,
+    )
+    try:
+        for test in tests:
+            test()
+            logger.info(f"✅ {test.__name__} 通过")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,79 @@
+"""
+行程JSON容错解析测试
+检查 loads_tolerant 对代码块、前后多余文本、尾随逗号和各种截断位置的修复，
+以及 parse_plan 对截断输出按天标记需要重新生成的天
+"""
+import sys
+import traceback
+from pathlib import Path
+
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.agents.plan_parser import loads_tolerant, parse_plan
+
+# (说明, 模型输出, 期望解析结果)
+REPAIR_CASES = [
+    ("标准JSON", '{"a": 1}', {"a": 1}),
+    ("代码块", '```json\n{"a": [1, 2]}\n```', {"a": [1, 2]}),
+    ("未闭合的代码块", '```json\n{"a": 1}', {"a": 1}),
+    ("前后多余文本", '好的，以下是行程：{"a": 1} 希望对你有帮助', {"a": 1}),
+    ("尾随逗号", '{"a": [1, 2,], "b": {"c": 3,},}', {"a": [1, 2], "b": {"c": 3}}),
+    ("多余的闭合括号", '{"a": 1}}]', {"a": 1}),
+    ("截断在字符串中", '{"title": "北京三日', {"title": "北京三日"}),
+    ("截断在转义符后", '{"title": "他说\\', {"title": "他说"}),
+    ("截断在数组中", '{"days": [{"day": 1, "items": ["故宫", "天坛"', {"days": [{"day": 1, "items": ["故宫", "天坛"]}]}),
+    ("悬空的逗号", '{"a": [1, 2,', {"a": [1, 2]}),
+    ("悬空的冒号", '{"a": 1, "b":', {"a": 1, "b": None}),
+    ("孤立的键", '{"a": 1, "b"', {"a": 1}),
+    ("只有键的对象", '{"days": [{"day"', {"days": [{}]}),
+    ("字符串中的括号不计入", '{"a": "}{][", "b": [', {"a": "}{][", "b": []}),
+]
+
+
+def test_loads_tolerant_repairs():
+    """常见缺陷都能修复为预期的对象"""
+    for description, text, expected in REPAIR_CASES:
+        assert loads_tolerant(text) == expected, (description, text)
+
+
+def test_loads_tolerant_rejects_non_json():
+    """无法修复的输出抛出 ValueError"""
+    for text in ["", "抱歉，我无法生成行程", '{"a": tru']:
+        try:
+            loads_tolerant(text)
+        except ValueError:
+            continue
+        raise AssertionError(f"expected ValueError for {text!r}")
+
+
+def test_parse_plan_marks_truncated_day():
+    """输出截断时，已完整的天保留，最后一天与缺失的天需要重新生成"""
+    text = (
+        '```json\n{"trip_title": "北京三日游", "total_budget": {}, "hotels": [], "days": ['
+        '{"day": 1, "theme": "故宫", "attractions": [], "dinings": []},'
+        '{"day": 2, "theme": "长城", "attractions": ['
+    )
+    result = parse_plan(text, expected_days=3)
+
+    assert result.trip_title == "北京三日游"
+    assert sorted(result.days) == [1]
+    assert result.failed_days == {2: "truncated", 3: "missing"}
+
+
+if __name__ == "__main__":
+    from app.observability.logger import default_logger as logger
+
+    tests = (
+        test_loads_tolerant_repairs,
+        test_loads_tolerant_rejects_non_json,
+        test_parse_plan_marks_truncated_day,
+    )
+    try:
+        for test in tests:
+            test()
+            logger.info(f"✅ {test.__name__} 通过")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,228 @@
+"""
+LLM语义缓存测试
+用固定向量代替嵌入模型，检查相似度阈值、作用域隔离、过期与容量淘汰，
+以及结构化整理中日期相关角色不使用语义缓存、请求信息（目的地、日期）进入作用域
+"""
+import sys
+import traceback
+import uuid
+import zlib
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models.trip_model import TripPlanRequest
+from app.services.llm_cache import CachePolicy
+from app.services.llm_router import LLMEndpoint, LLMRouter
+from app.services.semantic_cache import SemanticLLMCache
+
+DIM = 16
+THRESHOLD = 0.95
+
+
+class FakeEmbedder:
+    """按文本返回固定的归一化向量；未登记的文本按 CRC32 生成随机向量"""
+
+    def __init__(self):
+        self.vectors = {}
+
+    def register(self, text: str, vector: np.ndarray) -> None:
+        self.vectors[text] = vector / np.linalg.norm(vector)
+
+    def embed_text(self, text: str) -> np.ndarray:
+        if text in self.vectors:
+            return self.vectors[text]
+        vector = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(DIM)
+        return (vector / np.linalg.norm(vector)).astype("float32")
+
+
+def _base_vector() -> np.ndarray:
+    return np.eye(DIM, dtype="float32")[0]
+
+
+def _make_cache(max_entries: int = 100):
+    embedder = FakeEmbedder()
+    return SemanticLLMCache(THRESHOLD, max_entries, memory_service=embedder), embedder
+
+
+def test_similarity_threshold():
+    """相似度达到阈值时命中，低于阈值时未命中"""
+    cache, embedder = _make_cache()
+    near = _base_vector().copy()
+    near[1] = 0.2  # 余弦相似度约 0.98
+    far = _base_vector().copy()
+    far[1] = 0.6  # 余弦相似度约 0.86
+    embedder.register("故宫开放时间 8:30-17:00", _base_vector())
+    embedder.register("故宫开放时间为 8:30 至 17:00", near)
+    embedder.register("故宫周一闭馆", far)
+
+    scope = SemanticLLMCache.build_scope("test", "model-a", [], 0.2, 512)
+    cache.add(scope, cache.embed("故宫开放时间 8:30-17:00"), "整理结果", {"total_tokens": 40}, 3600)
+
+    assert cache.lookup(scope, cache.embed("故宫开放时间为 8:30 至 17:00")) == "整理结果"
+    assert cache.lookup(scope, cache.embed("故宫周一闭馆")) is None
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["saved_total_tokens"]) == (1, 1, 40), stats
+
+
+def test_scope_isolation():
+    """调用点、模型、上下文消息或透传参数不同时属于不同作用域，相同文本也不会命中"""
+    cache, _ = _make_cache()
+    context, user_text = SemanticLLMCache.split_prompt([
+        {"role": "system", "content": "整理规则"},
+        {"role": "user", "content": "目的地: 北京"},
+        {"role": "user", "content": "原始结果"},
+    ])
+    assert user_text == "原始结果"
+    assert context == [{"role": "system", "content": "整理规则"}, {"role": "user", "content": "目的地: 北京"}]
+
+    scope = SemanticLLMCache.build_scope("synthesis:attraction_agent", "model-a", context, 0.2, 512)
+    cache.add(scope, cache.embed(user_text), "北京的整理结果", {}, 3600)
+    assert cache.lookup(scope, cache.embed(user_text)) == "北京的整理结果"
+
+    other_scopes = [
+        SemanticLLMCache.build_scope("synthesis:food_agent", "model-a", context, 0.2, 512),
+        SemanticLLMCache.build_scope("synthesis:attraction_agent", "model-b", context, 0.2, 512),
+        SemanticLLMCache.build_scope(
+            "synthesis:attraction_agent",
+            "model-a",
+            [{"role": "system", "content": "整理规则"}, {"role": "user", "content": "目的地: 上海"}],
+            0.2,
+            512,
+        ),
+        SemanticLLMCache.build_scope(
+            "synthesis:attraction_agent", "model-a", context, 0.2, 512, extra_params={"top_p": 0.5}
+        ),
+    ]
+    for other in other_scopes:
+        assert other != scope
+        assert cache.lookup(other, cache.embed(user_text)) is None
+
+
+def test_expiry_and_compaction():
+    """过期条目不命中；作用域超过容量时只保留最新的一半条目"""
+    cache, _ = _make_cache(max_entries=4)
+    scope = SemanticLLMCache.build_scope("test", "model-a", [], 0.2, 512)
+
+    cache.add(scope, cache.embed("已过期"), "旧结果", {}, -1)
+    assert cache.lookup(scope, cache.embed("已过期")) is None
+
+    # 第 5 条（含过期条目）写入时超过容量：丢弃过期条目，保留最新的 2 条，再写入 1 条
+    for number in range(5):
+        cache.add(scope, cache.embed(f"条目 {number}"), f"结果 {number}", {}, 3600)
+    assert cache.get_stats()["entries"] == 3
+    assert cache.lookup(scope, cache.embed("条目 2")) == "结果 2"
+    assert cache.lookup(scope, cache.embed("条目 4")) == "结果 4"
+    assert cache.lookup(scope, cache.embed("条目 1")) is None
+
+
+def _synthesis_policies(role_name: str, request: TripPlanRequest, raw_result: str):
+    """以假的 LLM 调用结构化整理，返回传入的消息与缓存策略"""
+    from app.agents.planner import PlannerAgent
+
+    captured = {}
+
+    def invoke(messages, **kwargs):
+        captured["messages"] = messages
+        captured["policy"] = kwargs["cache_policy"]
+        return "{}"
+
+    fake_planner = SimpleNamespace(llm=SimpleNamespace(invoke=invoke))
+    PlannerAgent._synthesize_agent_output(
+        fake_planner, role_name=role_name, raw_result=raw_result, request=request, output_schema="{}"
+    )
+    return captured["messages"], captured["policy"]
+
+
+def test_synthesis_cache_policy():
+    """天气等日期相关角色不开启语义缓存；其余角色只对原始结果做检索，目的地与日期进入作用域"""
+    request = TripPlanRequest(destination="北京", start_date="2026-05-01", end_date="2026-05-03")
+    later = TripPlanRequest(destination="北京", start_date="2026-10-01", end_date="2026-10-03")
+
+    _, weather_policy = _synthesis_policies("weather_agent", request, "晴 25℃")
+    assert weather_policy.semantic is False
+
+    messages, policy = _synthesis_policies("attraction_agent", request, "故宫、天坛")
+    later_messages, _ = _synthesis_policies("attraction_agent", later, "故宫、天坛")
+    assert policy.semantic is True
+
+    context, user_text = SemanticLLMCache.split_prompt(messages)
+    later_context, later_user_text = SemanticLLMCache.split_prompt(later_messages)
+    assert user_text == later_user_text and "故宫、天坛" in user_text
+    assert "2026-05-01" not in user_text
+    assert any("2026-05-01" in message["content"] and "北京" in message["content"] for message in context)
+    assert (
+        SemanticLLMCache.build_scope(policy.namespace, "model-a", context, 0.2, 512)
+        != SemanticLLMCache.build_scope(policy.namespace, "model-a", later_context, 0.2, 512)
+    )
+
+
+def test_invoke_semantic_hit():
+    """LLMService.invoke 在精确缓存未命中后查询语义缓存，相近的原始结果复用已有回答"""
+    from app.services.llm_service import LLMService
+
+    calls = []
+
+    def create(**params):
+        calls.append(params)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=f"第 {len(calls)} 次回答"))],
+            usage=None,
+        )
+
+    endpoint = LLMEndpoint(
+        name=f"test-semantic-{uuid.uuid4().hex[:8]}",
+        provider="custom",
+        base_url="http://127.0.0.1:9/v1",
+        api_key="EMPTY",
+        model="test-model",
+    )
+    endpoint.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    cache, embedder = _make_cache()
+    near = _base_vector().copy()
+    near[1] = 0.2
+    embedder.register("原始结果: 故宫、天坛", _base_vector())
+    embedder.register("原始结果: 故宫 天坛", near)
+
+    service = LLMService()
+    service.router = LLMRouter([endpoint])
+    service.response_cache = None
+    service.semantic_cache = cache
+    system = {"role": "system", "content": "整理规则"}
+
+    def ask(text, semantic=True):
+        return service.invoke(
+            [system, {"role": "user", "content": text}],
+            model="test-model",
+            cache_policy=CachePolicy(namespace="synthesis:attraction_agent", semantic=semantic),
+        )
+
+    assert ask("原始结果: 故宫、天坛") == "第 1 次回答"
+    assert ask("原始结果: 故宫 天坛") == "第 1 次回答"
+    assert ask("原始结果: 故宫 天坛", semantic=False) == "第 2 次回答"
+    assert len(calls) == 2
+
+
+if __name__ == "__main__":
+    from app.observability.logger import default_logger as logger
+
+    tests = (
+        test_similarity_threshold,
+        test_scope_isolation,
+        test_expiry_and_compaction,
+        test_synthesis_cache_policy,
+        test_invoke_semantic_hit,
+    )
+    try:
+        for test in tests:
+            test()
+            logger.info(f"✅ {test.__name__} 通过")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,74 @@
+"""
+压缩向量存储测试
+在几百条合成向量上检查：sq_fp16 的 recall@10 接近精确检索，PQ 候选按原始向量重排后召回率高于只用 PQ
+（大规模的内存与耗时对比见 benchmarks/vector_compression.py）
+"""
+import sys
+import traceback
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings
+from app.services.vector_compression import build_compressed_index, bytes_per_vector, min_training_vectors
+from benchmarks.vector_compression import TOP_K, make_queries, make_vectors, recall, rerank
+
+VECTOR_COUNT = 800
+QUERY_COUNT = 50
+RERANK_FACTOR = 4
+# 几百条向量不足以训练 8 位码本，测试 PQ 时使用 4 位（每个子空间 16 个中心）
+PQ_NBITS = 4
+
+
+def _dataset():
+    vectors = make_vectors(VECTOR_COUNT, settings.VECTOR_DIM, clusters=20)
+    queries = make_queries(vectors, QUERY_COUNT)
+    exact_index = faiss.IndexFlatIP(settings.VECTOR_DIM)
+    exact_index.add(vectors)
+    _, exact = exact_index.search(queries, TOP_K)
+    return vectors, queries, exact
+
+
+def test_sq_fp16_recall():
+    """fp16 标量量化每条向量减半，recall@10 不低于 0.99"""
+    vectors, queries, exact = _dataset()
+    index = build_compressed_index(vectors, np.arange(len(vectors), dtype='int64'), "sq_fp16")
+    _, labels = index.search(queries, TOP_K)
+
+    assert bytes_per_vector(index) == settings.VECTOR_DIM * 2
+    assert recall(labels, exact) >= 0.99
+
+
+def test_pq_rerank_beats_pq():
+    """PQ 取 10 * 倍数个候选再按原始向量重排，召回率高于直接使用 PQ 的近似分数"""
+    vectors, queries, exact = _dataset()
+    nbits = settings.VECTOR_PQ_NBITS
+    settings.VECTOR_PQ_NBITS = PQ_NBITS
+    try:
+        assert len(vectors) >= min_training_vectors("pq")
+        index = build_compressed_index(vectors, np.arange(len(vectors), dtype='int64'), "pq")
+    finally:
+        settings.VECTOR_PQ_NBITS = nbits
+    _, labels = index.search(queries, TOP_K)
+    _, candidates = index.search(queries, TOP_K * RERANK_FACTOR)
+
+    pq_recall = recall(labels, exact)
+    reranked_recall = recall(rerank(vectors, queries, candidates, TOP_K), exact)
+    assert reranked_recall > pq_recall, (pq_recall, reranked_recall)
+
+
+if __name__ == "__main__":
+    from app.observability.logger import default_logger as logger
+
+    try:
+        for test in (test_sq_fp16_recall, test_pq_rerank_beats_pq):
+            test()
+            logger.info(f"✅ {test.__name__} 通过")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,143 @@
+"""
+向量记忆崩溃恢复测试
+在子进程中写入记忆后直接退出（不写快照，相当于进程被杀），再启动新进程重放预写日志，
+检查记忆条数、按用户查询的ID是否重复；并覆盖日志记录重复、写快照中途退出两种情况
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import traceback
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+# 将 backend 目录添加到Python路径
+sys.path.insert(0, str(BACKEND_DIR))
+
+USERS = ["recovery_user_0", "recovery_user_1", "recovery_user_2", "recovery_user_3"]
+MEMORIES_PER_USER = 25
+KNOWLEDGE_COUNT = 10
+EXTRA_MEMORIES = 20
+
+
+def _child_main(phase: str, work_dir: str) -> None:
+    """子进程入口：在 work_dir 下创建向量记忆服务并执行一个阶段"""
+    # 先在 backend 目录下读取 .env，再切换到临时目录，记忆目录 vector_memory 位于临时目录中
+    from app.config import settings  # noqa: F401
+    os.chdir(work_dir)
+    from app.services.vector_memory_service import vector_memory_service as service
+
+    if phase == "write":
+        for user_id in USERS:
+            for number in range(MEMORIES_PER_USER):
+                service.store_user_preference(user_id, "food", {"dish": f"{user_id} 的第 {number} 道菜"})
+        for number in range(KNOWLEDGE_COUNT):
+            service.store_destination_knowledge(f"城市{number}", {"tips": f"第 {number} 条目的地知识"})
+    elif phase == "snapshot_crash":
+        for number in range(EXTRA_MEMORIES):
+            service.store_user_preference(USERS[0], "hotel", {"hotel": f"第 {number} 家酒店"})
+        write_file = service._write_file
+
+        def crash_before_current(path, data):
+            # 索引与元数据已写入，替换 CURRENT 之前退出
+            if path.name == "CURRENT":
+                os._exit(0)
+            write_file(path, data)
+
+        service._write_file = crash_before_current
+        service.save()
+    elif phase == "compact":
+        service.save()
+
+    user_ids = {user_id: service.user_metadata.ids_for_user(user_id) for user_id in USERS}
+    result = {
+        "user_memory_count": service.get_stats()["user_memory_count"],
+        "knowledge_memory_count": service.get_stats()["knowledge_memory_count"],
+        "user_metadata_count": len(service.user_metadata),
+        "knowledge_metadata_count": len(service.knowledge_metadata),
+        "ids_per_user": {user_id: len(ids) for user_id, ids in user_ids.items()},
+        "duplicate_ids": sum(len(ids) - len(set(ids)) for ids in user_ids.values()),
+        "search_results": len(service.retrieve_user_memories(USERS[1], "第 3 道菜", limit=5)),
+        "wal_bytes": service.get_stats()["wal_bytes"],
+    }
+    print("RESULT " + json.dumps(result, ensure_ascii=False), flush=True)
+    # 不等待后台线程与退出清理，模拟进程被直接杀掉
+    os._exit(0)
+
+
+def _run_phase(phase: str, work_dir: str, expect_result: bool = True) -> dict:
+    completed = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), "--child", phase, work_dir],
+        cwd=str(BACKEND_DIR),
+        capture_output=True,
+        text=True,
+        timeout=600,
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    if not expect_result:
+        return {}
+    raise AssertionError(f"phase {phase} produced no result:\n{completed.stdout[-2000:]}\n{completed.stderr[-2000:]}")
+
+
+def _assert_counts(result: dict, user_memories: int, extra_for_first_user: int = 0) -> None:
+    assert result["user_memory_count"] == user_memories, result
+    assert result["user_metadata_count"] == user_memories, result
+    assert result["knowledge_memory_count"] == KNOWLEDGE_COUNT, result
+    assert result["knowledge_metadata_count"] == KNOWLEDGE_COUNT, result
+    assert result["duplicate_ids"] == 0, result
+    expected = {user_id: MEMORIES_PER_USER for user_id in USERS}
+    expected[USERS[0]] += extra_for_first_user
+    assert result["ids_per_user"] == expected, result
+    assert result["search_results"] == 5, result
+
+
+def test_wal_replay_after_crash():
+    """写入后不写快照直接退出，重启后从预写日志恢复；重复重放、日志记录重复都不产生重复记忆"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        total = len(USERS) * MEMORIES_PER_USER
+        _run_phase("write", work_dir)
+
+        _assert_counts(_run_phase("verify", work_dir), total)
+        # 再次重启，同一份日志重放第二次
+        _assert_counts(_run_phase("verify", work_dir), total)
+
+        # 日志中每条记录都出现两次（如写快照中断后日志与快照重叠）
+        wal_path = Path(work_dir) / "vector_memory" / "wal.log"
+        wal_path.write_bytes(wal_path.read_bytes() * 2)
+        _assert_counts(_run_phase("verify", work_dir), total)
+
+
+def test_crash_during_snapshot():
+    """写快照时在替换 CURRENT 之前退出，重启后仍从旧快照加日志恢复，压缩后条数不变"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        total = len(USERS) * MEMORIES_PER_USER
+        _run_phase("write", work_dir)
+        _run_phase("compact", work_dir)
+
+        # 该阶段在写快照途中退出，没有结果输出
+        _run_phase("snapshot_crash", work_dir, expect_result=False)
+        _assert_counts(_run_phase("verify", work_dir), total + EXTRA_MEMORIES, EXTRA_MEMORIES)
+
+        result = _run_phase("compact", work_dir)
+        _assert_counts(result, total + EXTRA_MEMORIES, EXTRA_MEMORIES)
+        assert result["wal_bytes"] == 0, result
+        _assert_counts(_run_phase("verify", work_dir), total + EXTRA_MEMORIES, EXTRA_MEMORIES)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        _child_main(sys.argv[2], sys.argv[3])
+
+    from app.observability.logger import default_logger as logger
+
+    try:
+        for test in (test_wal_replay_after_crash, test_crash_during_snapshot):
+            test()
+            logger.info(f"✅ {test.__name__} 通过")
+    except Exception as e:
+        logger.error(f"\n❌ 测试失败: {e}")
+        logger.error(traceback.format_exc())
+        sys.exit(1)
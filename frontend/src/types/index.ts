@@ -98,6 +98,7 @@ export interface TripPlanResponse {
   version?: number
   city_support_level?: string
   city_support_message?: string
+  degraded?: boolean
   trip_title: string
   total_budget: BudgetBreakdown
   hotels: Hotel[]